@@ -0,0 +1,23 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def tight_cache_dir(tmpdir, monkeypatch):
+    """ Keep machine level caches out of the user's home directory. """
+    cache_dir = '{}/tight-cache'.format(tmpdir)
+    monkeypatch.setenv('TIGHT_CACHE_DIR', cache_dir)
+    return cache_dir
@@ -12,7 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
+import json
 import os
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
 import yaml
 from click.testing import CliRunner
 from tight_cli import cli
@@ -58,6 +66,97 @@ def test_generate_function_verify_structure(tmpdir):
     assert generate_function_result.output == u'Usage: function [OPTIONS] NAME\n\nError: Invalid value for NAME: Function already exists!\n'
 
 
+def test_generate_function_scoped_tests(tmpdir, monkeypatch):
+    runner = CliRunner()
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    app_root = '{}/my_service'.format(tmpdir)
+    commands = []
+    monkeypatch.setattr(cli, 'run_command', lambda command, **kwargs: commands.append(command) or 0)
+
+    result = runner.invoke(cli.function, ['orders', '--target={}'.format(app_root)])
+    assert result.exit_code == 0, result.output
+    assert commands == [['py.test', '{}/tests/functions/unit/orders'.format(app_root),
+                         '{}/tests/functions/integration/orders'.format(app_root)]], 'Only the new tests run.'
+    assert 'Check (scoped) passed in' in result.output
+
+    result = runner.invoke(cli.function, ['accounts', '--target={}'.format(app_root), '--tests=smoke'])
+    assert commands[-1] == [sys.executable, '-c', 'import app.functions.accounts.handler']
+    result = runner.invoke(cli.function, ['users', '--target={}'.format(app_root), '--tests=none'])
+    assert len(commands) == 2 and 'Check' not in result.output
+
+
+# Stands in for the vendored tight runtime the starter's handlers import;
+# like the real client, connect() reads the region at import time.
+FAKE_TIGHT = {
+    'tight/__init__.py': '',
+    'tight/providers/__init__.py': '',
+    'tight/providers/aws/__init__.py': '',
+    'tight/providers/aws/clients/__init__.py': '',
+    'tight/providers/aws/clients/dynamo_db.py': 'import os\ndef connect():\n    return os.environ["AWS_REGION"], os.environ["USE_LOCAL_DB"]\n',
+    'tight/providers/aws/controllers/__init__.py': '',
+    'tight/providers/aws/controllers/lambda_proxy_event.py': 'get = post = put = patch = options = delete = lambda function: function\n',
+}
+
+
+def test_generate_function_smoke(tmpdir, monkeypatch):
+    runner = CliRunner()
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    app_root = '{}/my_service'.format(tmpdir)
+    for path, contents in FAKE_TIGHT.items():
+        os.makedirs(os.path.dirname('{}/app/vendored/{}'.format(app_root, path)), exist_ok=True)
+        with open('{}/app/vendored/{}'.format(app_root, path), 'w') as source:
+            source.write(contents)
+    for name in ['AWS_REGION', 'USE_LOCAL_DB']:
+        monkeypatch.delenv(name, raising=False)
+    result = runner.invoke(cli.function, ['orders', '--target={}'.format(app_root), '--tests=smoke'])
+    assert result.exit_code == 0, result.output
+    assert 'Check (smoke) passed' in result.output, 'Handlers import with the conftest defaults and no env.yml.'
+
+
+def test_generate_batch(tmpdir, monkeypatch):
+    runner = CliRunner()
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    app_root = '{}/my_service'.format(tmpdir)
+    commands = []
+    monkeypatch.setattr(cli, 'run_command', lambda command, **kwargs: commands.append(command) or 0)
+    manifest = '{}/manifest.yml'.format(tmpdir)
+    with open(manifest, 'w') as manifest_file:
+        yaml.safe_dump({'functions': ['accounts'], 'models': ['account', 'order_item']}, manifest_file)
+
+    result = runner.invoke(cli.batch, ['orders', '--target={}'.format(app_root), '--manifest={}'.format(manifest)])
+    assert result.exit_code == 0, result.output
+    assert 'Generated 2 functions and 2 models (12 files)' in result.output
+    for path in ['app/functions/orders/handler.py', 'app/functions/accounts/handler.py',
+                 'tests/functions/unit/accounts/test_unit_accounts.py',
+                 'tests/functions/integration/orders/expectations/test_get_method.yml',
+                 'app/models/Account.py', 'app/models/OrderItem.py']:
+        assert os.path.isfile('{}/{}'.format(app_root, path)), '{} is generated'.format(path)
+    with open('{}/app/models/_index.py'.format(app_root)) as index_file:
+        assert "'OrderItem': 'OrderItem'," in index_file.read()
+    assert len(commands) == 1, 'One check runs for the whole batch.'
+    assert commands[0][0] == 'py.test' and len(commands[0]) == 5
+
+    result = runner.invoke(cli.batch, ['orders', 'users', 'users', '--target={}'.format(app_root)])
+    assert result.exit_code == 2
+    assert 'orders, users' in result.output
+    assert not os.path.exists('{}/app/functions/users'.format(app_root)), 'Nothing is written when a name is invalid.'
+
+
+def test_generate_function_project_template_override(tmpdir):
+    runner = CliRunner()
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    app_root = '{}/{}'.format(tmpdir, 'my_service')
+    os.mkdir('{}/templates'.format(app_root))
+    with open('{}/templates/lambda_proxy_controller.jinja2'.format(app_root), 'w') as override:
+        override.write('# custom handler')
+    result = runner.invoke(cli.function, ['my_controller', '--target={}'.format(app_root)])
+    assert result.exit_code == 0
+    with open('{}/app/functions/my_controller/handler.py'.format(app_root)) as handler:
+        assert handler.read() == '# custom handler', 'Project-local template takes precedence.'
+    with open('{}/tests/functions/unit/my_controller/test_unit_my_controller.py'.format(app_root)) as unit_test:
+        assert 'app.functions.my_controller.handler' in unit_test.read(), 'Packaged templates are used when not overridden.'
+
+
 def test_generate_model_and_schema(tmpdir):
     here = os.path.dirname(os.path.realpath(__file__))
     runner = CliRunner()
@@ -70,26 +169,452 @@ def test_generate_model_and_schema(tmpdir):
     assert os.path.isfile(model_location)
     runner.invoke(cli.generateschema, ['--target={}/{}'.format(tmpdir, app_dir)])
     with open('{}/../fixtures/my-models.yml'.format(here)) as yaml_fixture:
-        yaml_fixture_dict = yaml.load(yaml_fixture)
+        yaml_fixture_dict = yaml.safe_load(yaml_fixture)
     with open('{}/{}/schemas/dynamo/my-models.yml'.format(tmpdir, app_dir)) as result_yaml:
-        result_yaml_dict = yaml.load(result_yaml)
+        result_yaml_dict = yaml.safe_load(result_yaml)
     assert yaml_fixture_dict == result_yaml_dict, 'Correct schema generated for model.'
 
 
+def build_artifact(runner, app_dir_path, *args):
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path)] + list(args))
+    assert result.exit_code == 0, result.output
+    artifacts = glob.glob('{}/builds/my-service-artifact-*.zip'.format(app_dir_path))
+    assert len(artifacts) == 1, 'Only the latest artifact is kept.'
+    return artifacts[0]
+
+
+def test_generate_model_lazy_registry(tmpdir):
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    target = '{}/app/models'.format(app_dir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    runner.invoke(cli.model, ['account', '--target={}'.format(target)])
+    runner.invoke(cli.model, ['order', '--target={}'.format(target)])
+    with open('{}/_index.py'.format(target)) as index_file:
+        index = index_file.read()
+    assert "'Account': 'Account'," in index and "'Order': 'Order'," in index, 'Index lists every model.'
+
+    script = '; '.join([
+        'import sys',
+        'import app.models as models',
+        'assert models.__all__ == ["Account", "Order"], models.__all__',
+        'assert "Order" not in sys.modules',
+        'assert models.Account.__name__ == "Account"',
+        'assert "Order" not in sys.modules, "Only the accessed model is imported."',
+        'assert models.get_model("Order") is models.Order',
+    ])
+    env = dict(os.environ, NAME='my-service', STAGE='dev')
+    subprocess.check_call([sys.executable, '-c', script], cwd=app_dir, env=env)
+
+    # Python 3.6 has no module level __getattr__; the registry stays lazy there.
+    script = '; '.join([
+        'import sys',
+        'sys.version_info = (3, 6, 0)',
+        'import app.models as models',
+        'del models.__dict__["__getattr__"]',
+        'assert "Account" not in sys.modules',
+        'from app.models import Account',
+        'assert Account.__name__ == "Account"',
+        'assert "Order" not in sys.modules, "Only the accessed model is imported."',
+    ])
+    subprocess.check_call([sys.executable, '-c', script], cwd=app_dir, env=env)
+
+
 def test_generate_artifact(tmpdir):
     runner = CliRunner()
     app_dir_name = 'my_service'
     app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
     runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
-    runner.invoke(cli.artifact, ['--target={}/{}'.format(tmpdir, app_dir_name)])
-    builds_dir_path = '{}/builds'.format(app_dir_path)
-    service_artifact_path = '{}/{}'.format(builds_dir_path, 'my-service-artifact')
-    app_artifact_path = '{}/app'.format(service_artifact_path)
-    assert os.path.isdir(builds_dir_path), './builds dir created'
-    assert os.path.isdir(service_artifact_path), './builds/artifact dir created'
-    assert os.path.isdir(app_artifact_path), './builds/artifact/app dir copied'
-    assert os.listdir(service_artifact_path) == ['app', 'app_index.py', 'env.dist.yml', 'tight.yml']
-    assert os.listdir(app_artifact_path).sort() == ['__init__.py', 'functions', 'lib', 'models', 'serializers', 'vendored'].sort()
+    os.makedirs('{}/app/lib/__pycache__'.format(app_dir_path))
+    for stale in ['app/lib/__pycache__/helpers.cpython-311.pyc', 'app/lib/stale.pyc', 'app/vendored/old.pyo']:
+        open('{}/{}'.format(app_dir_path, stale), 'w').close()
+    artifact_path = build_artifact(runner, app_dir_path)
+    assert os.path.isfile('{}/builds/manifest.json'.format(app_dir_path)), './builds/manifest.json written'
+    with zipfile.ZipFile(artifact_path) as artifact:
+        names = artifact.namelist()
+        assert artifact.testzip() is None, 'Artifact entries are valid.'
+    assert names == sorted(names), 'Entries are sorted.'
+    assert not [name for name in names if '__pycache__' in name or name.endswith(('.pyc', '.pyo'))], 'Local bytecode is left out.'
+    for name in ['app/__init__.py', 'app/vendored/__init__.py', 'app_index.py', 'env.dist.yml', 'tight.yml']:
+        assert name in names, '{} is in the artifact'.format(name)
+    assert set(name.split('/')[1] for name in names if name.startswith('app/')) == set(['__init__.py', 'functions', 'lib', 'models', 'serializers', 'vendored'])
+
+
+def test_generate_artifact_is_deterministic_and_incremental(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    with open(build_artifact(runner, app_dir_path), 'rb') as first:
+        first_bytes = first.read()
+    time.sleep(1)
+    with open(build_artifact(runner, app_dir_path), 'rb') as second:
+        assert second.read() == first_bytes, 'Identical inputs produce byte-identical artifacts.'
+
+    with open('{}/app/lib/helpers.py'.format(app_dir_path), 'w') as helpers:
+        helpers.write('VALUE = 1\n')
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path)])
+    assert '1 entries recompressed' in result.output, 'Only the changed file is recompressed.'
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path)) as artifact:
+        assert artifact.read('app/lib/helpers.py') == b'VALUE = 1\n'
+
+
+def test_generate_artifact_prunes_vendored(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    vendored = '{}/app/vendored'.format(app_dir_path)
+    for path in ['requests/__init__.py', 'requests/__pycache__/api.cpython-36.pyc', 'requests/tests/test_api.py',
+                 'requests-2.0.dist-info/RECORD', 'requests-2.0.dist-info/METADATA']:
+        os.makedirs(os.path.dirname('{}/{}'.format(vendored, path)), exist_ok=True)
+        with open('{}/{}'.format(vendored, path), 'w') as vendored_file:
+            vendored_file.write('# {}\n'.format(path))
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path)])
+    assert 'Pruned from app/vendored:' in result.output
+    assert 'requests' in result.output.split('Bundle size by package:')[1], 'Per package sizes are reported.'
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path)) as artifact:
+        names = artifact.namelist()
+    assert 'app/vendored/requests/__init__.py' in names
+    assert 'app/vendored/requests-2.0.dist-info/METADATA' in names
+    for pruned in ['requests/__pycache__/api.cpython-36.pyc', 'requests/tests/test_api.py', 'requests-2.0.dist-info/RECORD']:
+        assert 'app/vendored/{}'.format(pruned) not in names, '{} is pruned'.format(pruned)
+
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path, '--no-prune')) as artifact:
+        assert 'app/vendored/requests/tests/test_api.py' in artifact.namelist()
+
+
+def import_value(extract_dir, module, env=None):
+    command = [sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); import {0}; print({0}.VALUE)'.format(module), extract_dir]
+    return subprocess.check_output(command, universal_newlines=True, env=env).strip()
+
+
+def test_generate_artifact_precompile(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    with open('{}/app/lib/helpers.py'.format(app_dir_path), 'w') as helpers:
+        helpers.write('VALUE = 1\n')
+    tag = sys.implementation.cache_tag
+
+    artifact_path = build_artifact(runner, app_dir_path, '--precompile')
+    with zipfile.ZipFile(artifact_path) as artifact:
+        names = artifact.namelist()
+    assert 'app/lib/helpers.py' in names
+    assert 'app/lib/__pycache__/helpers.{}.pyc'.format(tag) in names
+    assert names == sorted(names), 'Entries are sorted.'
+    extract_dir = '{}/extracted'.format(tmpdir)
+    with zipfile.ZipFile(artifact_path) as artifact:
+        artifact.extractall(extract_dir)
+    with open('{}/app/lib/helpers.py'.format(extract_dir), 'w') as source:
+        source.write('VALUE = 2\n')
+    assert import_value(extract_dir, 'app.lib.helpers') == '1', 'Shipped bytecode is used without checking the source.'
+
+    artifact_path = build_artifact(runner, app_dir_path, '--precompile', '--sourceless')
+    with zipfile.ZipFile(artifact_path) as artifact:
+        names = artifact.namelist()
+    assert 'app/lib/helpers.pyc' in names
+    assert 'app/lib/helpers.py' not in names, 'Sources are replaced by bytecode.'
+    assert 'app_index.py' in names, 'The Lambda entrypoint keeps its source.'
+    extract_dir = '{}/sourceless'.format(tmpdir)
+    with zipfile.ZipFile(artifact_path) as artifact:
+        artifact.extractall(extract_dir)
+    assert import_value(extract_dir, 'app.lib.helpers') == '1'
+
+
+def test_generate_artifact_precompile_optimize(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    with open('{}/app/lib/helpers.py'.format(app_dir_path), 'w') as helpers:
+        helpers.write('VALUE = 1\n')
+    tag = sys.implementation.cache_tag
+
+    artifact_path = build_artifact(runner, app_dir_path, '--precompile', '--optimize', '1')
+    with zipfile.ZipFile(artifact_path) as artifact:
+        names = artifact.namelist()
+    assert 'app/lib/__pycache__/helpers.{}.opt-1.pyc'.format(tag) in names
+    assert 'app/lib/__pycache__/helpers.{}.pyc'.format(tag) not in names, 'Optimized bytecode is only loaded at its level.'
+    extract_dir = '{}/extracted'.format(tmpdir)
+    with zipfile.ZipFile(artifact_path) as artifact:
+        artifact.extractall(extract_dir)
+    with open('{}/app/lib/helpers.py'.format(extract_dir), 'w') as source:
+        source.write('VALUE = 2\n')
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('PYTHONOPTIMIZE', None)
+    assert import_value(extract_dir, 'app.lib.helpers', env) == '2', 'Without PYTHONOPTIMIZE the source is compiled.'
+    env['PYTHONOPTIMIZE'] = '1'
+    assert import_value(extract_dir, 'app.lib.helpers', env) == '1', 'With PYTHONOPTIMIZE the shipped bytecode is used.'
+
+
+def test_generate_artifact_import_index(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    os.makedirs('{}/app/vendored/vendored_package'.format(app_dir_path))
+    os.makedirs('{}/app/vendored/vendored_package-1.0.dist-info'.format(app_dir_path))
+    for path, contents in [('app/lib/helpers.py', 'VALUE = 1\n'), ('app/vendored/vendored_package/__init__.py', 'VALUE = 2\n'),
+                           ('app/vendored/vendored_package-1.0.dist-info/METADATA', 'Metadata-Version: 2.1\nName: vendored-package\nVersion: 1.0\n')]:
+        with open('{}/{}'.format(app_dir_path, path), 'w') as source:
+            source.write(contents)
+    artifact_path = build_artifact(runner, app_dir_path, '--import-index')
+    extract_dir = '{}/extracted'.format(tmpdir)
+    with zipfile.ZipFile(artifact_path) as artifact:
+        artifact.extractall(extract_dir)
+    script = '; '.join([
+        'import sys',
+        'sys.path.insert(0, sys.argv[1])',
+        'path = list(sys.path)',
+        'import app, helpers, vendored_package',
+        'assert sys.path == path, "sys.path is left untouched"',
+        'print(app.MODULES["helpers"], app.MODULES["vendored_package"], helpers.VALUE, vendored_package.VALUE)',
+    ])
+    output = subprocess.check_output([sys.executable, '-c', script, extract_dir], universal_newlines=True)
+    assert output.split() == ['app/lib', 'app/vendored', '1', '2']
+    if sys.version_info >= (3, 8):
+        script = '; '.join([
+            'import sys',
+            'sys.path.insert(0, sys.argv[1])',
+            'import app',
+            'from importlib import metadata',
+            'assert not [d for d in metadata.distributions(path=[sys.argv[1]]) if d.metadata["Name"] == "vendored-package"]',
+            'print(metadata.version("vendored-package"))',
+        ])
+        output = subprocess.check_output([sys.executable, '-c', script, extract_dir], universal_newlines=True)
+        assert output.strip() == '1.0', 'Vendored distributions are found on the import path only.'
+
+
+def test_generate_artifact_shake(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    for path, contents in [
+        ('app/functions/orders/__init__.py', ''),
+        ('app/functions/orders/handler.py', 'from . import helpers\nimport used_package.api\n'),
+        ('app/functions/orders/helpers.py', 'import importlib\nimportlib.import_module("used_module")\n'),
+        ('app/vendored/used_package/__init__.py', 'from .api import *\n'),
+        ('app/vendored/used_package/api.py', 'from transitive_package import VALUE\n'),
+        ('app/vendored/transitive_package/__init__.py', 'VALUE = 1\n'),
+        ('app/vendored/used_module.py', ''),
+        ('app/vendored/plugin_package/__init__.py', ''),
+        ('app/vendored/plugin_package/loaded.py', 'import plugin_dependency\n'),
+        ('app/vendored/plugin_dependency.py', ''),
+        ('app/vendored/unused_package/__init__.py', 'import transitive_package\n'),
+        ('app/vendored/unused_package-1.0.dist-info/RECORD', 'unused_package/__init__.py,,\n'),
+    ]:
+        os.makedirs(os.path.dirname('{}/{}'.format(app_dir_path, path)), exist_ok=True)
+        with open('{}/{}'.format(app_dir_path, path), 'w') as source:
+            source.write(contents)
+    with open('{}/tight.yml'.format(app_dir_path)) as tight_yml:
+        config = yaml.safe_load(tight_yml)
+    config['artifact'] = {'shake': {'allow': ['plugin_package']}}
+    with open('{}/tight.yml'.format(app_dir_path), 'w') as tight_yml:
+        yaml.safe_dump(config, tight_yml)
+
+    result = runner.invoke(cli.unused, ['--target={}'.format(app_dir_path)])
+    assert result.exit_code == 0, result.output
+    assert 'unused_package ' in result.output and 'unused_package-1.0.dist-info' in result.output
+    assert '2 unreachable entries' in result.output
+
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path)) as artifact:
+        assert 'app/vendored/unused_package/__init__.py' in artifact.namelist(), 'Tree shaking is opt-in.'
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path, '--shake')) as artifact:
+        names = artifact.namelist()
+    for kept in ['used_package/api.py', 'transitive_package/__init__.py', 'used_module.py', 'plugin_package/loaded.py',
+                 'plugin_dependency.py', '__init__.py']:
+        assert 'app/vendored/{}'.format(kept) in names, '{} is reachable'.format(kept)
+    assert not [name for name in names if name.startswith('app/vendored/unused_package')]
+
+
+def test_generate_artifact_per_function(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    for path, contents in [
+        ('app/functions/orders/__init__.py', ''),
+        ('app/functions/orders/handler.py', 'import order_helpers\n'),
+        ('app/functions/accounts/__init__.py', ''),
+        ('app/functions/accounts/handler.py', 'from app.lib import account_helpers\n'),
+        ('app/lib/order_helpers.py', 'import used_package\n'),
+        ('app/lib/account_helpers.py', ''),
+        ('app/vendored/used_package/__init__.py', ''),
+    ]:
+        os.makedirs(os.path.dirname('{}/{}'.format(app_dir_path, path)), exist_ok=True)
+        with open('{}/{}'.format(app_dir_path, path), 'w') as source:
+            source.write(contents)
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path), '--per-function'])
+    assert result.exit_code == 0, result.output
+    assert 'Built 2 function bundles' in result.output and '% of the full artifact' in result.output
+
+    bundles = {}
+    for function in ['orders', 'accounts']:
+        paths = glob.glob('{}/builds/functions/{}/my-service-{}-artifact-*.zip'.format(app_dir_path, function, function))
+        assert len(paths) == 1
+        with zipfile.ZipFile(paths[0]) as bundle:
+            bundles[function] = bundle.namelist()
+    for name in ['app_index.py', 'app/__init__.py', 'app/functions/__init__.py', 'app/vendored/__init__.py',
+                 'app/functions/orders/handler.py', 'app/lib/order_helpers.py', 'app/vendored/used_package/__init__.py']:
+        assert name in bundles['orders'], '{} is in the orders bundle'.format(name)
+    for name in ['app/functions/accounts/handler.py', 'app/lib/account_helpers.py']:
+        assert name not in bundles['orders']
+    assert 'app/lib/account_helpers.py' in bundles['accounts']
+    assert not [name for name in bundles['accounts'] if 'orders' in name or 'used_package' in name]
+
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path), '--per-function', '--layer'])
+    assert result.exit_code == 0, result.output
+    for function in ['orders', 'accounts']:
+        paths = glob.glob('{}/builds/functions/{}/my-service-{}-artifact-*.zip'.format(app_dir_path, function, function))
+        assert len(paths) == 1
+        with zipfile.ZipFile(paths[0]) as bundle:
+            names = bundle.namelist()
+            loader = bundle.read('app/vendored/__init__.py').decode('utf-8')
+        assert [name for name in names if name.startswith('app/vendored/')] == ['app/vendored/__init__.py'], 'Vendored packages come from the layer.'
+        assert "__path__.append('/opt/python')" in loader
+        assert 'app/functions/{}/handler.py'.format(function) in names
+
+
+def test_generate_artifact_layer(tmpdir, monkeypatch):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    os.makedirs('{}/app/vendored/vendored_package'.format(app_dir_path))
+    with open('{}/app/vendored/vendored_package/__init__.py'.format(app_dir_path), 'w') as source:
+        source.write('VALUE = 1\n')
+
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path), '--layer'])
+    assert result.exit_code == 0, result.output
+    assert 'Built layer builds/layer/my-service-layer-' in result.output
+    layers = glob.glob('{}/builds/layer/my-service-layer-*.zip'.format(app_dir_path))
+    assert len(layers) == 1
+    with zipfile.ZipFile(layers[0]) as layer:
+        assert layer.namelist() == ['python/vendored_package/__init__.py']
+    with zipfile.ZipFile(build_artifact(runner, app_dir_path, '--layer')) as artifact:
+        names = artifact.namelist()
+        loader = artifact.read('app/vendored/__init__.py').decode('utf-8')
+    assert not [name for name in names if name.startswith('app/vendored/') and name != 'app/vendored/__init__.py']
+    assert "__path__.append('/opt/python')" in loader
+
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path), '--layer'])
+    assert 'is up to date' in result.output, 'The layer is only rebuilt when the vendored packages change.'
+
+    def mock_run_command(command, **kwargs):
+        package_dir = '{}/{}'.format(command[command.index('-t') + 1], command[2])
+        os.makedirs(package_dir)
+        with open('{}/__init__.py'.format(package_dir), 'w') as installed:
+            installed.write('')
+    monkeypatch.setattr(cli, 'run_command', mock_run_command)
+    result = runner.invoke(cli.install, ['new_package', '--target={}'.format(app_dir_path)])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(cli.artifact, ['--target={}'.format(app_dir_path), '--layer'])
+    assert 'Built layer' in result.output, 'Packages installed one at a time rebuild the layer.'
+    new_layers = glob.glob('{}/builds/layer/my-service-layer-*.zip'.format(app_dir_path))
+    assert len(new_layers) == 1 and new_layers != layers, 'The previous layer is replaced.'
+    with zipfile.ZipFile(new_layers[0]) as layer:
+        assert 'python/new_package/__init__.py' in layer.namelist()
+
+
+def test_dynamo_snapshot_restore(tmpdir):
+    runner = CliRunner()
+    target = str(tmpdir)
+    os.makedirs('{}/dynamo_db'.format(target))
+    database = '{}/dynamo_db/shared-local-instance.db'.format(target)
+    connection = sqlite3.connect(database)
+    connection.execute('CREATE TABLE items (id TEXT)')
+    connection.execute("INSERT INTO items VALUES ('seeded')")
+    connection.commit()
+
+    result = runner.invoke(cli.snapshot, ['seeded', '--target={}'.format(target)])
+    assert result.exit_code == 0, result.output
+    assert 'Saved snapshot seeded' in result.output
+    connection.execute("INSERT INTO items VALUES ('added by a test')")
+    connection.commit()
+
+    result = runner.invoke(cli.restore, ['seeded', '--target={}'.format(target)])
+    assert result.exit_code == 0, result.output
+    assert connection.execute('SELECT id FROM items').fetchall() == [('seeded',)], 'Open connections see the restored data.'
+    connection.close()
+    assert runner.invoke(cli.snapshot, ['--list', '--target={}'.format(target)]).output == 'seeded\n'
+    result = runner.invoke(cli.restore, ['missing', '--target={}'.format(target)])
+    assert result.exit_code == 1 and 'available: seeded' in result.output
+
+
+def test_dynamo_installdb_from_archive(tmpdir):
+    runner = CliRunner()
+    archive = '{}/dynamodb_local.tar.gz'.format(tmpdir)
+    with tarfile.open(archive, 'w:gz') as tar:
+        for name in ['DynamoDBLocal.jar', 'DynamoDBLocal_lib/sqlite4java.jar']:
+            path = '{}/source/{}'.format(tmpdir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as source:
+                source.write(name)
+            tar.add(path, name)
+    projects = ['{}/first'.format(tmpdir), '{}/second'.format(tmpdir)]
+    for project in projects:
+        os.makedirs('{}/dynamo_db'.format(project))
+        with open('{}/dynamo_db/shared-local-instance.db'.format(project), 'w') as database:
+            database.write('data')
+        result = runner.invoke(cli.installdb, ['--target={}'.format(project), '--from-archive={}'.format(archive)])
+        assert result.exit_code == 0, result.output
+        assert 'Installed DynamoDB Local' in result.output
+    jars = [os.path.realpath('{}/dynamo_db/DynamoDBLocal.jar'.format(project)) for project in projects]
+    assert jars[0] == jars[1], 'Projects share one extracted copy.'
+    with open('{}/dynamo_db/DynamoDBLocal_lib/sqlite4java.jar'.format(projects[0])) as library:
+        assert library.read() == 'DynamoDBLocal_lib/sqlite4java.jar'
+    with open('{}/dynamo_db/shared-local-instance.db'.format(projects[0])) as database:
+        assert database.read() == 'data', 'Local data is kept.'
+
+    result = runner.invoke(cli.installdb, ['--target={}'.format(projects[0]), '--from-archive={}'.format(archive)])
+    assert 'is already installed' in result.output
+    result = runner.invoke(cli.installdb, ['--target={}'.format(projects[0]), '--from-archive={}'.format(archive),
+                                           '--sha256={}'.format('0' * 64)])
+    assert result.exit_code == 1 and 'Checksum mismatch' in result.output
+
+    upgrade = '{}/dynamodb_local_upgrade.tar.gz'.format(tmpdir)
+    with tarfile.open(upgrade, 'w:gz') as tar:
+        tar.add('{}/source/DynamoDBLocal.jar'.format(tmpdir), 'DynamoDBLocal.jar')
+    result = runner.invoke(cli.installdb, ['--target={}'.format(projects[0]), '--from-archive={}'.format(upgrade)])
+    assert result.exit_code == 0, result.output
+    assert sorted(os.listdir('{}/dynamo_db'.format(projects[0]))) == [
+        '.tight-dynamodb.json', 'DynamoDBLocal.jar', 'shared-local-instance.db'], 'Links of the previous version are removed.'
+
+
+def test_profile_coldstart(tmpdir):
+    runner = CliRunner()
+    app_dir_name = 'my_service'
+    app_dir_path = '{}/{}'.format(tmpdir, app_dir_name)
+    runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+    with open('{}/app/lib/helpers.py'.format(app_dir_path), 'w') as helpers:
+        helpers.write('import json\n')
+    with open('{}/app_index.py'.format(app_dir_path), 'w') as entrypoint:
+        entrypoint.write('import app.lib.helpers\n')
+    result = runner.invoke(cli.coldstart, ['--target={}'.format(app_dir_path), '--runs=2', '--threshold=0'])
+    assert result.exit_code == 0, result.output
+    assert 'app_index' in result.output
+    assert 'app.lib.helpers' in result.output
+    assert 'median of 2 runs' in result.output
+    result = runner.invoke(cli.coldstart, ['--target={}'.format(app_dir_path), '--runs=1', '--budget=0'])
+    assert result.exit_code != 0, 'Exceeding the budget fails the command.'
+    assert 'exceeds the 0.0ms budget' in result.output
+    assert not os.path.isdir('{}/app/lib/__pycache__'.format(app_dir_path)), 'Profiling writes no bytecode.'
+
+    # Bytecode that doesn't match the source: only used with --precompiled.
+    import importlib.util
+    import py_compile
+    broken = '{}/broken.py'.format(tmpdir)
+    with open(broken, 'w') as source:
+        source.write('raise RuntimeError("stale bytecode")\n')
+    py_compile.compile(broken, cfile=importlib.util.cache_from_source('{}/app/lib/helpers.py'.format(app_dir_path)),
+                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    result = runner.invoke(cli.coldstart, ['--target={}'.format(app_dir_path), '--runs=1'])
+    assert result.exit_code == 0, 'Project modules are compiled from source, as on a cold start without bytecode.'
+    result = runner.invoke(cli.coldstart, ['--target={}'.format(app_dir_path), '--runs=1', '--precompiled'])
+    assert result.exit_code != 0 and 'stale bytecode' in result.output
 
 
 def test_pip_install_requirements(tmpdir, monkeypatch):
@@ -104,6 +629,126 @@ def test_pip_install_requirements(tmpdir, monkeypatch):
     runner.invoke(cli.install, ['--requirements', '--target={}'.format(app_dir_path)])
 
 
+def pip_report_item(name, requires=None, requested=False):
+    return {'metadata': {'name': name, 'version': '1.0', 'requires_dist': requires or []},
+            'is_direct': False, 'requested': requested, 'download_info': {'url': 'https://example.com/{}.whl'.format(name)}}
+
+
+PIP_REPORT = [
+    pip_report_item('somepackage', ['six'], requested=True),
+    pip_report_item('boto3', ['botocore (>=1.0)', 's3transfer'], requested=True),
+    pip_report_item('botocore', ['six', 'jmespath ; python_version >= "3.6"']),
+    pip_report_item('s3transfer', ['botocore']),
+    pip_report_item('jmespath'),
+    pip_report_item('six'),
+]
+
+
+def mock_pip(pip_calls, report=PIP_REPORT):
+    """ Stands in for pip: writes a resolution report or installs an empty package. """
+    def mock_run_command(command, **kwargs):
+        pip_calls.append(command)
+        if '--report' in command:
+            with open(command[command.index('--report') + 1], 'w') as report_file:
+                json.dump({'install': report}, report_file)
+            return 0
+        package_dir = '{}/{}'.format(command[command.index('-t') + 1], command[-1].split('==')[0])
+        os.makedirs(package_dir)
+        with open('{}/__init__.py'.format(package_dir), 'w') as installed:
+            installed.write('')
+        return 0
+    return mock_run_command
+
+
+def test_pip_install_requirements_parallel(tmpdir, monkeypatch):
+    runner = CliRunner()
+    pip_calls = []
+    monkeypatch.setattr(cli, 'run_command', mock_pip(pip_calls))
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    result = runner.invoke(cli.install, ['--requirements', '--no-cache', '--target={}/my_service'.format(tmpdir)])
+    assert result.exit_code == 0, result.output
+    installed = sorted(command[-1] for command in pip_calls if '--no-deps' in command)
+    assert installed == ['six==1.0', 'somepackage==1.0'], 'Runtime provided packages and their exclusive dependencies are never installed.'
+    for package in ['boto3', 'botocore', 's3transfer', 'jmespath']:
+        assert 'Excluded {} from'.format(package) in result.output
+    assert sorted(os.listdir('{}/my_service/app/vendored'.format(tmpdir))) == ['__init__.py', 'six', 'somepackage']
+    assert 'somepackage' in result.output.split('(provided by the Lambda runtime)')[-1], 'Per package timings are reported.'
+
+
+def test_pip_install_requirements_cache(tmpdir, monkeypatch):
+    runner = CliRunner()
+    pip_calls = []
+    report = list(PIP_REPORT)
+    monkeypatch.setattr(cli, 'run_command', mock_pip(pip_calls, report))
+    for app_dir_name in ['my_service', 'other_service', 'offline_service']:
+        runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+
+    def install(app_dir_name):
+        result = runner.invoke(cli.install, ['--requirements', '--target={}/{}'.format(tmpdir, app_dir_name)])
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def install_count():
+        return len([command for command in pip_calls if '--report' not in command])
+
+    install('my_service')
+    assert install_count() > 0
+    vendored = os.listdir('{}/my_service/app/vendored'.format(tmpdir))
+    assert 'somepackage' in vendored and '__init__.py' in vendored
+    assert 'botocore' not in vendored, 'Runtime provided packages are excluded.'
+
+    output = install('other_service')
+    assert install_count() == len(PIP_REPORT) - 4, 'Nothing is installed on a cache hit, even for another project.'
+    assert 'from the vendor cache' in output
+    assert os.path.isfile('{}/other_service/app/vendored/somepackage/__init__.py'.format(tmpdir))
+    with open('{}/my_service/app/vendored/somepackage/__init__.py'.format(tmpdir), 'w') as edited:
+        edited.write('EDITED = True\n')
+    with open('{}/other_service/app/vendored/somepackage/__init__.py'.format(tmpdir)) as other:
+        assert other.read() == '', 'Editing a vendored file leaves the cache and other projects alone.'
+
+    report[-1] = dict(report[-1], metadata=dict(report[-1]['metadata'], version='2.0'))
+    count = len(pip_calls)
+    install('other_service')
+    assert ['six==2.0'] == [command[-1] for command in pip_calls[count:] if command[-1].startswith('six')], 'A new release of an unpinned dependency misses the cache.'
+
+    monkeypatch.setattr(cli, 'run_command', lambda command, **kwargs: 1)
+    output = install('offline_service')
+    assert 'from the vendor cache' in output, 'Offline, the last resolution of the same requirements is used.'
+    assert os.path.isdir('{}/offline_service/app/vendored/somepackage'.format(tmpdir))
+
+    monkeypatch.setattr(cli, 'run_command', mock_pip(pip_calls, report))
+    with open('{}/other_service/requirements-vendor.txt'.format(tmpdir), 'a') as requirements:
+        requirements.write('\nPyYAML')
+    report.append(pip_report_item('PyYAML', requested=True))
+    count = install_count()
+    install('other_service')
+    assert install_count() > count, 'Changed requirements miss the cache.'
+
+
+def test_pip_install_requirements_pinned(tmpdir, monkeypatch):
+    runner = CliRunner()
+    pip_calls = []
+    monkeypatch.setattr(cli, 'run_command', mock_pip(pip_calls, [pip_report_item('six', requested=True)]))
+    for app_dir_name in ['my_service', 'other_service']:
+        runner.invoke(cli.app, [app_dir_name, '--target={}'.format(tmpdir)])
+        with open('{}/{}/requirements-vendor.txt'.format(tmpdir, app_dir_name), 'w') as requirements:
+            requirements.write('six==1.0  # pinned\n')
+
+    def install(app_dir_name, *args):
+        result = runner.invoke(cli.install, ['--requirements', '--target={}/{}'.format(tmpdir, app_dir_name)] + list(args))
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    install('my_service')
+    assert len(pip_calls) == 2, 'The first install resolves and installs.'
+    output = install('other_service')
+    assert len(pip_calls) == 2, 'pip never runs on a hit for pinned requirements.'
+    assert 'from the vendor cache' in output
+    assert os.path.isdir('{}/other_service/app/vendored/six'.format(tmpdir))
+    install('other_service', '--refresh-cache')
+    assert len(pip_calls) == 4, '--refresh-cache resolves and installs again.'
+
+
 def test_pip_install_package(tmpdir, monkeypatch):
     runner = CliRunner()
     app_dir_name = 'my_service'
@@ -119,3 +764,221 @@ def test_pip_install_package(tmpdir, monkeypatch):
     with open('{}/requirements-vendor.txt'.format(app_dir_path)) as requirements_file:
         contents = requirements_file.read()
         assert contents.split('\n')[-1] == 'PyYAML', 'Package added to requirements file.'
+
+
+def test_generateschema_incremental(tmpdir):
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    target = '{}/app/models'.format(app_dir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    runner.invoke(cli.env, ['--target={}'.format(app_dir)])
+    runner.invoke(cli.model, ['account', '--target={}'.format(target)])
+    runner.invoke(cli.model, ['order', '--target={}'.format(target)])
+    result = runner.invoke(cli.generateschema, ['--target={}'.format(app_dir)])
+    assert result.exit_code == 0, result.output
+    assert 'Wrote 2 of 2 schemas' in result.output
+    schemas = {name: '{}/schemas/dynamo/{}.yml'.format(app_dir, name) for name in ['accounts', 'orders']}
+    for path in schemas.values():
+        os.utime(path, (0, 0))
+
+    result = runner.invoke(cli.generateschema, ['--target={}'.format(app_dir)])
+    assert 'Wrote 0 of 2 schemas, 2 unchanged.' in result.output
+    assert all(os.path.getmtime(path) == 0 for path in schemas.values()), 'Unchanged schemas are not rewritten.'
+
+    with open('{}/Order.py'.format(target)) as model_file:
+        source = model_file.read()
+    with open('{}/Order.py'.format(target), 'w') as model_file:
+        model_file.write(source.replace("'read': 1", "'read': 7"))
+    result = runner.invoke(cli.generateschema, ['--target={}'.format(app_dir), '--jobs=1'])
+    assert 'Wrote 1 of 2 schemas, 1 unchanged.' in result.output
+    assert os.path.getmtime(schemas['accounts']) == 0
+    with open(schemas['orders']) as schema_file:
+        assert yaml.safe_load(schema_file)['Properties']['ProvisionedThroughput']['ReadCapacityUnits'] == 7
+
+
+def test_dynamo_capacity_recommendations(tmpdir):
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    runner.invoke(cli.env, ['--target={}'.format(app_dir)])
+    runner.invoke(cli.model, ['account', '--target={}/app/models'.format(app_dir)])
+    with open('{}/env.yml'.format(app_dir)) as env_file:
+        env = yaml.safe_load(env_file)
+    table = '{}-{}-accounts'.format(env['NAME'], env['STAGE'])
+    recording = {
+        'version': 1, 'started': 0, 'duration': 60, 'requests': 40,
+        'tables': {table: {'': {'reads': 30, 'writes': 10, 'read_units': {'1': 2, '2': 8}, 'write_units': {'1': 3},
+                                'items': 10, 'item_bytes': 5000, 'max_item_bytes': 900, 'scans': 4}}},
+        'filters': {table: {'Scan': {':email': 4}}},
+    }
+    recording_path = '{}/recording.json'.format(tmpdir)
+    with open(recording_path, 'w') as recording_file:
+        json.dump(recording, recording_file)
+    result = runner.invoke(cli.recommend_capacity, ['--target={}'.format(app_dir), '--recording={}'.format(recording_path)])
+    assert result.exit_code == 0, result.output
+    assert 'accounts: read 10, write 4' in result.output
+    assert '4 requests filter on email, consider a global index' in result.output
+
+    result = runner.invoke(cli.generateschema, ['--target={}'.format(app_dir)])
+    assert result.exit_code == 0, result.output
+    with open('{}/schemas/dynamo/accounts.yml'.format(app_dir)) as schema_file:
+        throughput = yaml.safe_load(schema_file)['Properties']['ProvisionedThroughput']
+    assert throughput == {'ReadCapacityUnits': 10, 'WriteCapacityUnits': 4}, 'generateschema applies the recommendation.'
+
+
+# Stands in for the vendored tight runtime, which attaches a function per
+# app/functions/<name>/handler.py to app_index.
+FAKE_APP_INDEX = '''
+import importlib, os
+for name in os.listdir('app/functions'):
+    if os.path.isfile(os.path.join('app/functions', name, 'handler.py')):
+        def function(event, context, module='app.functions.{}.handler'.format(name)):
+            return importlib.import_module(module).handler(event, context)
+        globals()[name] = function
+'''
+
+FAKE_HANDLER = '''
+import json
+calls = []
+def handler(event, context):
+    calls.append(event.get('path'))
+    body = {'version': VERSION, 'calls': len(calls), 'proxy': event.get('pathParameters'),
+            'query': event.get('queryStringParameters'), 'body': event.get('body')}
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+'''
+
+
+def write_fake_app(app_dir, functions, version=1):
+    with open('{}/app_index.py'.format(app_dir), 'w') as index_file:
+        index_file.write(FAKE_APP_INDEX)
+    for function in functions:
+        os.makedirs('{}/app/functions/{}'.format(app_dir, function), exist_ok=True)
+        open('{}/app/functions/{}/__init__.py'.format(app_dir, function), 'w').close()
+        with open('{}/app/functions/{}/handler.py'.format(app_dir, function), 'w') as handler_file:
+            handler_file.write(FAKE_HANDLER.replace('VERSION', str(version)))
+
+
+def test_serve(tmpdir):
+    import urllib.error
+    import urllib.request
+    from tight_cli.localdb import free_port
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    write_fake_app(app_dir, ['hello', 'other'])
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-c', 'from tight_cli.cli import main; main()', 'serve',
+                               '--target={}'.format(app_dir), '--port={}'.format(port), '--workers=2'],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def get(path, data=None):
+        url = 'http://127.0.0.1:{}{}'.format(port, path)
+        with urllib.request.urlopen(url, data=data, timeout=5) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+
+    try:
+        for _ in range(100):
+            try:
+                status, body = get('/hello/a/b?x=1')
+                break
+            except OSError:
+                time.sleep(0.1)
+        assert status == 200
+        assert body == {'version': 1, 'calls': 1, 'proxy': {'proxy': 'a/b'}, 'query': {'x': '1'}, 'body': None}
+        assert get('/hello', b'{"a": 1}')[1]['calls'] == 2, 'Modules stay warm between requests.'
+        assert get('/hello', b'{"a": 1}')[1]['body'] == '{"a": 1}'
+        get('/other')
+        try:
+            get('/missing')
+            assert False, 'Unknown functions are a 404.'
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+
+        write_fake_app(app_dir, ['hello'], version=2)
+        for _ in range(50):
+            status, body = get('/hello')
+            if body['version'] == 2:
+                break
+            time.sleep(0.1)
+        assert body['version'] == 2 and body['calls'] == 1, 'The changed function is reloaded.'
+        assert get('/other')[1]['calls'] == 2, 'Other functions keep their state.'
+    finally:
+        server.terminate()
+        output = server.communicate(timeout=10)[0].decode('utf-8')
+    assert 'Reloaded hello' in output, output
+    assert 'Reloaded other' not in output
+
+
+def test_bench(tmpdir, monkeypatch):
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    write_fake_app(app_dir, ['hello'])
+    # The app is loaded in this interpreter; undo that afterwards.
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+    modules = set(sys.modules)
+    results_path = '{}/results.json'.format(tmpdir)
+    try:
+        result = runner.invoke(cli.bench, ['hello', '--target={}'.format(app_dir), '--cold=2', '--requests=20',
+                                           '--concurrency=4', '--allocations=3', '--output={}'.format(results_path)])
+        assert result.exit_code == 0, result.output
+        assert 'warm  20 requests x4' in result.output
+        with open(results_path) as results_file:
+            results = json.load(results_file)
+        assert results['event'] == {'httpMethod': 'GET'}, 'The generated integration test event is the default.'
+        assert results['cold']['runs'] == 2 and results['cold']['total']['p50'] > results['cold']['invoke']['p50']
+        assert results['warm']['errors'] == 0 and results['warm']['throughput'] > 0
+        assert results['warm']['latency']['p50'] <= results['warm']['latency']['p99']
+        assert results['allocations']['samples'] == 3
+
+        results['warm']['latency']['p95'] /= 1000.0
+        with open(results_path, 'w') as results_file:
+            json.dump(results, results_file)
+        result = runner.invoke(cli.bench, ['hello', '--target={}'.format(app_dir), '--cold=0', '--allocations=0',
+                                           '--baseline={}'.format(results_path), '--max-regression=50'])
+        assert result.exit_code != 0 and 'regressed by more than 50' in result.output, result.output
+        assert 'warm.latency.p95' in result.output.splitlines()[-1]
+        assert len(glob.glob('{}/builds/bench/hello-*.json'.format(app_dir))) == 1
+
+        result = runner.invoke(cli.bench, ['missing', '--target={}'.format(app_dir)])
+        assert result.exit_code != 0 and 'No function named missing' in result.output
+    finally:
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+
+
+def test_invoke_replays_events(tmpdir, monkeypatch):
+    runner = CliRunner()
+    app_dir = '{}/my_service'.format(tmpdir)
+    runner.invoke(cli.app, ['my_service', '--target={}'.format(tmpdir)])
+    write_fake_app(app_dir, ['hello'])
+    expectations_dir = '{}/tests/functions/integration/hello/expectations'.format(app_dir)
+    os.makedirs(expectations_dir)
+    with open('{}/test_get_method.yml'.format(expectations_dir), 'w') as expectation_file:
+        yaml.safe_dump({'statusCode': 200, 'headers': {'Content-Type': 'application/json'}}, expectation_file)
+    with open('{}/stale.yml'.format(expectations_dir), 'w') as expectation_file:
+        yaml.safe_dump({'statusCode': 200, 'body': '{"version": 0}'}, expectation_file)
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+    modules = set(sys.modules)
+    events = [json.dumps({'httpMethod': 'GET', 'path': '/hello/{}'.format(number)}) for number in range(6)]
+    events.insert(2, '')
+    events.insert(4, '{not json')
+    events.append(json.dumps({'httpMethod': 'GET', 'expectation': 'stale'}))
+    output_path = '{}/responses.ndjson'.format(tmpdir)
+    try:
+        result = runner.invoke(cli.invoke, ['hello', '-', '--target={}'.format(app_dir), '--concurrency=3',
+                                            '--output={}'.format(output_path)], input='\n'.join(events) + '\n')
+    finally:
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+    assert result.exit_code != 0, 'Errors and mismatches fail the command.'
+    assert '8 events, 1 errors, 1 of 7 compared differ' in result.output, result.output
+    with open(output_path) as output_file:
+        results = [json.loads(line) for line in output_file]
+    assert [result['line'] for result in results] == [1, 2, 4, 5, 6, 7, 8, 9], 'Results are written in input order.'
+    assert results[3]['error'].startswith('Invalid JSON')
+    assert all(result['expectation'] == 'test_get_method' and 'mismatch' not in result
+               for result in results[:3] + results[4:7])
+    assert results[-1]['expectation'] == 'stale' and results[-1]['mismatch'] == ['body']
@@ -12,8 +12,297 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import subprocess
+import sys
 import tight_cli.cli as cli
 
 
 def test_no_boom():
     assert True, 'Module can be imported.'
+
+
+HELP_IMPORT_BUDGET_US = 150000
+HEAVY_MODULES = ['yaml', 'jinja2', 'inflector', 'colorama', 'termcolor', 'dynamo3', 'flywheel', 'botocore']
+
+
+def help_import_times():
+    """
+    Run `tight --help` in a clean interpreter with `-X importtime` and return a
+    dict of top level module name -> cumulative import time in microseconds.
+    """
+    command = [sys.executable, '-X', 'importtime', '-c',
+               'from tight_cli.cli import main; main(["--help"], standalone_mode=False)']
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        times[name] = int(cumulative)
+    return times
+
+
+def test_help_does_not_import_heavy_dependencies():
+    imported = help_import_times()
+    for module in HEAVY_MODULES:
+        assert module not in imported, '{} is imported by `tight --help`'.format(module)
+
+
+def test_help_import_time_budget():
+    imported = help_import_times()
+    assert imported['tight_cli.cli'] < HELP_IMPORT_BUDGET_US, 'tight_cli.cli import exceeded the startup budget.'
+
+
+def test_get_template_is_cached(tight_cache_dir):
+    first = cli.get_template(cli.LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller.jinja2')
+    second = cli.get_template(cli.LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller.jinja2')
+    assert first is second, 'Template is parsed once per process.'
+
+
+def test_get_template_writes_bytecode_cache(tight_cache_dir, monkeypatch):
+    from tight_cli import templates
+    monkeypatch.setattr(templates, '_ENVIRONMENTS', {})
+    cli.get_template(cli.LAMBDA_APP_TEMPLATES, 'flywheel_model.jinja2')
+    assert os.listdir('{}/templates'.format(tight_cache_dir)), 'Compiled template written to the bytecode cache.'
+
+
+def test_artifact_writer_streams_large_files_in_parallel(tmpdir, monkeypatch):
+    import zipfile
+    from tight_cli import artifacts
+    monkeypatch.setattr(artifacts, 'STREAM_THRESHOLD', 1024)
+    monkeypatch.setattr(artifacts, 'PARALLEL_THRESHOLD', 0)
+    target = str(tmpdir)
+    os.makedirs('{}/app/lib'.format(target))
+    contents = {}
+    for index in range(8):
+        contents['app/lib/module_{}.py'.format(index)] = 'VALUE = {}\n'.format(index).encode() * (index * 100 + 1)
+    for name, data in contents.items():
+        with open('{}/{}'.format(target, name), 'wb') as source:
+            source.write(data)
+    result = artifacts.build_artifact(target, '{}/artifact.zip'.format(target), target, jobs=2)
+    with zipfile.ZipFile(result['path']) as artifact:
+        assert artifact.namelist() == sorted(contents)
+        for name, data in contents.items():
+            assert artifact.read(name) == data
+    assert [phase for phase, seconds in result['stats'].phases] == ['scan', 'compress', 'finalize']
+    assert result['stats'].bytes_in == sum(len(data) for data in contents.values())
+
+
+def test_prune_rules():
+    from tight_cli import prune
+    rules = prune.load_rules({})
+    assert rules.match('requests/__pycache__/api.cpython-36.pyc')
+    assert rules.match('requests/tests/test_api.py') == '*/tests/'
+    assert rules.match('yaml/__init__.pyi') == '**/*.pyi'
+    assert rules.match('PyYAML-3.12.dist-info/RECORD') == '*.dist-info/*'
+    assert rules.match('PyYAML-3.12.dist-info/METADATA') is None, 'Metadata needed by importlib.metadata is kept.'
+    assert rules.match('requests/api.py') is None
+    assert rules.match('requests/packages/tests/helpers.py') is None, 'Only package level tests are pruned by default.'
+
+    custom = prune.load_rules({'artifact': {'prune': {'defaults': False, 'rules': ['botocore/', '!botocore/data/']}}})
+    assert custom.match('requests/__pycache__/api.pyc') is None
+    assert custom.match('botocore/client.py') == 'botocore/'
+    assert custom.match('botocore/data/s3.json') is None
+    assert prune.load_rules({'artifact': {'prune': False}}) is None
+
+
+def test_parse_importtime():
+    from tight_cli import coldstart
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       249 |        249 |       _json',
+        'import time:       536 |        784 |     json.scanner',
+        'import time:       529 |       1313 |   json.decoder',
+        'import time:       607 |        607 |   json.encoder',
+        'import time:       337 |       2256 | json',
+        'import time:       100 |        100 | app_index',
+    ])
+    roots = coldstart.parse_importtime(output)
+    assert [root.name for root in roots] == ['json', 'app_index']
+    assert [child.name for child in roots[0].children] == ['json.decoder', 'json.encoder']
+    assert roots[0].find('_json').cumulative_us == 249
+
+    merged = coldstart.merge_runs([roots[0], coldstart.ImportNode('json', 100, 400), roots[0]])
+    assert merged.cumulative_us == 2256, 'Median across runs.'
+    assert merged.find('json.decoder').cumulative_us == 1313
+
+
+def test_localdb_readiness_backoff(monkeypatch):
+    from tight_cli import localdb
+    now = [0.0]
+    delays = []
+    answers = iter([False, False, False, True])
+    monkeypatch.setattr(localdb, 'is_ready', lambda port: next(answers))
+
+    def sleep(seconds):
+        delays.append(seconds)
+        now[0] += seconds
+
+    assert localdb.wait_until_ready(8000, sleep=sleep, clock=lambda: now[0]) == sum(delays)
+    assert delays == [0.05, 0.1, 0.2], 'Polling backs off exponentially.'
+
+    monkeypatch.setattr(localdb, 'is_ready', lambda port: False)
+    try:
+        localdb.wait_until_ready(8000, timeout=2, sleep=sleep, clock=lambda: now[0])
+        assert False, 'Times out.'
+    except RuntimeError as e:
+        assert 'not ready' in str(e)
+
+
+def test_localdb_pidfile(tmpdir):
+    from tight_cli import localdb
+    target = str(tmpdir)
+    os.makedirs(localdb.db_dir(target))
+    assert '-inMemory' in localdb.build_command(target, in_memory=True)
+    assert localdb.read_pidfile(target) is None
+    localdb.write_pidfile(target, os.getpid(), 8001, True)
+    assert localdb.read_pidfile(target) == {'pid': os.getpid(), 'port': 8001, 'in_memory': True}
+    finished = subprocess.Popen([sys.executable, '-c', ''])
+    finished.wait()
+    localdb.write_pidfile(target, finished.pid, 8001, True)
+    assert localdb.read_pidfile(target) is None, 'Stale pidfiles are ignored.'
+    assert not os.path.exists(localdb.pidfile_path(target))
+
+
+def test_localdb_dump_database(tmpdir):
+    import sqlite3
+    from tight_cli import localdb
+    source = sqlite3.connect('{}/source.db'.format(tmpdir))
+    source.executescript('CREATE TABLE items (id TEXT PRIMARY KEY, value INTEGER); CREATE INDEX item_values ON items (value);'
+                         "INSERT INTO items VALUES ('a', 1), ('b', 2);")
+    destination = sqlite3.connect('{}/destination.db'.format(tmpdir))
+    destination.executescript("CREATE TABLE items (id TEXT); CREATE TABLE stale (id TEXT); INSERT INTO items VALUES ('old');")
+    localdb.dump_database(source, destination)
+    assert destination.execute('SELECT id, value FROM items ORDER BY id').fetchall() == [('a', 1), ('b', 2)]
+    names = [row[0] for row in destination.execute("SELECT name FROM sqlite_master ORDER BY name")]
+    assert 'stale' not in names and 'item_values' in names, 'The destination is replaced, not merged.'
+    assert not source.in_transaction and not destination.in_transaction
+
+
+MODEL_SOURCE = '''
+from flywheel import Model, Field, GlobalIndex
+import os
+
+class Order(Model):
+    __metadata__ = {
+        '_name': '%s-%s-orders' % (os.environ['NAME'], os.environ['STAGE']),
+        'throughput': {'read': 3, 'write': 2},
+        'global_indexes': [GlobalIndex.all('customer-index', 'customer').throughput(read=4, write=1)],
+    }
+    id = Field(type=str, hash_key=True)
+    created = Field(type=int, range_key=True)
+    customer = Field()
+    updated = Field(type=float).keys_index('updated-index')
+'''
+
+
+def test_import_graph_caches_lookups(tmpdir, monkeypatch):
+    from tight_cli import imports
+    os.makedirs('{}/app/vendored/package'.format(tmpdir))
+    for path in ['app/vendored/package/__init__.py', 'app/vendored/package/api.py', 'app/vendored/module.py']:
+        with open('{}/{}'.format(tmpdir, path), 'w') as source:
+            source.write('')
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(imports.os, 'scandir', lambda directory: scanned.append(directory) or scandir(directory))
+    graph = imports.ImportGraph(str(tmpdir), 'app/vendored')
+    for _ in range(3):
+        assert [module for path, module, is_package in graph.resolve('package.api')] == ['package', 'package.api']
+        assert graph.resolve('module')[0][0].endswith('module.py')
+        assert graph.resolve('json') == [], 'Modules outside the project resolve to nothing.'
+    assert len(scanned) == len(set(scanned)), 'Every directory is listed once.'
+
+
+def test_discover_models_statically(tmpdir, monkeypatch):
+    from tight_cli import schema
+    monkeypatch.delenv('NAME', raising=False)
+    with open('{}/Order.py'.format(tmpdir), 'w') as model_file:
+        model_file.write(MODEL_SOURCE)
+    with open('{}/Dynamic.py'.format(tmpdir), 'w') as model_file:
+        model_file.write('from flywheel import Model\nclass Dynamic(Model):\n    __metadata__ = {"_name": make_name()}\n')
+    models, unsupported = schema.discover_models(str(tmpdir))
+    assert [model['class_name'] for model in models] == ['Order'], 'Models are read without env.yml.'
+    assert [module_name for module_name, reason in unsupported] == ['Dynamic']
+    assert 'Dynamic' not in sys.modules and 'Order' not in sys.modules, 'Model modules are not imported.'
+
+    kwargs = schema.create_table_kwargs(models[0], {'NAME': 'svc', 'STAGE': 'dev'})
+    assert kwargs['TableName'] == 'svc-dev-orders'
+    assert kwargs['ProvisionedThroughput'] == {'ReadCapacityUnits': 3, 'WriteCapacityUnits': 2}
+    assert [attribute['AttributeName'] for attribute in kwargs['AttributeDefinitions']] == ['created', 'customer', 'id', 'updated']
+    assert kwargs['LocalSecondaryIndexes'][0]['Projection'] == {'ProjectionType': 'KEYS_ONLY'}
+    assert kwargs['GlobalSecondaryIndexes'][0]['ProvisionedThroughput']['ReadCapacityUnits'] == 4
+
+    monkeypatch.setattr(schema, 'parse_model_file', lambda *args: 1 / 0)
+    assert schema.discover_models(str(tmpdir))[0][0]['table_name'] == '{NAME}-{STAGE}-orders', 'Results are cached by file hash.'
+
+
+def test_capacity_recording_and_recommendations(tmpdir, monkeypatch):
+    import http.client
+    import http.server
+    import json
+    import threading
+    from tight_cli import capacity, localdb, schema
+    item = {'id': {'S': 'a' * 100}, 'created': {'N': '1500000000'}, 'customer': {'S': 'c' * 2000}}
+    responses = {
+        'GetItem': {'Item': item},
+        'Scan': {'Items': [item], 'Count': 1, 'ScannedCount': 10},
+        'Query': {'Items': [], 'Count': 0, 'ScannedCount': 0},
+        'PutItem': {},
+    }
+
+    class Upstream(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            body = json.dumps(responses[self.headers['X-Amz-Target'].split('.')[1]]).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    upstream = http.server.HTTPServer(('localhost', localdb.free_port()), Upstream)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    clock = iter([0, 10, 11, 11, 11, 11, 20])
+    recorder = capacity.Recorder(clock=lambda: next(clock))
+    proxy = capacity.RecordingProxy(localdb.free_port(), upstream.server_address[1], recorder)
+    proxy.start()
+
+    def call(operation, request):
+        connection = http.client.HTTPConnection('localhost', proxy.server_address[1])
+        connection.request('POST', '/', body=json.dumps(request), headers={'X-Amz-Target': 'DynamoDB_20120810.' + operation})
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read().decode('utf-8')) == responses[operation], 'Responses pass through unchanged.'
+        connection.close()
+
+    call('PutItem', {'TableName': 'svc-dev-orders', 'Item': item})
+    call('GetItem', {'TableName': 'svc-dev-orders', 'Key': {}, 'ConsistentRead': True})
+    call('Scan', {'TableName': 'svc-dev-orders', 'FilterExpression': '#c = :c', 'ExpressionAttributeNames': {'#c': 'status'}})
+    call('Query', {'TableName': 'svc-dev-orders', 'IndexName': 'customer-index'})
+    call('Query', {'TableName': 'svc-dev-orders', 'IndexName': 'updated-index'})
+    proxy.shutdown()
+    upstream.shutdown()
+    recorded = recorder.to_dict()
+    usage = recorded['tables']['svc-dev-orders']['']
+    assert recorded['requests'] == 5
+    assert usage['write_units'] == {'10': 3}, 'A 2.1KB item takes 3 write units.'
+    assert usage['read_units'] == {'11': 1 + 3.0}, 'Scans are billed for every scanned item, eventually consistent.'
+    assert usage['max_item_bytes'] == 2119
+
+    with open('{}/Order.py'.format(tmpdir), 'w') as model_file:
+        model_file.write(MODEL_SOURCE)
+    models, unsupported = schema.discover_models(str(tmpdir))
+    env = {'NAME': 'svc', 'STAGE': 'dev'}
+    recommendations = capacity.recommend(recorded, models, headroom=1.5, env=env)
+    orders = recommendations['tables']['orders']
+    assert orders['read'] == 7 and orders['write'] == 5, 'Local index reads count against the table.'
+    assert orders['global_indexes'] == {'customer-index': {'read': 1, 'write': 5}}
+    assert recommendations['indexes'] == {'orders': [{'type': 'global', 'attribute': 'status', 'requests': 1}]}
+
+    kwargs = capacity.apply(schema.create_table_kwargs(models[0], env), orders)
+    assert kwargs['ProvisionedThroughput'] == {'ReadCapacityUnits': 7, 'WriteCapacityUnits': 5}
+    assert kwargs['GlobalSecondaryIndexes'][0]['ProvisionedThroughput'] == {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 5}
@@ -0,0 +1,705 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from tight_cli import imports
+from tight_cli.bytecode import compile_sources, compiled_name
+from tight_cli.prune import package_name, strip_shared_object
+
+ARTIFACT_DIRS = ['app']
+ARTIFACT_FILES = ['app_index.py', 'env.dist.yml', 'tight.yml']
+FUNCTIONS_DIR = 'app/functions'
+# Python files below these are only shipped in a function's bundle when it imports them.
+SHARED_DIRS = ['app/lib', 'app/models', 'app/serializers']
+# Lambda extracts layers to /opt and puts /opt/python on sys.path.
+LAYER_PREFIX = 'python'
+LAYER_PATH = '/opt/python'
+LAYERS_DIR = 'layer'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSION_LEVEL = 9
+CHUNK_SIZE = 1024 * 1024
+# Files larger than this are deflated chunk by chunk straight into the zip by
+# the parent process instead of being held in memory by a worker.
+STREAM_THRESHOLD = 8 * 1024 * 1024
+# Below this many bytes to compress, starting a process pool costs more than it saves.
+PARALLEL_THRESHOLD = 4 * 1024 * 1024
+# Local bytecode depends on whichever interpreter last ran; --precompile adds
+# bytecode for the Lambda runtime explicitly.
+BYTECODE_DIR = '__pycache__'
+BYTECODE_SUFFIXES = ('.pyc', '.pyo')
+# Pruning reason for vendored packages removed by tree shaking.
+UNREACHABLE = 'unreachable imports'
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_COUNT_LIMIT = 0xFFFF
+# 1980-01-01 00:00:00, the earliest timestamp a zip entry can hold. Every entry
+# gets the same timestamp so identical inputs produce byte-identical archives.
+DOS_DATE = (0 << 9) | (1 << 5) | 1
+DOS_TIME = 0
+
+
+def collect_sources(target):
+    """
+    List the files that make up an artifact. Local bytecode is left out.
+
+    :param target: Project root.
+    :return: Sorted list of (archive name, absolute path) tuples.
+    """
+    sources = []
+    for directory in ARTIFACT_DIRS:
+        root = os.path.join(target, directory)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [dirname for dirname in dirnames if dirname != BYTECODE_DIR]
+            for filename in filenames:
+                if filename.endswith(BYTECODE_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                sources.append((os.path.relpath(path, target).replace(os.sep, '/'), path))
+    for filename in ARTIFACT_FILES:
+        path = os.path.join(target, filename)
+        if os.path.isfile(path):
+            sources.append((filename, path))
+    return sorted(sources)
+
+
+def iter_chunks(path):
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            yield chunk
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def deflate_chunks(chunks, state):
+    """
+    Deflate chunks the way zip stores them (raw deflate stream, no zlib
+    header), recording the crc32 and uncompressed size in state.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    for chunk in chunks:
+        state['crc'] = zlib.crc32(chunk, state['crc'])
+        state['size'] += len(chunk)
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def compress_file(path):
+    """
+    Deflate a whole file in memory. Runs in worker processes.
+
+    :param path:
+    :return: Tuple of (compressed bytes, crc32, uncompressed size).
+    """
+    state = {'crc': 0, 'size': 0}
+    data = b''.join(deflate_chunks(iter_chunks(path), state))
+    return data, state['crc'] & 0xFFFFFFFF, state['size']
+
+
+def file_mode(path):
+    return 0o100755 if os.access(path, os.X_OK) else 0o100644
+
+
+class DeterministicZipWriter(object):
+    """
+    Minimal streaming zip writer.
+
+    Unlike zipfile.ZipFile it accepts raw deflate data, which lets entries be
+    compressed elsewhere (worker processes, a previous artifact), and it
+    writes no timestamps or host specific metadata.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.central_directory = []
+        self.entries = []
+
+    def _local_header(self, encoded_name, flags, crc, compress_size, size):
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, flags, zipfile.ZIP_DEFLATED, DOS_TIME, DOS_DATE,
+                           crc, compress_size, size, len(encoded_name), 0) + encoded_name
+
+    def _write_entry(self, name, chunks, mode, sizes):
+        """
+        Write a placeholder local header followed by the deflated chunks, then
+        patch the header once crc and sizes are known. chunks may be a
+        generator, so nothing has to be held in memory.
+        """
+        encoded_name = name.encode('utf-8')
+        flags = 0 if all(ord(char) < 128 for char in name) else 0x800
+        offset = self.file.tell()
+        if offset > ZIP32_LIMIT:
+            raise ValueError('Artifact is too large at {}.'.format(name))
+        self.file.write(self._local_header(encoded_name, flags, 0, 0, 0))
+        compress_size = 0
+        for chunk in chunks:
+            self.file.write(chunk)
+            compress_size += len(chunk)
+        crc, size = sizes()
+        if size > ZIP32_LIMIT or compress_size > ZIP32_LIMIT:
+            raise ValueError('{} is too large for a Lambda artifact.'.format(name))
+        end = self.file.tell()
+        self.file.seek(offset)
+        self.file.write(self._local_header(encoded_name, flags, crc, compress_size, size))
+        self.file.seek(end)
+        self.central_directory.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 20, 20, flags,
+                                                  zipfile.ZIP_DEFLATED, DOS_TIME, DOS_DATE, crc, compress_size,
+                                                  size, len(encoded_name), 0, 0, 0, 0, mode << 16, offset) + encoded_name)
+        self.entries.append((name, compress_size, size))
+        return compress_size
+
+    def write_raw(self, name, chunks, crc, size, mode=0o100644):
+        """
+        Write an entry from already deflated chunks.
+        """
+        return self._write_entry(name, chunks, mode, lambda: (crc, size))
+
+    def write_file(self, name, path, mode=0o100644):
+        """
+        Deflate a file chunk by chunk straight into the archive.
+        """
+        state = {'crc': 0, 'size': 0}
+        return self._write_entry(name, deflate_chunks(iter_chunks(path), state), mode,
+                                 lambda: (state['crc'] & 0xFFFFFFFF, state['size']))
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+    def close(self):
+        start = self.file.tell()
+        for record in self.central_directory:
+            self.file.write(record)
+        end = self.file.tell()
+        size = end - start
+        count = len(self.central_directory)
+        if count > ZIP_COUNT_LIMIT or start > ZIP32_LIMIT:
+            self.file.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+            self.file.write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            self.file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+                                        min(size, ZIP32_LIMIT), ZIP32_LIMIT, 0))
+        else:
+            self.file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, start, 0))
+        self.file.close()
+
+
+class PreviousArtifact(object):
+    """
+    Read access to the deflated entries of the previous build, so unchanged
+    files can be copied into the new artifact without recompressing them.
+    """
+
+    def __init__(self, path):
+        self.entries = {}
+        self.file = None
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            with zipfile.ZipFile(path) as archive:
+                infos = [info for info in archive.infolist() if info.compress_type == zipfile.ZIP_DEFLATED]
+            self.file = open(path, 'rb')
+            for info in infos:
+                self.file.seek(info.header_offset)
+                name_length, extra_length = struct.unpack('<HH', self.file.read(30)[26:30])
+                data_offset = info.header_offset + 30 + name_length + extra_length
+                self.entries[info.filename] = (data_offset, info.compress_size, info.CRC, info.file_size)
+        except (zipfile.BadZipfile, OSError, struct.error):
+            self.close()
+            self.entries = {}
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def info(self, name):
+        """
+        :param name:
+        :return: Tuple of (crc32, uncompressed size).
+        """
+        return self.entries[name][2:]
+
+    def iter_raw(self, name):
+        data_offset, remaining = self.entries[name][:2]
+        offset = data_offset
+        while remaining:
+            self.file.seek(offset)
+            chunk = self.file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError('Previous artifact is truncated at {}.'.format(name))
+            offset += len(chunk)
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def load_manifest(builds_dir):
+    try:
+        with open(os.path.join(builds_dir, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(builds_dir, manifest):
+    with open(os.path.join(builds_dir, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+class BuildStats(object):
+    """
+    Wall time per build phase and bytes read / written.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # rule -> [files, bytes]
+        self.pruned = {}
+        self.stripped_bytes = 0
+        # Sources that are not valid for the target runtime and ship without bytecode.
+        self.uncompiled = []
+        # package -> [uncompressed bytes, compressed bytes]
+        self.packages = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+
+@contextmanager
+def worker_pool(jobs):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield pool
+    else:
+        yield None
+
+
+def pool_map(pool, function, items, jobs):
+    if pool is None:
+        return [function(item) for item in items]
+    return list(pool.map(function, items, chunksize=max(1, len(items) // (jobs * 4))))
+
+
+def iter_compressed(pool, paths, window):
+    """
+    Compress paths in order, keeping at most window files in flight so memory
+    stays bounded regardless of how many files are vendored.
+    """
+    if pool is None:
+        for path in paths:
+            yield compress_file(path)
+        return
+    paths = iter(paths)
+    pending = deque(pool.submit(compress_file, path) for path in islice(paths, window))
+    while pending:
+        result = pending.popleft().result()
+        path = next(paths, None)
+        if path is not None:
+            pending.append(pool.submit(compress_file, path))
+        yield result
+
+
+def record_sizes(stats, entries, vendor_dir):
+    vendor_prefix = vendor_dir.strip('/')
+    for name, compress_size, size in entries:
+        package = stats.packages.setdefault(package_name(name, vendor_prefix), [0, 0])
+        package[0] += size
+        package[1] += compress_size
+
+
+def prune_sources(sources, sizes, vendor_dir, rules, stats, exclude=None):
+    """
+    Drop vendored files excluded by the prune rules, recording what was
+    removed per rule. Files below an entry of exclude are recorded under
+    UNREACHABLE.
+    """
+    if rules is None and not exclude:
+        return sources, sizes
+    vendor_prefix = vendor_dir.strip('/') + '/'
+    kept_sources = []
+    kept_sizes = []
+    for (name, path), size in zip(sources, sizes):
+        rule = None
+        if name.startswith(vendor_prefix):
+            relative_name = name[len(vendor_prefix):]
+            if exclude and relative_name.split('/')[0] in exclude:
+                rule = UNREACHABLE
+            elif rules is not None:
+                rule = rules.match(relative_name)
+        if rule:
+            removed = stats.pruned.setdefault(rule, [0, 0])
+            removed[0] += 1
+            removed[1] += size
+        else:
+            kept_sources.append((name, path))
+            kept_sizes.append(size)
+    return kept_sources, kept_sizes
+
+
+def build_artifact(target, zip_path, builds_dir, jobs=None, vendor_dir='app/vendored', prune=None, bytecode=None,
+                   import_index=False, exclude=None, select=None):
+    """
+    Build a deterministic artifact zip, reusing the compressed entries of the
+    previous build for every file whose content hash is unchanged. Changed
+    files are deflated across a process pool and written straight into the
+    zip; nothing is staged on disk.
+
+    :param target: Project root.
+    :param zip_path: Location of the zip to write.
+    :param builds_dir: Directory holding the build manifest.
+    :param jobs: Number of compression processes. Defaults to the CPU count.
+    :param vendor_dir: Project relative vendor directory, from tight.yml.
+    :param prune: PruneRules applied to vendor_dir, or None to ship it as-is.
+    :param bytecode: BytecodeOptions to precompile python sources, or None.
+    :param import_index: Ship app/_import_index.py so the app resolves top
+                         level imports without extending sys.path.
+    :param exclude: Entries directly below vendor_dir to leave out, see
+                    tight_cli.imports.find_unreachable.
+    :param select: Optional callable filtering or renaming the list of
+                   (archive name, path) sources before anything is read.
+    :return: Dict describing the build.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    stats = BuildStats()
+    manifest = load_manifest(builds_dir)
+    previous_files = manifest.get('files', {})
+    previous_artifact = manifest.get('artifact')
+    previous = PreviousArtifact(os.path.join(builds_dir, previous_artifact) if previous_artifact else None)
+
+    with stats.phase('scan'):
+        sources = collect_sources(target)
+        if select is not None:
+            sources = select(sources)
+        sizes = [os.path.getsize(path) for name, path in sources]
+        stats.bytes_in = sum(sizes)
+        sources, sizes = prune_sources(sources, sizes, vendor_dir, prune, stats, exclude)
+        with worker_pool(jobs if stats.bytes_in >= PARALLEL_THRESHOLD else 1) as pool:
+            digests = pool_map(pool, hash_file, [path for name, path in sources], jobs)
+
+    entries = []
+    for (name, path), digest in zip(sources, digests):
+        entry = {'sha256': digest}
+        if prune is not None and prune.should_strip(name):
+            entry['transform'] = 'strip'
+        entries.append((name, path, entry))
+
+    compiled = {}
+    if bytecode is not None:
+        with stats.phase('precompile'):
+            python_sources = [(name, path, entry['sha256']) for name, path, entry in entries if name.endswith('.py')]
+            compiled, stats.uncompiled = compile_sources(bytecode, python_sources, os.path.join(builds_dir, '.bytecode'))
+        with_bytecode = []
+        for name, path, entry in entries:
+            pyc_name = compiled_name(name, bytecode) if name in compiled else None
+            if pyc_name:
+                with_bytecode.append((pyc_name, compiled[name], {'sha256': entry['sha256'], 'transform': bytecode.transform}))
+            if pyc_name != name + 'c':
+                with_bytecode.append((name, path, entry))
+        entries = with_bytecode
+
+    if import_index:
+        entries = [item for item in entries if item[0] != imports.INDEX_NAME]
+        index_name, index_path = imports.write_index([name for name, path, entry in entries], vendor_dir,
+                                                     os.path.join(builds_dir, '.generated'))
+        entries.append((index_name, index_path, {'sha256': hash_file(index_path)}))
+
+    plan = []
+    files = {}
+    for name, path, entry in sorted(entries, key=lambda item: item[0]):
+        files[name] = entry
+        size = os.path.getsize(path)
+        mode = file_mode(path)
+        if previous_files.get(name) == entry and name in previous:
+            action = 'reuse'
+            if entry.get('transform') == 'strip':
+                stats.stripped_bytes += size - previous.info(name)[1]
+        else:
+            if entry.get('transform') == 'strip':
+                path = strip_shared_object(path, entry['sha256'], os.path.join(builds_dir, '.stripped'))
+                stats.stripped_bytes += size - os.path.getsize(path)
+                size = os.path.getsize(path)
+            action = 'stream' if size > STREAM_THRESHOLD else 'compress'
+        plan.append((name, path, action, size, mode))
+    to_compress = [path for name, path, action, size, mode in plan if action == 'compress']
+    compress_bytes = sum(size for name, path, action, size, mode in plan if action == 'compress')
+
+    # Write next to the destination first; the previous artifact may share its name.
+    writer = DeterministicZipWriter('{}.tmp'.format(zip_path))
+    try:
+        with stats.phase('compress'), worker_pool(jobs if compress_bytes >= PARALLEL_THRESHOLD else 1) as pool:
+            compressed = iter_compressed(pool, to_compress, jobs * 2)
+            for name, path, action, size, mode in plan:
+                if action == 'reuse':
+                    crc, size = previous.info(name)
+                    writer.write_raw(name, previous.iter_raw(name), crc, size, mode)
+                elif action == 'stream':
+                    writer.write_file(name, path, mode)
+                else:
+                    data, crc, size = next(compressed)
+                    writer.write_raw(name, [data], crc, size, mode)
+        with stats.phase('finalize'):
+            writer.close()
+            os.replace(writer.path, zip_path)
+            stats.bytes_out = os.path.getsize(zip_path)
+            artifact_digest = hash_file(zip_path)
+            write_manifest(builds_dir, {
+                'artifact': os.path.basename(zip_path),
+                'sha256': artifact_digest,
+                'files': files
+            })
+            record_sizes(stats, writer.entries, vendor_dir)
+    except BaseException:
+        if not writer.file.closed:
+            writer.abort()
+        raise
+    finally:
+        previous.close()
+    return {
+        'path': zip_path,
+        'sha256': artifact_digest,
+        'reused': sum(1 for name, path, action, size, mode in plan if action == 'reuse'),
+        'compressed': sum(1 for name, path, action, size, mode in plan if action != 'reuse'),
+        'stats': stats
+    }
+
+
+def list_functions(target):
+    """
+    :param target: Project root.
+    :return: Sorted names of the function directories.
+    """
+    functions_dir = os.path.join(target, FUNCTIONS_DIR)
+    if not os.path.isdir(functions_dir):
+        return []
+    return sorted(name for name in os.listdir(functions_dir)
+                  if os.path.isdir(os.path.join(functions_dir, name)) and name != '__pycache__')
+
+
+def function_selector(function, reached, vendor_dir):
+    """
+    Keep the shared project files, the function's own directory and the
+    python files of app/lib, models and serializers the function imports.
+    Vendored packages are filtered separately, through build_artifact's exclude.
+
+    :param function: Directory name below app/functions.
+    :param reached: Archive names of the project python files the function imports.
+    :param vendor_dir:
+    :return: Callable for build_artifact's select.
+    """
+    vendor_prefix = vendor_dir.strip('/') + '/'
+    function_prefix = '{}/{}/'.format(FUNCTIONS_DIR, function)
+    shared_prefixes = tuple(directory + '/' for directory in SHARED_DIRS)
+
+    def keep(name):
+        if name.startswith(vendor_prefix):
+            return True
+        if name.startswith(FUNCTIONS_DIR + '/'):
+            return name.startswith(function_prefix) or name == FUNCTIONS_DIR + '/__init__.py'
+        if name.startswith(shared_prefixes) and name.endswith('.py'):
+            return name in reached
+        return True
+
+    def select(sources):
+        return [(name, path) for name, path in sources if keep(name)]
+    return select
+
+
+def build_function_artifacts(target, builds_dir, name, jobs=None, vendor_dir='app/vendored', prune=None,
+                             bytecode=None, import_index=False, allow=None, vendor_loader=None):
+    """
+    Build one artifact per function directory, holding only the modules and
+    vendored packages that function imports. Each bundle keeps its own
+    manifest in builds/functions/<function> so it is rebuilt incrementally.
+    Bundles are built concurrently in threads; zlib and hashlib release the
+    GIL, so each bundle compresses in its own thread.
+
+    :param target: Project root.
+    :param builds_dir: Project builds directory.
+    :param name: App name from tight.yml.
+    :param jobs: Number of bundles built at once. Defaults to the CPU count.
+    :param vendor_dir:
+    :param prune: See build_artifact.
+    :param bytecode: See build_artifact.
+    :param import_index: See build_artifact.
+    :param allow: Module names that are imported dynamically, see tight_cli.imports.walk_app.
+    :param vendor_loader: From write_vendor_loader when vendored packages are
+                          deployed in a layer; bundles then leave them out like
+                          the app artifact does.
+    :return: Dict of function name -> build_artifact result.
+    """
+    functions = list_functions(target)
+    timestamp = int(time.time())
+
+    def build(function):
+        reached, unreachable = imports.function_closure(target, vendor_dir, function, allow)
+        function_dir = os.path.join(builds_dir, 'functions', function)
+        os.makedirs(function_dir, exist_ok=True)
+        zip_path = os.path.join(function_dir, '{}-{}-artifact-{}.zip'.format(name, function, timestamp))
+        function_select = function_selector(function, reached, vendor_dir)
+        layer_select = app_selector(vendor_dir, vendor_loader) if vendor_loader else None
+
+        def select(sources):
+            selected = function_select(sources)
+            return layer_select(selected) if layer_select else selected
+
+        return build_artifact(target, zip_path, function_dir, jobs=1, vendor_dir=vendor_dir, prune=prune,
+                              bytecode=bytecode, import_index=import_index, exclude=set(unreachable),
+                              select=select)
+
+    if not functions:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(functions))) as pool:
+        return dict(zip(functions, pool.map(build, functions)))
+
+
+VENDOR_LOADER = """# Generated by `tight generate artifact --layer`, do not edit.
+# Vendored packages are deployed in a Lambda layer; keep `app.vendored.<package>`
+# imports working by resolving them from the layer.
+import os
+
+if os.path.isdir({path!r}):
+    __path__.append({path!r})
+"""
+
+
+def tree_key(directory):
+    """
+    Fingerprint of the files below directory from their names, sizes and
+    modification times, so it changes however the files were installed.
+    Local bytecode is left out, as in collect_sources.
+
+    :param directory:
+    :return: Hex digest.
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(dirname for dirname in dirnames if dirname != BYTECODE_DIR)
+        for filename in sorted(filenames):
+            if filename.endswith(BYTECODE_SUFFIXES):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append([os.path.relpath(path, directory).replace(os.sep, '/'), stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps(entries).encode('utf-8')).hexdigest()
+
+
+def layer_key(vendored_key, prune=None, bytecode=None, exclude=None):
+    """
+    Identify the contents of a layer: the vendored files and the build
+    options that change what is shipped from them.
+
+    :param vendored_key: See tree_key.
+    :return: Hex digest.
+    """
+    key = {
+        'vendored': vendored_key,
+        'prune': None if prune is None else [[rule for rule, regex in prune.rules], prune.strip],
+        'bytecode': None if bytecode is None else bytecode.transform,
+        'exclude': sorted(exclude or [])
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def layer_path(builds_dir, name, key):
+    return os.path.join(builds_dir, LAYERS_DIR, '{}-layer-{}.zip'.format(name, key[:12]))
+
+
+def layer_selector(vendor_dir):
+    """
+    Ship the contents of vendor_dir below python/, where Lambda looks for
+    layer packages.
+    """
+    vendor_prefix = vendor_dir.strip('/') + '/'
+
+    def select(sources):
+        return [(LAYER_PREFIX + '/' + name[len(vendor_prefix):], path) for name, path in sources
+                if name.startswith(vendor_prefix) and name != vendor_prefix + '__init__.py']
+    return select
+
+
+def app_selector(vendor_dir, loader_path):
+    """
+    Leave vendor_dir out of the app artifact, except for a package __init__
+    that resolves `app.vendored.<package>` imports from the layer.
+    """
+    vendor_prefix = vendor_dir.strip('/') + '/'
+
+    def select(sources):
+        selected = [(name, path) for name, path in sources if not name.startswith(vendor_prefix)]
+        return sorted(selected + [(vendor_prefix + '__init__.py', loader_path)])
+    return select
+
+
+def write_vendor_loader(builds_dir):
+    """
+    :return: Path of the generated vendor_dir/__init__.py for layer builds.
+    """
+    generated_dir = os.path.join(builds_dir, '.generated')
+    os.makedirs(generated_dir, exist_ok=True)
+    path = os.path.join(generated_dir, 'vendor_loader.py')
+    with open(path, 'w') as loader:
+        loader.write(VENDOR_LOADER.format(path=LAYER_PATH))
+    return path
+
+
+def build_layer(target, builds_dir, name, key, jobs=None, vendor_dir='app/vendored', prune=None, bytecode=None,
+                exclude=None):
+    """
+    Build the layer zip for vendor_dir unless one already exists for key.
+    Older layers are removed.
+
+    :param target: Project root.
+    :param builds_dir: Project builds directory.
+    :param name: App name from tight.yml.
+    :param key: See layer_key.
+    :return: build_artifact result, or None when the layer is up to date.
+    """
+    zip_path = layer_path(builds_dir, name, key)
+    if os.path.isfile(zip_path):
+        return None
+    layer_dir = os.path.dirname(zip_path)
+    os.makedirs(layer_dir, exist_ok=True)
+    result = build_artifact(target, zip_path, layer_dir, jobs=jobs, vendor_dir=LAYER_PREFIX, prune=prune,
+                            bytecode=bytecode, exclude=exclude, select=layer_selector(vendor_dir))
+    for filename in os.listdir(layer_dir):
+        if filename.endswith('.zip') and os.path.join(layer_dir, filename) != zip_path:
+            os.remove(os.path.join(layer_dir, filename))
+    return result
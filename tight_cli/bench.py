@@ -0,0 +1,221 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from tight_cli import runtime
+
+# `tight bench` measures a function's handler: cold invocations in fresh
+# interpreters, warm invocations repeated in this one at a given concurrency,
+# and the memory a warm invocation allocates. Times are in milliseconds.
+
+# The event of the generated test_integration_<name>.py.
+DEFAULT_EVENT = {'httpMethod': 'GET'}
+RESULTS_VERSION = 1
+BENCH_DIR = 'builds/bench'
+PERCENTILES = [50, 95, 99]
+# Metrics compared with a baseline, and whether higher is better.
+COMPARED = [
+    ('cold.total.p50', False),
+    ('warm.latency.p50', False),
+    ('warm.latency.p95', False),
+    ('warm.latency.p99', False),
+    ('warm.throughput', True),
+    ('allocations.peak_bytes', False),
+]
+COLD_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from tight_cli import runtime
+target, vendor_dir, function = sys.argv[1:4]
+event = json.loads(sys.stdin.read())
+app = runtime.load_app(target, vendor_dir, env={})
+loaded = time.perf_counter()
+response = runtime.invoke(app, function, event)
+done = time.perf_counter()
+status = response.get('statusCode', 200) if isinstance(response, dict) else None
+print(json.dumps({'init': (loaded - start) * 1000, 'invoke': (done - loaded) * 1000, 'status': status}))
+'''
+
+
+def percentile(values, q):
+    """
+    Linearly interpolated percentile.
+
+    :param values: Sorted numbers.
+    :param q: 0-100.
+    :return:
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values):
+    values = sorted(values)
+    summary = {'p{}'.format(q): percentile(values, q) for q in PERCENTILES}
+    summary.update({
+        'min': values[0] if values else None,
+        'max': values[-1] if values else None,
+        'mean': sum(values) / len(values) if values else None,
+    })
+    return summary
+
+
+def run_cold(target, vendor_dir, function, event, runs, concurrency, env):
+    """
+    Invoke the function once in each of `runs` fresh interpreters.
+
+    :return: Dict of init, invoke and total summaries, plus errors.
+    """
+    command = [sys.executable, '-c', COLD_SCRIPT, target, vendor_dir, function]
+    payload = json.dumps(event)
+
+    def run(_):
+        result = subprocess.run(command, input=payload, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                cwd=target, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError('Cold invocation failed:\n{}'.format(result.stderr.strip()))
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(run, range(runs)))
+    return {
+        'runs': runs,
+        'errors': sum(1 for timing in timings if timing['status'] is None or int(timing['status']) >= 500),
+        'init': summarize([timing['init'] for timing in timings]),
+        'invoke': summarize([timing['invoke'] for timing in timings]),
+        'total': summarize([timing['init'] + timing['invoke'] for timing in timings]),
+    }
+
+
+def run_warm(app, function, event, requests, concurrency, warmup=1):
+    """
+    Invoke the function in this interpreter, `concurrency` at a time, after
+    `warmup` untimed invocations.
+
+    :return: Dict of latency summary, throughput (invocations per second) and errors.
+    """
+    payload = json.dumps(event)
+    for _ in range(warmup):
+        runtime.invoke(app, function, json.loads(payload))
+
+    def run(_):
+        # Handlers may change the event, so each gets its own copy.
+        request = json.loads(payload)
+        start = time.perf_counter()
+        try:
+            error = runtime.is_error(runtime.invoke(app, function, request))
+        except Exception:
+            error = True
+        return (time.perf_counter() - start) * 1000, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, range(requests)))
+    duration = time.perf_counter() - start
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, error in results if error),
+        'duration': duration,
+        'throughput': requests / duration if duration else None,
+        'latency': summarize([latency for latency, _ in results]),
+    }
+
+
+def measure_allocations(app, function, event, samples):
+    """
+    Memory allocated by warm invocations, traced one at a time since tracing
+    slows them down.
+
+    :return: Dict with the median peak and retained bytes per invocation.
+    """
+    payload = json.dumps(event)
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            request = json.loads(payload)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.clear_traces()
+            before = tracemalloc.get_traced_memory()[0]
+            runtime.invoke(app, function, request)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(max(0, peak - before))
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+    return {
+        'samples': samples,
+        'peak_bytes': int(percentile(sorted(peaks), 50)),
+        'retained_bytes': int(percentile(sorted(retained), 50)),
+    }
+
+
+def metric(results, path):
+    value = results
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(results, baseline, tolerance=0.0):
+    """
+    :param results: This run.
+    :param baseline: A saved run.
+    :param tolerance: Relative change in the wrong direction that isn't a regression, e.g. 0.1.
+    :return: List of (metric, current, baseline, relative change, regressed).
+    """
+    rows = []
+    for path, higher_is_better in COMPARED:
+        current, previous = metric(results, path), metric(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / float(previous)
+        worse = -change if higher_is_better else change
+        rows.append((path, current, previous, change, worse > tolerance))
+    return rows
+
+
+def results_path(target, function, timestamp):
+    stamp = '{}{:03d}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)), int(timestamp * 1000) % 1000)
+    return os.path.join(target, BENCH_DIR, '{}-{}.json'.format(function, stamp))
+
+
+def save(path, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
@@ -1,8 +1,50 @@
 import sys
 import os
 here = os.path.dirname(os.path.realpath(__file__))
-sys.path = [os.path.join(here, "./vendored")] + sys.path
-sys.path = [os.path.join(here, "./lib")] + sys.path
-sys.path = [os.path.join(here, "./models")] + sys.path
-sys.path = [os.path.join(here, "./serializers")] + sys.path
-sys.path = [os.path.join(here, "../")] + sys.path
+
+# Artifacts built with `tight generate artifact --import-index` ship
+# _import_index.py, a map of top level module name -> directory computed at
+# build time. A meta path finder resolves those names with one lookup instead
+# of adding the directories below to sys.path.
+try:
+    from ._import_index import MODULES
+except ImportError:
+    MODULES = None
+
+if MODULES is None:
+    sys.path = [os.path.join(here, "./vendored")] + sys.path
+    sys.path = [os.path.join(here, "./lib")] + sys.path
+    sys.path = [os.path.join(here, "./models")] + sys.path
+    sys.path = [os.path.join(here, "./serializers")] + sys.path
+    sys.path = [os.path.join(here, "../")] + sys.path
+else:
+    from importlib.machinery import PathFinder
+    root = os.path.dirname(here)
+
+    class ImportIndexFinder(object):
+        @classmethod
+        def find_spec(cls, fullname, path=None, target=None):
+            directory = MODULES.get(fullname) if path is None else None
+            if directory is None:
+                return None
+            return PathFinder.find_spec(fullname, [os.path.join(root, directory)], target)
+
+        @classmethod
+        def find_distributions(cls, context=None):
+            # Vendored distributions are importable through the index, but
+            # their directory isn't on sys.path. Searches of the import path
+            # (the default) also look there, for the requested name only.
+            try:
+                from importlib.metadata import DistributionFinder, MetadataPathFinder
+            except ImportError:
+                try:
+                    from importlib_metadata import DistributionFinder, MetadataPathFinder
+                except ImportError:
+                    return iter(())
+            context = context or DistributionFinder.Context()
+            if context.path is not sys.path:
+                return iter(())
+            return MetadataPathFinder.find_distributions(
+                DistributionFinder.Context(name=context.name, path=[os.path.join(here, 'vendored')]))
+
+    sys.meta_path.insert(0, ImportIndexFinder)
@@ -1,13 +1,59 @@
-from os.path import dirname, basename, isfile
-import glob
 import importlib
+import os
 import sys
-modules = glob.glob(dirname(__file__) + "/*.py")
-module_names = [basename(f)[:-3] for f in modules if isfile(f)]
-module_names.remove('__init__')
-current_module = sys.modules[__name__]
-for class_name in module_names:
-    model_class = getattr(importlib.import_module(class_name, package=class_name), class_name)
-    setattr(current_module, class_name, model_class)
-
-__all__ = module_names
+import types
+here = os.path.dirname(os.path.realpath(__file__))
+
+# Classes are imported on first access, so a handler only pays for the
+# modules it uses: through module level __getattr__ (PEP 562) on Python 3.7+
+# and a module subclass on 3.6. get_model(name) does the same explicitly.
+# `tight generate model` and `tight generate artifact` write _index.py, a
+# static class name -> module map, so the directory doesn't have to be listed
+# at runtime.
+try:
+    from ._index import MODULES
+except ImportError:
+    MODULES = dict((f[:-3], f[:-3]) for f in os.listdir(here) if f.endswith('.py') and not f.startswith('_'))
+
+__all__ = sorted(MODULES)
+
+
+def get_model(name):
+    """
+    Import a class by name on first use.
+
+    :param name: Class name, e.g. Account.
+    :return:
+    """
+    if name in MODULES and name in globals():
+        return globals()[name]
+    module_name = MODULES.get(name)
+    if module_name is None and not name.startswith('_') and os.path.isfile(os.path.join(here, name + '.py')):
+        # Added since the index was generated.
+        module_name = name
+    if module_name is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __getattr__(name):
+    return get_model(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(MODULES))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ is ignored before 3.7, but attribute lookups
+    # on a module subclass fall back to its __getattr__.
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            return get_model(name)
+
+        def __dir__(self):
+            return __dir__()
+
+    sys.modules[__name__].__class__ = _LazyModule
@@ -0,0 +1,153 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+# Runs under the target interpreter so the bytecode matches the Lambda
+# runtime. Python 3.7+ gets unchecked hash based pycs (PEP 552) which are
+# never validated against the source; older versions get timestamp pycs whose
+# mtime matches the fixed timestamp of every artifact entry, so the
+# interpreter accepts them on Lambda's read-only filesystem.
+COMPILE_SCRIPT = '''
+import importlib.util, json, marshal, struct, sys
+ZIP_EPOCH = 315532800
+skipped = []
+for source, destination, dfile, optimize in json.load(sys.stdin):
+    with open(source, 'rb') as source_file:
+        data = source_file.read()
+    try:
+        code = compile(data, dfile, 'exec', dont_inherit=True, optimize=optimize)
+    except (SyntaxError, ValueError):
+        skipped.append(dfile)
+        continue
+    if sys.version_info >= (3, 7):
+        header = importlib.util.MAGIC_NUMBER + struct.pack('<I', 0b01) + importlib.util.source_hash(data)
+    else:
+        header = importlib.util.MAGIC_NUMBER + struct.pack('<II', ZIP_EPOCH, len(data) & 0xFFFFFFFF)
+    with open(destination, 'wb') as destination_file:
+        destination_file.write(header + marshal.dumps(code))
+json.dump(skipped, sys.stdout)
+'''
+TAG_SCRIPT = 'import sys; print(sys.implementation.cache_tag)'
+ENTRYPOINT = 'app_index.py'
+
+
+class BytecodeOptions(object):
+    """
+    How `generate artifact --precompile` compiles python sources.
+
+    :param interpreter: Interpreter matching the Lambda runtime.
+    :param cache_tag: e.g. cpython-36
+    :param optimize: Optimization level passed to compile().
+    :param sourceless: Ship only .pyc files in place of the sources.
+    """
+
+    def __init__(self, interpreter, cache_tag, optimize=0, sourceless=False):
+        self.interpreter = interpreter
+        self.cache_tag = cache_tag
+        self.optimize = optimize
+        self.sourceless = sourceless
+
+    @property
+    def transform(self):
+        return 'bytecode:{}:{}:{}'.format(self.cache_tag, self.optimize, 'sourceless' if self.sourceless else 'cached')
+
+
+def find_interpreter(runtime=None):
+    """
+    Locate an interpreter for a Lambda runtime such as `python3.6`.
+
+    :param runtime: Runtime name or version. Defaults to the running interpreter.
+    :return: Path to the interpreter.
+    """
+    if not runtime:
+        return sys.executable
+    match = re.match(r'^(?:python)?(\d+)\.(\d+)$', str(runtime))
+    if not match:
+        raise ValueError('Unrecognized runtime {}'.format(runtime))
+    version = (int(match.group(1)), int(match.group(2)))
+    if sys.version_info[:2] == version:
+        return sys.executable
+    interpreter = shutil.which('python{}.{}'.format(*version))
+    if not interpreter:
+        raise ValueError('python{}.{} is required to precompile for this runtime.'.format(*version))
+    return interpreter
+
+
+def load_options(runtime=None, optimize=0, sourceless=False):
+    interpreter = find_interpreter(runtime)
+    cache_tag = subprocess.check_output([interpreter, '-c', TAG_SCRIPT], universal_newlines=True).strip()
+    return BytecodeOptions(interpreter, cache_tag, optimize, sourceless)
+
+
+def compiled_name(name, options):
+    """
+    Archive name of the bytecode for a source. Sourceless bytecode replaces
+    the source (legacy layout) and is loaded whatever the interpreter's
+    optimization level; otherwise it goes where the interpreter looks for it,
+    __pycache__/<module>.<tag>.pyc, or <module>.<tag>.opt-<level>.pyc when
+    optimized so it is only used with a matching PYTHONOPTIMIZE.
+
+    :param name: Archive name of the .py source.
+    :param options: BytecodeOptions
+    :return:
+    """
+    if options.sourceless and name != ENTRYPOINT:
+        return name + 'c'
+    directory, filename = os.path.split(name)
+    parts = [filename[:-3], options.cache_tag]
+    if options.optimize:
+        parts.append('opt-{}'.format(options.optimize))
+    return '/'.join(part for part in [directory, '__pycache__', '.'.join(parts + ['pyc'])] if part)
+
+
+def compile_sources(options, sources, cache_dir):
+    """
+    Compile sources, reusing bytecode compiled by previous builds.
+
+    :param options: BytecodeOptions
+    :param sources: List of (archive name, path, sha256) tuples for .py files.
+    :param cache_dir:
+    :return: Tuple of (dict of archive name -> compiled file path, list of
+             archive names that are not valid for the runtime and stay source only).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    compiled = {}
+    pending = []
+    for name, path, digest in sources:
+        key = hashlib.sha256('{}:{}:{}'.format(name, digest, options.transform).encode('utf-8')).hexdigest()
+        destination = os.path.join(cache_dir, '{}.pyc'.format(key))
+        compiled[name] = destination
+        if not os.path.isfile(destination):
+            pending.append([path, destination, name, options.optimize])
+    skipped = []
+    if pending:
+        process = subprocess.Popen([options.interpreter, '-c', COMPILE_SCRIPT], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        output, errors = process.communicate(json.dumps(pending))
+        if process.returncode != 0:
+            for path, destination, name, optimize in pending:
+                if os.path.exists(destination):
+                    os.remove(destination)
+            raise ValueError('Could not compile sources:\n{}'.format(errors))
+        skipped = json.loads(output)
+        for name in skipped:
+            del compiled[name]
+    return compiled, skipped
@@ -0,0 +1,404 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.client
+import http.server
+import json
+import math
+import os
+import re
+import socketserver
+import threading
+import time
+
+# `tight dynamo rundb --record` puts a proxy in front of DynamoDB Local that
+# records, per table and index, how many read and write capacity units each
+# request would consume on DynamoDB and the size of the items involved.
+# `tight dynamo capacity` turns the recording into provisioned throughput and
+# index suggestions in schemas/capacity.yml, which generateschema applies.
+
+RECORDING = 'recording.json'
+RECORDING_VERSION = 1
+RECOMMENDATIONS = 'schemas/capacity.yml'
+TARGET_PREFIX = 'DynamoDB_20120810.'
+# Bytes per read (strongly consistent) and write capacity unit.
+READ_UNIT = 4096
+WRITE_UNIT = 1024
+# Recommended capacity is the peak units per second times this.
+DEFAULT_HEADROOM = 1.2
+# Key used for the table itself next to its indexes.
+TABLE = ''
+# Headers not passed through the proxy.
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'host', 'proxy-connection', 'upgrade'}
+
+
+def attribute_size(value):
+    """
+    Size of a DynamoDB attribute value as DynamoDB bills it.
+
+    :param value: Typed attribute value, e.g. {'S': 'abc'}.
+    :return: Bytes.
+    """
+    kind, data = next(iter(value.items()))
+    if kind == 'S':
+        return len(data.encode('utf-8'))
+    if kind == 'N':
+        digits = data.lstrip('-').replace('.', '').split('e')[0].split('E')[0].strip('0')
+        return int(math.ceil(len(digits) / 2.0)) + 1
+    if kind == 'B':
+        return len(data) * 3 // 4 - data.count('=')
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind in ('SS', 'NS', 'BS'):
+        return sum(attribute_size({kind[0]: element}) for element in data)
+    if kind == 'L':
+        return 3 + sum(1 + attribute_size(element) for element in data)
+    if kind == 'M':
+        return 3 + sum(1 + item_size({name: element}) for name, element in data.items())
+    return 0
+
+
+def item_size(item):
+    """
+    :param item: Dict of attribute name -> typed value.
+    :return: Bytes.
+    """
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in (item or {}).items())
+
+
+def read_units(size, consistent=False):
+    units = max(1, int(math.ceil(size / float(READ_UNIT))))
+    return units if consistent else units / 2.0
+
+
+def write_units(size):
+    return max(1, int(math.ceil(size / float(WRITE_UNIT))))
+
+
+def filter_attributes(request):
+    """
+    Attributes a Scan or Query filters on by equality; candidates for an index.
+
+    :param request:
+    :return: List of attribute names.
+    """
+    attributes = [name for name, condition in sorted((request.get('ScanFilter') or request.get('QueryFilter') or {}).items())
+                  if condition.get('ComparisonOperator') == 'EQ']
+    names = request.get('ExpressionAttributeNames', {})
+    for name in re.findall(r'([#\w.]+)\s*=\s*:', request.get('FilterExpression', '')):
+        attributes.append(names.get(name, name))
+    return attributes
+
+
+class Recorder(object):
+    """
+    Accumulates the capacity consumed per table and index, in one second
+    buckets so peaks can be found. Safe to use from several threads.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or time.time
+        self.started = self.clock()
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.filters = {}
+        self.requests = 0
+
+    def usage(self, table, index=None):
+        return self.tables.setdefault(table, {}).setdefault(index or TABLE, {
+            'reads': 0, 'writes': 0, 'read_units': {}, 'write_units': {}, 'items': 0, 'item_bytes': 0,
+            'max_item_bytes': 0, 'scans': 0
+        })
+
+    def average_item(self, table, default):
+        usage = self.tables.get(table, {}).get(TABLE)
+        if not usage or not usage['items']:
+            return default
+        return usage['item_bytes'] / float(usage['items'])
+
+    def add(self, second, table, index, kind, units, sizes=()):
+        usage = self.usage(table, index)
+        usage[kind + 's'] += 1
+        buckets = usage[kind + '_units']
+        buckets[second] = buckets.get(second, 0) + units
+        for size in sizes:
+            usage['items'] += 1
+            usage['item_bytes'] += size
+            usage['max_item_bytes'] = max(usage['max_item_bytes'], size)
+
+    def record(self, operation, request, response):
+        """
+        Record one successful request.
+
+        :param operation: e.g. GetItem.
+        :param request: Decoded request body.
+        :param response: Decoded response body.
+        :return:
+        """
+        second = str(int(self.clock()))
+        with self.lock:
+            self.requests += 1
+            table = request.get('TableName')
+            if operation == 'GetItem':
+                size = item_size(response.get('Item'))
+                self.add(second, table, None, 'read', read_units(size, request.get('ConsistentRead')),
+                         [size] if response.get('Item') else [])
+            elif operation == 'BatchGetItem':
+                for name, items in response.get('Responses', {}).items():
+                    consistent = request['RequestItems'].get(name, {}).get('ConsistentRead')
+                    for item in items:
+                        size = item_size(item)
+                        self.add(second, name, None, 'read', read_units(size, consistent), [size])
+            elif operation in ('Query', 'Scan'):
+                index = request.get('IndexName')
+                sizes = [item_size(item) for item in response.get('Items', [])]
+                count = response.get('Count', len(sizes))
+                scanned = response.get('ScannedCount', count)
+                # Filtered out items are read and billed too.
+                if sizes:
+                    evaluated = sum(sizes) * scanned / float(count)
+                else:
+                    evaluated = scanned * self.average_item(table, 0)
+                self.add(second, table, index, 'read', read_units(evaluated, request.get('ConsistentRead')),
+                         sizes if not index else [])
+                usage = self.usage(table, index)
+                if operation == 'Scan':
+                    usage['scans'] += 1
+                for attribute in filter_attributes(request):
+                    counts = self.filters.setdefault(table, {}).setdefault(operation, {})
+                    key = '{}:{}'.format(index or TABLE, attribute)
+                    counts[key] = counts.get(key, 0) + 1
+            elif operation == 'PutItem':
+                size = item_size(request.get('Item'))
+                self.add(second, table, None, 'write', write_units(size), [size])
+            elif operation in ('UpdateItem', 'DeleteItem'):
+                # Without returned attributes the item size isn't known; use
+                # the average item seen so far.
+                if response.get('Attributes'):
+                    size = item_size(response['Attributes'])
+                else:
+                    size = self.average_item(table, item_size(request.get('Key')))
+                self.add(second, table, None, 'write', write_units(size))
+            elif operation == 'BatchWriteItem':
+                for name, writes in request.get('RequestItems', {}).items():
+                    for write in writes:
+                        if 'PutRequest' in write:
+                            size = item_size(write['PutRequest'].get('Item'))
+                            self.add(second, name, None, 'write', write_units(size), [size])
+                        else:
+                            size = self.average_item(name, item_size(write.get('DeleteRequest', {}).get('Key')))
+                            self.add(second, name, None, 'write', write_units(size))
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'version': RECORDING_VERSION,
+                'started': self.started,
+                'duration': self.clock() - self.started,
+                'requests': self.requests,
+                'tables': json.loads(json.dumps(self.tables)),
+                'filters': json.loads(json.dumps(self.filters)),
+            }
+
+    def save(self, path):
+        temporary = '{}.tmp'.format(path)
+        with open(temporary, 'w') as recording:
+            json.dump(self.to_dict(), recording, indent=1, sort_keys=True)
+        os.replace(temporary, path)
+
+
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def forward(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_HEADERS}
+        connection = http.client.HTTPConnection('localhost', self.server.upstream_port, timeout=60)
+        try:
+            connection.request(self.command, self.path, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.send_error(502, 'DynamoDB Local is not reachable ({})'.format(e))
+            return
+        finally:
+            connection.close()
+        self.send_response(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_HEADERS and name.lower() != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        target = self.headers.get('X-Amz-Target', '')
+        if response.status == 200 and target.startswith(TARGET_PREFIX) and body:
+            try:
+                self.server.recorder.record(target[len(TARGET_PREFIX):], json.loads(body.decode('utf-8')),
+                                            json.loads(payload.decode('utf-8')))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                pass
+
+    do_GET = forward
+    do_POST = forward
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingProxy(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, upstream_port, recorder):
+        self.upstream_port = upstream_port
+        self.recorder = recorder
+        http.server.HTTPServer.__init__(self, ('localhost', port), ProxyHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def short_name(table_name, env=None):
+    """
+    Table name without the NAME-STAGE- prefix, so recommendations apply to
+    every stage.
+    """
+    env = os.environ if env is None else env
+    prefix = '{}-{}-'.format(env.get('NAME'), env.get('STAGE'))
+    return table_name[len(prefix):] if table_name.startswith(prefix) else table_name
+
+
+def peak(buckets):
+    return max(buckets.values()) if buckets else 0
+
+
+def merge(*buckets):
+    merged = {}
+    for bucket in buckets:
+        for second, units in bucket.items():
+            merged[second] = merged.get(second, 0) + units
+    return merged
+
+
+def recommend(recording, models, headroom=DEFAULT_HEADROOM, env=None):
+    """
+    Provisioned throughput and index suggestions for the recorded tables.
+
+    Capacity is the peak units per second times headroom, at least 1. Local
+    secondary indexes share the table's capacity, so their reads are added to
+    the table. Every write to a table may also write each of its global
+    indexes, so they are given the table's write capacity.
+
+    :param recording: Recorder.to_dict().
+    :param models: Model dicts from schema.discover_models.
+    :param headroom:
+    :param env: See schema.table_name.
+    :return: Dict with 'tables' (short name -> read, write, global_indexes)
+             and 'indexes' (short name -> list of suggested indexes).
+    """
+    from tight_cli import schema
+
+    def capacity(units):
+        return max(1, int(math.ceil(units * headroom)))
+
+    definitions = {}
+    for model in models:
+        try:
+            definitions[schema.table_name(model, env)] = model
+        except ValueError:
+            continue
+    tables = {}
+    suggestions = {}
+    for table, usages in sorted(recording['tables'].items()):
+        model = definitions.get(table)
+        global_names = {index['name'] for index in model['global_indexes']} if model else None
+        table_usage = usages.get(TABLE, {'read_units': {}, 'write_units': {}})
+        reads = [table_usage['read_units']]
+        global_indexes = {}
+        write = capacity(peak(table_usage['write_units']))
+        for index, usage in sorted(usages.items()):
+            if index == TABLE:
+                continue
+            if global_names is None or index in global_names:
+                global_indexes[index] = {'read': capacity(peak(usage['read_units'])), 'write': write}
+            else:
+                reads.append(usage['read_units'])
+        entry = {'read': capacity(peak(merge(*reads))), 'write': write}
+        if global_indexes:
+            entry['global_indexes'] = global_indexes
+        name = short_name(table, env)
+        tables[name] = entry
+
+        indexed = set()
+        if model:
+            indexed.update(index['hash_key'] for index in model['global_indexes'])
+            indexed.update(field for field, options in model['fields'].items() if options['index'])
+            indexed.update([model['hash_key'], model['range_key']])
+        for operation, counts in sorted(recording.get('filters', {}).get(table, {}).items()):
+            for key, count in sorted(counts.items()):
+                index, attribute = key.split(':', 1)
+                if attribute in indexed or index != TABLE:
+                    continue
+                # Scans filtered on an attribute want a global index hashed on
+                # it; filtered queries want a local index ranged on it.
+                suggestions.setdefault(name, []).append({
+                    'type': 'global' if operation == 'Scan' else 'local',
+                    'attribute': attribute,
+                    'requests': count,
+                })
+    return {'tables': tables, 'indexes': suggestions}
+
+
+def write_recommendations(target, recommendations):
+    import yaml
+    path = os.path.join(target, RECOMMENDATIONS)
+    with open(path, 'w') as recommendations_file:
+        recommendations_file.write('# Written by `tight dynamo capacity`, applied by `tight dynamo generateschema`.\n')
+        recommendations_file.write(yaml.safe_dump(recommendations, default_flow_style=False))
+    return path
+
+
+def load_recommendations(target):
+    """
+    :param target: Project root.
+    :return: Short table name -> recommended capacity, empty without schemas/capacity.yml.
+    """
+    import yaml
+    try:
+        with open(os.path.join(target, RECOMMENDATIONS)) as recommendations_file:
+            return (yaml.safe_load(recommendations_file) or {}).get('tables') or {}
+    except (IOError, OSError):
+        return {}
+
+
+def apply(kwargs, entry):
+    """
+    Replace the throughput in CreateTable arguments with a recommendation.
+
+    :param kwargs: CreateTable arguments.
+    :param entry: Recommendation for the table, or None.
+    :return: kwargs
+    """
+    if not entry:
+        return kwargs
+    kwargs['ProvisionedThroughput'] = {'ReadCapacityUnits': entry['read'], 'WriteCapacityUnits': entry['write']}
+    indexes = entry.get('global_indexes') or {}
+    for index in kwargs.get('GlobalSecondaryIndexes', []):
+        if index['IndexName'] in indexes:
+            index['ProvisionedThroughput'] = {'ReadCapacityUnits': indexes[index['IndexName']]['read'],
+                                              'WriteCapacityUnits': indexes[index['IndexName']]['write']}
+    return kwargs
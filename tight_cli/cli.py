@@ -17,23 +17,15 @@ import sys
 import shutil
 import subprocess
 import time
-import importlib
 import click
-from os.path import basename, isfile
+from os.path import basename
 import glob
-
-import yaml
-from inflector import Inflector, English
-from colorama import init
-from termcolor import colored
-from jinja2 import Template
-from dynamo3 import DynamoDBConnection
 from collections import namedtuple
-from flywheel import Engine
 
-init()
+# Heavy dependencies (yaml, jinja2, inflector, colorama, termcolor, dynamo3 and
+# flywheel) are imported inside the commands that use them so that
+# `tight --help` and small commands don't pay for the whole stack on startup.
 
-INFLECTOR = Inflector(English)
 HERE = os.path.dirname(os.path.realpath(__file__))
 LAMBDA_APP_TEMPLATES = '{}/blueprints/providers/aws/lambda_app/templates'.format(HERE)
 CWD = os.getcwd()
@@ -45,10 +37,11 @@ ENV_DIST = '{}/env.dist.yml'.format(CWD)
 Retrieves and loads local project config. E.g. /path/to/project/tight.yml
 """
 def get_config(target):
+    import yaml
     config = {}
     try:
         with open('{}/tight.yml'.format(target)) as tight_config:
-            config = yaml.load(tight_config)
+            config = yaml.safe_load(tight_config)
     except Exception as e:
         pass
 
@@ -59,19 +52,41 @@ if CONFIG and 'vendor_dir' in CONFIG:
     VENDOR_DIR = CONFIG['vendor_dir']
 
 VENDOR_REQUIREMENTS_FILE = 'requirements-vendor.txt'
+FUNCTION_CHECKS = ['scoped', 'smoke', 'none', 'all']
+FUNCTION_TEST_DIRS = ['tests/functions/unit/{}', 'tests/functions/integration/{}']
 TESTS_DIR = '{}/tests'.format(CWD)
 
 
-def get_template(template_root, template):
+def get_template(template_root, template, target=None):
     """
     Helper function for retrieving a jinja2 template.
+
+    Templates are loaded through a shared Environment backed by an on-disk
+    bytecode cache. When target is inside a project, templates found in
+    <project>/templates take precedence over the packaged ones.
     :param template_root:
     :param template:
+    :param target:
     :return:
     """
-    with open('{}/{}'.format(template_root, template), 'r') as handler_template:
-        template = Template(handler_template.read())
-    return template
+    from tight_cli import templates
+    return templates.get_template(template_root, template, target)
+
+
+_INFLECTOR = None
+_COLORS_INITIALIZED = False
+
+
+def get_inflector():
+    """
+    Lazily build the shared English inflector.
+    :return:
+    """
+    global _INFLECTOR
+    if _INFLECTOR is None:
+        from inflector import Inflector, English
+        _INFLECTOR = Inflector(English)
+    return _INFLECTOR
 
 
 def color(message):
@@ -80,6 +95,12 @@ def color(message):
     :param message:
     :return:
     """
+    global _COLORS_INITIALIZED
+    from termcolor import colored
+    if not _COLORS_INITIALIZED:
+        from colorama import init
+        init()
+        _COLORS_INITIALIZED = True
     return colored(message, 'yellow', 'on_grey')
 
 
@@ -124,8 +145,10 @@ def app(provider, type, target, name):
 @click.option('--provider', default='aws', help='Platform providers', type=click.Choice(['aws']))
 @click.option('--type', default='lambda_proxy', help='Function type', type=click.Choice(['lambda_proxy']))
 @click.option('--target', default=CWD, help='Location where app will be created.')
+@click.option('--tests', default='scoped', type=click.Choice(FUNCTION_CHECKS),
+              help='Check to run afterwards: the new function\'s tests, an import of its handler, no check or the whole suite.')
 @click.argument('name')
-def function(provider, type, target, name):
+def function(provider, type, target, tests, name):
     """
     Generate a "function" within a project. Common usage:
 
@@ -152,52 +175,166 @@ def function(provider, type, target, name):
                 render_controller/
                     test_unit_render_controller.py
 
+    Afterwards only the new function's unit and integration tests are run.
+    Pass `--tests smoke` to just import the handler, `--tests none` to skip
+    the check or `--tests all` to run the whole suite.
+
     :param provider:
     :param type:
     :param target:
+    :param tests:
     :param name:
     :return:
     """
+    start = time.time()
     function_dir = '{}/app/functions/{}'.format(target, name)
-    try:
-        os.mkdir(function_dir)
-    except Exception as e:
-        if e.strerror == 'File exists':
-            raise click.BadParameter('Function already exists!', param_hint='NAME')
-        else:
-            raise Exception('Cannot create function dir')
-
-    with open('{}/__init__.py'.format(function_dir), 'w') as file:
-        file.write('')
+    if os.path.exists(function_dir):
+        raise click.BadParameter('Function already exists!', param_hint='NAME')
+    if not os.path.isdir(os.path.dirname(function_dir)):
+        raise Exception('Cannot create function dir')
+    write_files(render_function(target, name))
+    click.echo(color(message='Successfully generated function and tests! ({:.2f}s)'.format(time.time() - start)))
+    check_functions(target, [name], tests)
 
-    template = get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller.jinja2')
 
-    with open('{}/handler.py'.format(function_dir), 'w') as file:
-        file.write(template.render())
+def render_function(target, name):
+    """
+    Render the files of a new function and its test stubs.
 
+    :param target: Project root.
+    :param name: Function name.
+    :return: List of (path, contents).
+    """
+    function_dir = '{}/app/functions/{}'.format(target, name)
     integration_test_dir = '{}/tests/functions/integration/{}'.format(target, name)
-    integration_test_expectations_dir = '{}/tests/functions/integration/{}/expectations'.format(target, name)
     unit_test_dir = '{}/tests/functions/unit/{}'.format(target, name)
+    return [
+        ('{}/__init__.py'.format(function_dir), ''),
+        ('{}/handler.py'.format(function_dir),
+         get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller.jinja2', target).render()),
+        ('{}/test_integration_{}.py'.format(integration_test_dir, name),
+         get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_integration_test.jinja2', target).render(name=name)),
+        ('{}/test_unit_{}.py'.format(unit_test_dir, name),
+         get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_unit_test.jinja2', target).render(name=name)),
+        ('{}/expectations/test_get_method.yml'.format(integration_test_dir),
+         get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_get_expectation.jinja2', target).render(name=name)),
+    ]
+
+
+def write_files(files, jobs=None):
+    """
+    Write rendered files, creating their directories.
 
-    os.mkdir(integration_test_dir)
-    os.mkdir(integration_test_expectations_dir)
-    os.mkdir(unit_test_dir)
+    :param files: List of (path, contents).
+    :param jobs: Files written at once. Defaults to the CPU count.
+    :return:
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def write(item):
+        path, contents = item
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(contents)
 
-    with open('{}/test_integration_{}.py'.format(integration_test_dir, name), 'w') as file:
-        template = get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_integration_test.jinja2')
-        file.write(template.render(name=name))
+    if len(files) == 1 or jobs == 1:
+        for item in files:
+            write(item)
+        return
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        list(pool.map(write, files))
 
-    with open('{}/test_unit_{}.py'.format(unit_test_dir, name), 'w') as file:
-        template = get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_unit_test.jinja2')
-        file.write(template.render(name=name))
 
-    with open('{}/test_get_method.yml'.format(integration_test_expectations_dir, name), 'w') as file:
-        template = get_template(LAMBDA_APP_TEMPLATES, 'lambda_proxy_controller_get_expectation.jinja2')
-        file.write(template.render(name=name))
+def check_functions(target, names, tests):
+    """
+    Run the post generation check for newly generated functions and report
+    how long it took.
 
-    command = ['py.test', '{}/tests'.format(target)]
-    subprocess.call(command)
-    click.echo(color(message='Successfully generated function and tests!'))
+    :param target: Project root.
+    :param names: Function names.
+    :param tests: One of FUNCTION_CHECKS.
+    :return: Exit code of the check, 0 when skipped.
+    """
+    if tests == 'none':
+        return 0
+    start = time.time()
+    if tests == 'smoke':
+        from tight_cli.runtime import project_env
+        # Handlers are imported under the same environment as serve, bench and invoke.
+        script = '; '.join('import app.functions.{}.handler'.format(name) for name in names)
+        code = run_command([sys.executable, '-c', script], cwd=target, env=project_env(target))
+    elif tests == 'all':
+        code = run_command(['py.test', '{}/tests'.format(target)])
+    else:
+        test_dirs = ['{}/{}'.format(target, pattern.format(name)) for name in names for pattern in FUNCTION_TEST_DIRS]
+        code = run_command(['py.test'] + [test_dir for test_dir in test_dirs if os.path.isdir(test_dir)])
+    message = 'passed' if code == 0 else 'failed (exit code {})'.format(code)
+    click.echo(color(message='Check ({}) {} in {:.2f}s'.format(tests, message, time.time() - start)))
+    return code
+
+
+@click.command()
+@click.option('--target', default=CWD, help='Project root.')
+@click.option('--manifest', default=None, type=click.Path(exists=True, dir_okay=False), help='YAML file listing functions and models.')
+@click.option('--model', 'models', multiple=True, help='Model to generate, may be repeated.')
+@click.option('--tests', default='scoped', type=click.Choice(FUNCTION_CHECKS), help='Check to run once everything is written.')
+@click.option('--jobs', default=None, type=click.IntRange(min=1), help='Files written at once. Defaults to the CPU count.')
+@click.argument('functions', nargs=-1)
+def batch(target, manifest, models, tests, jobs, functions):
+    """
+    Generate many functions and models at once:
+
+    tight generate batch orders accounts --model order --model account
+
+    or from a manifest:
+
+    functions:
+      - orders
+      - accounts
+    models:
+      - order
+      - account
+
+    Everything is rendered in one process and written concurrently, then a
+    single check runs over all the new functions (see generate function).
+
+    :param target:
+    :param manifest:
+    :param models:
+    :param tests:
+    :param jobs:
+    :param functions:
+    :return:
+    """
+    start = time.time()
+    functions = list(functions)
+    models = list(models)
+    if manifest:
+        import yaml
+        with open(manifest) as manifest_file:
+            entries = yaml.safe_load(manifest_file) or {}
+        functions += entries.get('functions') or []
+        models += entries.get('models') or []
+    if not functions and not models:
+        raise click.UsageError('Nothing to generate, pass function names, --model or --manifest.')
+    duplicates = sorted(set(name for name in functions if functions.count(name) > 1))
+    existing = [name for name in functions if os.path.exists('{}/app/functions/{}'.format(target, name))]
+    if duplicates or existing:
+        raise click.BadParameter('Functions already exist or are listed twice: {}'.format(', '.join(sorted(set(duplicates + existing)))),
+                                 param_hint='FUNCTIONS')
+    if functions and not os.path.isdir('{}/app/functions'.format(target)):
+        raise Exception('Cannot create function dir')
+
+    models_dir = '{}/app/models'.format(target)
+    files = [item for name in functions for item in render_function(target, name)]
+    files += [render_model(models_dir, name) for name in models]
+    write_files(files, jobs)
+    if models:
+        write_registry_index(models_dir)
+    click.echo(color(message='Generated {} functions and {} models ({} files) in {:.2f}s'.format(
+        len(functions), len(models), len(files), time.time() - start)))
+    if functions:
+        check_functions(target, functions, tests)
 
 
 def generate_app_aws_lambda(name, target):
@@ -210,7 +347,7 @@ def generate_app_aws_lambda(name, target):
     """
     HERE = os.path.dirname(os.path.realpath(__file__))
     shutil.copytree('{}/blueprints/providers/aws/lambda_app/starter'.format(HERE), '{}/{}'.format(target, name))
-    app_name = INFLECTOR.underscore(name).replace('_', '-')
+    app_name = get_inflector().underscore(name).replace('_', '-')
     with open('{}/{}/tight.yml'.format(target, name), 'w') as tight_yml:
         template = get_template(LAMBDA_APP_TEMPLATES, 'tight.yml.jinja2')
         tight_yml.write(template.render(name=app_name))
@@ -233,7 +370,7 @@ def pip():
 
 
 def run_command(command, **kwargs):
-    subprocess.call(command, **kwargs)
+    return subprocess.call(command, **kwargs)
 
 
 @click.command()
@@ -241,6 +378,9 @@ def run_command(command, **kwargs):
 @click.option('--requirements/--no-requirements', default=False)
 @click.option('--requirements-file', default=VENDOR_REQUIREMENTS_FILE, help='Requirements file location', type=click.Choice([VENDOR_REQUIREMENTS_FILE]))
 @click.option('--target', default=CWD, help='Target directory.')
+@click.option('--cache/--no-cache', default=True, help='Restore --requirements installs from the machine level vendor cache.')
+@click.option('--refresh-cache', is_flag=True, default=False, help='Reinstall and replace the cached vendor tree.')
+@click.option('--jobs', default=None, type=click.IntRange(min=1), help='Packages installed in parallel. Defaults to the CPU count.')
 def install(*args, **kwargs):
     """
     Install pip dependencies in a lambda compatible manner.
@@ -253,6 +393,18 @@ def install(*args, **kwargs):
 
     tight pip install --requirements
 
+    Installs from requirements are cached per machine, keyed by the resolved
+    requirements, Python version and platform. When every requirement is
+    pinned (name==version) and was installed before, the cached tree is
+    copied into the vendor dir without running pip. Other requirements are
+    resolved first so new releases are picked up; offline, their last
+    resolution is used. Cached trees are shared between projects.
+
+    The dependency set is resolved once up front; packages provided by the
+    Lambda runtime (boto3, botocore) and dependencies only they need are left
+    out before anything is downloaded, and the remaining packages are
+    installed in parallel.
+
     :param args:
     :param kwargs:
     :return:
@@ -267,6 +419,9 @@ def install(*args, **kwargs):
         click.echo(color(message='Installing pacakage {}'.format(vendor_dir_path)))
         command = ['pip', 'install', package_name, '-t', vendor_dir_path, '--upgrade']
         run_command(command)
+        from tight_cli import vendor
+        # The vendor dir no longer matches a cache entry.
+        vendor.remove_marker(vendor_dir_path)
         click.echo(color(message='Installed {}'.format(package_name)))
 
         with open(requirements_file_path, 'r') as read_file:
@@ -276,19 +431,51 @@ def install(*args, **kwargs):
                     append_file.write('\n{}'.format(package_name))
 
     elif kwargs.pop('requirements'):
-        command = ['pip', 'install', '-r', requirements_file_path, '-t',
-                   vendor_dir_path, '--upgrade']
-        run_command(command)
-        botocore_path = '{}/botocore'.format(vendor_dir_path)
-        boto3_path = '{}/boto3'.format(vendor_dir_path)
-        if os.path.exists(botocore_path):
-            shutil.rmtree(botocore_path)
-            run_command(['rm -rf {}-*'.format(botocore_path)], shell=True)
-            click.echo(color(message='Removed botocore from {}'.format(vendor_dir_path)))
-        if os.path.exists(boto3_path):
-            shutil.rmtree(boto3_path)
-            run_command(['rm -rf {}-*'.format(boto3_path)], shell=True)
-            click.echo(color(message='Removed boto3 from {}'.format(vendor_dir_path)))
+        from tight_cli import vendor
+        try:
+            result = vendor.install_requirements(requirements_file_path, vendor_dir_path, run_command,
+                                                 use_cache=kwargs.pop('cache'), refresh=kwargs.pop('refresh_cache'),
+                                                 jobs=kwargs.pop('jobs'))
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        if result['hit']:
+            click.echo(color(message='Restored {} from the vendor cache ({})'.format(vendor_dir_path, result['key'][:12])))
+        for package in result['removed']:
+            click.echo(color(message='Excluded {} from {} (provided by the Lambda runtime)'.format(package, vendor_dir_path)))
+        for package, seconds in sorted(result['timings'], key=lambda timing: -timing[1]):
+            click.echo('  {:<32}{:>7.2f}s'.format(package, seconds))
+
+
+@click.command()
+@click.option('--target', default=CWD)
+def unused(target):
+    """
+    List vendored packages that can't be reached by static imports from
+    app_index.py, the function handlers, models and serializers.
+
+    Modules listed under `artifact.shake.allow` in tight.yml are treated as
+    imported. `tight generate artifact --shake` leaves these packages out.
+
+    :param target:
+    :return:
+    """
+    from tight_cli import imports
+    from tight_cli.utils import format_size
+    config = get_config(target)
+    vendor_dir = config.get('vendor_dir', 'app/vendored')
+    unreachable = imports.find_unreachable(target, vendor_dir, imports.load_allowlist(config))
+    if not unreachable:
+        click.echo(color(message='Every vendored package is reachable.'))
+        return
+    total = 0
+    for entry in unreachable:
+        path = os.path.join(target, vendor_dir, entry)
+        size = os.path.getsize(path) if os.path.isfile(path) else sum(
+            os.path.getsize(os.path.join(dirpath, filename))
+            for dirpath, dirnames, filenames in os.walk(path) for filename in filenames)
+        total += size
+        click.echo('  {:<48}{:>10}'.format(entry, format_size(size)))
+    click.echo(color(message='{} unreachable entries in {} ({})'.format(len(unreachable), vendor_dir, format_size(total))))
 
 
 @click.command()
@@ -301,9 +488,11 @@ def env(*args, **kwargs):
     :param kwargs:
     :return:
     """
+    import yaml
     target = kwargs.pop('target')
     env_dist_path = '{}/env.dist.yml'.format(target)
-    dist_env_vars = yaml.load(open(env_dist_path))
+    with open(env_dist_path) as env_dist_file:
+        dist_env_vars = yaml.safe_load(env_dist_file)
     for k, v in dist_env_vars.items():
         if os.environ.get(k):
             dist_env_vars[k] = os.environ[k]
@@ -325,17 +514,57 @@ def model(target, **kwargs):
     :param kwargs:
     :return:
     """
-    model_name = kwargs.pop('name')
-    class_name = INFLECTOR.camelize(model_name)
-    table_name = INFLECTOR.tableize(class_name)
+    write_files([render_model(target, kwargs.pop('name'))])
+    write_registry_index(target)
+
+
+def render_model(target, name):
+    """
+    :param target: Models directory.
+    :param name: Model name, e.g. account.
+    :return: Tuple of (path, contents).
+    """
+    inflector = get_inflector()
+    class_name = inflector.camelize(name)
+    table_name = inflector.tableize(class_name)
     table_name = table_name.replace('_', '-')
-    template = get_template(LAMBDA_APP_TEMPLATES, 'flywheel_model.jinja2')
-    with open('{}/{}.py'.format(target, class_name), 'w') as file:
-        file.write(template.render(class_name=class_name, table_name=table_name))
+    template = get_template(LAMBDA_APP_TEMPLATES, 'flywheel_model.jinja2', target)
+    return '{}/{}.py'.format(target, class_name), template.render(class_name=class_name, table_name=table_name)
+
+
+REGISTRY_DIRS = ['app/models', 'app/serializers']
+REGISTRY_INDEX = '_index.py'
+
+
+def write_registry_index(directory):
+    """
+    Write the static class name -> module index read by the lazy registries in
+    app/models and app/serializers. Every module is expected to define a class
+    of the same name, as generated by `tight generate model`.
+
+    :param directory:
+    :return:
+    """
+    if not os.path.isdir(directory):
+        return
+    names = sorted(f[:-3] for f in os.listdir(directory) if f.endswith('.py') and not f.startswith('_'))
+    lines = ['# Generated by tight-cli, do not edit.', 'MODULES = {']
+    lines += ['    {!r}: {!r},'.format(name, name) for name in names]
+    lines += ['}', '']
+    contents = '\n'.join(lines)
+    index_path = '{}/{}'.format(directory, REGISTRY_INDEX)
+    if os.path.isfile(index_path):
+        with open(index_path) as index_file:
+            if index_file.read() == contents:
+                return
+    with open(index_path, 'w') as index_file:
+        index_file.write(contents)
 
 
 def load_env(target):
-    env_vars = yaml.load(open('{}/env.yml'.format(target)))
+    import yaml
+    with open('{}/env.yml'.format(target)) as env_file:
+        env_vars = yaml.safe_load(env_file)
     if not env_vars:
         raise Exception('Could not load env.yml. Have you run `tight generate env`?')
 
@@ -350,6 +579,7 @@ def dynamo():
 
 @click.command()
 @click.option('--target', default=CWD)
+@click.option('--jobs', default=None, type=click.IntRange(min=1), help='Schemas rendered at once. Defaults to the CPU count.')
 def generateschema(*args, **kwargs):
     """
     Inspect models/ directory and derive DynamoDB schema definitions.
@@ -360,10 +590,17 @@ def generateschema(*args, **kwargs):
     """
     target = kwargs.pop('target')
     load_env(target)
-    generate_cf_dynamo_schema(target)
+    generate_cf_dynamo_schema(target, jobs=kwargs.pop('jobs'))
 
 
-def write_schema_to_yaml(target, **kwargs):
+def render_schema(**kwargs):
+    """
+    Render the CloudFormation resource for a CreateTable call.
+
+    :param kwargs: CreateTable arguments.
+    :return: Tuple of (table name without the service and stage, YAML).
+    """
+    import yaml
     properties = kwargs.copy()
     table_name = "-".join(kwargs.pop('TableName').split('-')[3:])
     properties['TableName'] = '{}-{}-{}'.format(os.environ['NAME'], os.environ['STAGE'], table_name)
@@ -371,16 +608,109 @@ def write_schema_to_yaml(target, **kwargs):
         'Type': 'AWS::DynamoDB::Table',
         'Properties': properties
     }
-    with open('{}/schemas/dynamo/{}.yml' .format(target, table_name), 'w') as model_file:
-        model_file.write(yaml.safe_dump(table))
+    return table_name, yaml.safe_dump(table)
+
+
+def write_if_changed(path, contents):
+    """
+    Write a file unless it already holds contents, so unchanged files keep
+    their modification time.
+
+    :param path:
+    :param contents:
+    :return: Whether the file was written.
+    """
+    try:
+        with open(path) as existing:
+            if existing.read() == contents:
+                return False
+    except (IOError, OSError):
+        pass
+    with open(path, 'w') as file:
+        file.write(contents)
+    return True
 
 
-def generate_cf_dynamo_schema(target):
+def write_schema_to_yaml(target, recommendations=None, **kwargs):
+    from tight_cli import capacity
+    if recommendations:
+        capacity.apply(kwargs, recommendations.get(capacity.short_name(kwargs['TableName'])))
+    table_name, contents = render_schema(**kwargs)
+    return write_if_changed('{}/schemas/dynamo/{}.yml'.format(target, table_name), contents)
+
+
+def generate_cf_dynamo_schema(target, jobs=None):
+    """
+    Write schemas/dynamo/<table>.yml for every model. Rendered schemas are
+    cached per machine by model file hash, NAME and STAGE, so only changed
+    models are rendered again, and files whose contents didn't change aren't
+    rewritten.
+
+    Throughput recommended by `tight dynamo capacity` in schemas/capacity.yml
+    replaces the throughput declared by the models.
+
+    :param target:
+    :param jobs: Schemas rendered at once. Defaults to the CPU count.
+    :return:
+    """
+    import json
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from tight_cli import capacity, schema
+    from tight_cli.utils import get_cache_dir
+    models_dir = '{}/app/models'.format(target)
+    models, unsupported = schema.discover_models(models_dir)
+    cache_dir = get_cache_dir('schemas')
+    recommendations = capacity.load_recommendations(target)
+    if recommendations:
+        click.echo('Using the throughput recommended in {}'.format(capacity.RECOMMENDATIONS))
+
+    def generate(model):
+        recommended = recommendations.get(capacity.short_name(schema.table_name(model)))
+        cache_path = os.path.join(cache_dir, '{}.json'.format(schema.render_key(model, extra=recommended)))
+        try:
+            with open(cache_path) as cached:
+                table_name, contents = json.load(cached)
+        except (IOError, OSError, ValueError):
+            table_name, contents = render_schema(**capacity.apply(schema.create_table_kwargs(model), recommended))
+            temporary = '{}.{}.{}.tmp'.format(cache_path, os.getpid(), threading.get_ident())
+            with open(temporary, 'w') as cached:
+                json.dump([table_name, contents], cached)
+            os.replace(temporary, cache_path)
+        return write_if_changed('{}/schemas/dynamo/{}.yml'.format(target, table_name), contents)
+
+    if len(models) <= 1 or jobs == 1:
+        written = [generate(model) for model in models]
+    else:
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            written = list(pool.map(generate, models))
+    if unsupported:
+        written.extend(generate_imported_dynamo_schema(target, models_dir, unsupported, recommendations))
+    click.echo('Wrote {} of {} schemas, {} unchanged.'.format(sum(written), len(written),
+                                                              len(written) - sum(written)))
+
+
+def generate_imported_dynamo_schema(target, models_dir, unsupported, recommendations=None):
+    """
+    Route models that can't be read statically through flywheel's
+    create_schema, capturing the CreateTable calls.
+
+    :param target:
+    :param models_dir:
+    :param unsupported: List of (module name, reason) from discover_models.
+    :param recommendations: See capacity.load_recommendations.
+    :return: Whether each schema was written.
+    """
+    from dynamo3 import DynamoDBConnection
+    from flywheel import Engine
+    from tight_cli import schema
     dynamo_connection = DynamoDBConnection()
 
+    written = []
+
     class FakeClient(object):
         def create_table(self, *args, **kwargs):
-            write_schema_to_yaml(target, **kwargs)
+            written.append(write_schema_to_yaml(target, recommendations, **kwargs))
             return {}
 
     client = FakeClient()
@@ -401,131 +731,757 @@ def generate_cf_dynamo_schema(target):
     engine = Engine()
     engine.dynamo = dynamo
 
-    sys.path = ['{}/app/models'.format(target)] + sys.path
-    modelModules = glob.glob('{}/app/models'.format(target) + '/*.py')
-    models = [basename(f)[:-3] for f in modelModules if isfile(f)]
-    for modelName in models:
-        if modelName != '__init__':
-            engine.register(getattr(importlib.__import__(modelName), modelName))
+    for module_name, reason in unsupported:
+        click.echo('Importing {} ({})'.format(module_name, reason))
+    for model in schema.import_models(models_dir, [module_name for module_name, reason in unsupported]):
+        engine.register(model)
 
     engine.create_schema()
+    return written
 
 
 @click.command()
-def installdb():
+@click.option('--target', default=CWD)
+@click.option('--from-archive', default=None, type=click.Path(exists=True, dir_okay=False), help='Install from a local dynamodb_local tarball instead of downloading.')
+@click.option('--sha256', default=None, help='Expected checksum of the archive.')
+@click.option('--url', default=None, help='Archive to download. Defaults to the latest DynamoDB Local.')
+@click.option('--refresh', is_flag=True, default=False, help='Download the archive again even when it is cached.')
+def installdb(target, from_archive, sha256, url, refresh):
     """
     Install a local copy of DynamoDB
 
+    The archive is cached in ~/.tight/cache/dynamodb and verified against
+    its published (or the given) sha256. It is extracted once per machine
+    and linked into dynamo_db, so installing into more projects or
+    reinstalling the same version needs no network and no copying.
+
+    :param target:
+    :param from_archive:
+    :param sha256:
+    :param url:
+    :param refresh:
     :return:
     """
-    install_path = '{}/dynamo_db'.format(CWD)
-    command = ['curl', '-LO', 'https://s3-us-west-2.amazonaws.com/dynamodb-local/dynamodb_local_latest.tar.gz']
-    subprocess.call(command)
-    if os.path.exists(install_path):
-        shutil.rmtree(install_path)
-    os.mkdir(install_path)
-    extract = ['tar', '-xvzf', '{}/dynamodb_local_latest.tar.gz'.format(CWD), '-C', '{}/dynamo_db'.format(CWD)]
-    subprocess.call(extract)
-    remove_archive = ['rm', '{}/dynamodb_local_latest.tar.gz'.format(CWD)]
-    subprocess.call(remove_archive)
+    from tight_cli import localdb
+    start = time.time()
+    try:
+        digest, up_to_date = localdb.install(target, url or localdb.DOWNLOAD_URL, from_archive, sha256, refresh)
+    except (ValueError, OSError) as e:
+        raise click.ClickException(str(e))
+    if up_to_date:
+        click.echo(color(message='DynamoDB Local {} is already installed'.format(digest[:12])))
+    else:
+        click.echo(color(message='Installed DynamoDB Local {} in {:.2f}s'.format(digest[:12], time.time() - start)))
 
 
 @click.command()
 @click.option('--target', default=CWD)
-def rundb(target):
+@click.option('--persist/--no-persist', default=False, help='Keep the data from previous runs instead of starting empty.')
+@click.option('--in-memory', is_flag=True, default=False, help='Keep tables in memory (-inMemory) instead of in dynamo_db.')
+@click.option('--detach', is_flag=True, default=False, help='Return once tables are created and leave DynamoDB running, or reuse a running instance.')
+@click.option('--port', default=8000, type=click.IntRange(1, 65535))
+@click.option('--timeout', default=30.0, help='Seconds to wait for DynamoDB to accept requests.')
+@click.option('--record', is_flag=True, default=False, help='Record the capacity requests consume in dynamo_db/recording.json.')
+def rundb(target, persist, in_memory, detach, port, timeout, record):
     """
     Start running a local DynamoDB instance.
 
+    Every run starts from an empty database unless --persist is passed, in
+    which case existing tables and items are kept and only tables for new
+    models are created.
+
+    Tables are created once DynamoDB answers requests; it is polled with
+    exponential backoff. With --detach the command returns after creating
+    tables and records the instance in dynamo_db/rundb.pid, so later
+    `rundb --detach` calls (e.g. from test runners) reuse the warm instance.
+    `tight dynamo stopdb` stops it.
+
+    With --record, requests on --port go through a proxy that records the
+    capacity each table and index would consume, written to
+    dynamo_db/recording.json on exit. Run the test suite or a load replay
+    against it, then `tight dynamo capacity`.
+
     :param target:
+    :param persist:
+    :param in_memory:
+    :param detach:
+    :param port:
+    :param timeout:
+    :param record:
     :return:
     """
+    from flywheel import Engine
+    from tight_cli import localdb, schema
+    if persist and in_memory:
+        raise click.BadParameter('--in-memory can\'t persist data between runs.', param_hint='--persist')
+    if record and detach:
+        raise click.BadParameter('Recording runs in the foreground.', param_hint='--record')
+    # When recording, DynamoDB Local listens on a private port behind the proxy.
+    proxy_port = port
+    if record:
+        port = localdb.free_port()
     load_env(target)
     os.environ['AWS_REGION'] = 'us-west-2'
-    shared_db = './dynamo_db/shared-local-instance.db'
-    if os.path.exists(shared_db):
-        os.remove(shared_db)
-    dynamo_command = ['java', '-Djava.library.path={}/dynamo_db/DynamoDBLocal_lib'.format(CWD), '-jar', '{}/dynamo_db/DynamoDBLocal.jar'.format(CWD), '-sharedDb', '-dbPath', './dynamo_db']
-    try:
-        dynamo_process = subprocess.Popen(dynamo_command, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except Exception as e:
-        pass
+    dynamo_process = None
+    running = localdb.read_pidfile(target)
+    if running:
+        if not detach:
+            raise click.ClickException('DynamoDB Local is already running (pid {}, port {}). Pass --detach to reuse it '
+                                       'or run `tight dynamo stopdb`.'.format(running['pid'], running['port']))
+        port = running['port']
+        click.echo(color(message='Reusing DynamoDB Local (pid {}, port {})'.format(running['pid'], port)))
+    else:
+        shared_db = localdb.shared_db_path(target)
+        if os.path.exists(shared_db) and not persist:
+            os.remove(shared_db)
+        dynamo_command = localdb.build_command(target, port, in_memory)
+        try:
+            if detach:
+                with open(os.path.join(localdb.db_dir(target), localdb.LOGFILE), 'w') as log:
+                    dynamo_process = subprocess.Popen(dynamo_command, stdin=subprocess.DEVNULL, stdout=log,
+                                                      stderr=subprocess.STDOUT, start_new_session=True)
+            else:
+                dynamo_process = subprocess.Popen(dynamo_command, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            raise click.ClickException('Could not start DynamoDB Local ({}). Is java installed and has '
+                                       '`tight dynamo installdb` been run?'.format(e))
+        try:
+            ready = localdb.wait_until_ready(port, dynamo_process, timeout)
+        except RuntimeError as e:
+            dynamo_process.kill()
+            raise click.ClickException(str(e))
+        click.echo(color(message='DynamoDB Local ready on port {} in {:.2f}s'.format(port, ready)))
     try:
         '''
         Connect to DynamoDB and register and create tables for application models.
         '''
         engine = Engine()
         engine.connect(os.environ['AWS_REGION'], host='localhost',
-                       port=8000,
+                       port=port,
                        access_key='anything',
                        secret_key='anything',
                        is_secure=False)
-        # load models
-        sys.path = ['./app/models'] + sys.path
-        modelModules = glob.glob('./app/models' + "/*.py")
-        models = [basename(f)[:-3] for f in modelModules if isfile(f)]
-        for modelName in models:
-            if modelName != '__init__':
-                engine.register(getattr(__import__(modelName), modelName))
-        engine.create_schema()
+        # Models are read statically; only those that can't be are imported.
+        models_dir = '{}/app/models'.format(target)
+        models, unsupported = schema.discover_models(models_dir)
+        existing = set(engine.dynamo.list_tables())
+        created = []
+        for model in models:
+            table_kwargs = schema.create_table_kwargs(model)
+            if table_kwargs['TableName'] not in existing:
+                engine.dynamo.call('create_table', **table_kwargs)
+                created.append(table_kwargs['TableName'])
+        for model in schema.import_models(models_dir, [module_name for module_name, reason in unsupported]):
+            engine.register(model)
+        created += engine.create_schema()
+        if persist or running:
+            print("Created tables " + str(created))
         tables = [table for table in engine.dynamo.list_tables()]
         print("This engine has the following tables " + str(tables))
         for table in tables:
             engine.dynamo.describe_table(table)
     except Exception as e:
         # IF anything goes wrong, then we self-destruct.
-        dynamo_process.kill()
+        if dynamo_process is not None:
+            dynamo_process.kill()
         raise e
-    # Wait for process to finish.
-    dynamo_process.wait()
+    if detach:
+        if dynamo_process is not None:
+            localdb.write_pidfile(target, dynamo_process.pid, port, in_memory)
+            click.echo(color(message='DynamoDB Local is running in the background (pid {}), '
+                                     'stop it with `tight dynamo stopdb`'.format(dynamo_process.pid)))
+        return
+    if not record:
+        # Wait for process to finish.
+        dynamo_process.wait()
+        return
+    from tight_cli import capacity
+    recorder = capacity.Recorder()
+    try:
+        proxy = capacity.RecordingProxy(proxy_port, port, recorder)
+    except OSError as e:
+        dynamo_process.kill()
+        raise click.ClickException('Could not listen on port {} ({}).'.format(proxy_port, e))
+    proxy.start()
+    recording_path = os.path.join(localdb.db_dir(target), capacity.RECORDING)
+    click.echo(color(message='Recording requests on port {}, stop with Ctrl-C'.format(proxy_port)))
+    try:
+        dynamo_process.wait()
+    except KeyboardInterrupt:
+        dynamo_process.terminate()
+    finally:
+        proxy.shutdown()
+        recorder.save(recording_path)
+        click.echo(color(message='Recorded {} requests to {}, run `tight dynamo capacity` for recommendations'.format(
+            recorder.requests, recording_path)))
 
 
 @click.command()
 @click.option('--target', default=CWD)
+def stopdb(target):
+    """
+    Stop a DynamoDB Local instance started with `tight dynamo rundb --detach`.
+
+    :param target:
+    :return:
+    """
+    from tight_cli import localdb
+    pid = localdb.stop(target)
+    if pid is None:
+        click.echo('DynamoDB Local is not running.')
+    else:
+        click.echo(color(message='Stopped DynamoDB Local (pid {})'.format(pid)))
+
+
+@click.command()
+@click.option('--target', default=CWD)
+@click.option('--list', 'list_snapshots', is_flag=True, default=False, help='List the saved snapshots.')
+@click.argument('name', required=False)
+def snapshot(target, list_snapshots, name):
+    """
+    Save the local DynamoDB database as a named snapshot in
+    dynamo_db/snapshots. Safe to run while rundb is running.
+
+    :param target:
+    :param list_snapshots:
+    :param name:
+    :return:
+    """
+    from tight_cli import localdb
+    from tight_cli.utils import format_size
+    if list_snapshots:
+        for snapshot_name in localdb.list_snapshots(target):
+            click.echo(snapshot_name)
+        return
+    if not name:
+        raise click.UsageError('Missing argument "name".')
+    start = time.time()
+    try:
+        path, size = localdb.snapshot(target, name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(color(message='Saved snapshot {} ({}) in {:.0f}ms'.format(name, format_size(size), (time.time() - start) * 1000)))
+
+
+@click.command()
+@click.option('--target', default=CWD)
+@click.argument('name')
+def restore(target, name):
+    """
+    Replace the local DynamoDB database with a snapshot saved by
+    `tight dynamo snapshot`.
+
+    :param target:
+    :param name:
+    :return:
+    """
+    from tight_cli import localdb
+    from tight_cli.utils import format_size
+    start = time.time()
+    try:
+        path, size = localdb.restore(target, name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(color(message='Restored snapshot {} ({}) in {:.0f}ms'.format(name, format_size(size), (time.time() - start) * 1000)))
+
+
+@click.command('capacity')
+@click.option('--target', default=CWD)
+@click.option('--recording', default=None, type=click.Path(exists=True, dir_okay=False), help='Defaults to dynamo_db/recording.json.')
+@click.option('--headroom', default=1.2, help='Multiplier applied to the peak units per second.')
+def recommend_capacity(target, recording, headroom):
+    """
+    Recommend provisioned throughput and indexes from a recording made with
+    `tight dynamo rundb --record`, and write them to schemas/capacity.yml
+    for `tight dynamo generateschema`.
+
+    :param target:
+    :param recording:
+    :param headroom:
+    :return:
+    """
+    import json
+    from tight_cli import capacity, localdb, schema
+    if headroom < 1:
+        raise click.BadParameter('Must be at least 1.', param_hint='--headroom')
+    load_env(target)
+    recording = recording or os.path.join(localdb.db_dir(target), capacity.RECORDING)
+    try:
+        with open(recording) as recording_file:
+            recorded = json.load(recording_file)
+    except (IOError, OSError, ValueError) as e:
+        raise click.ClickException('Could not read {} ({}). Record one with `tight dynamo rundb --record`.'.format(recording, e))
+    models, unsupported = schema.discover_models('{}/app/models'.format(target))
+    recommendations = capacity.recommend(recorded, models, headroom)
+    click.echo('{} requests over {:.0f}s'.format(recorded['requests'], recorded['duration']))
+    for table, entry in sorted(recommendations['tables'].items()):
+        click.echo('{}: read {}, write {}'.format(table, entry['read'], entry['write']))
+        for index, throughput in sorted(entry.get('global_indexes', {}).items()):
+            click.echo('  {}: read {}, write {}'.format(index, throughput['read'], throughput['write']))
+    for table, suggestions in sorted(recommendations['indexes'].items()):
+        for suggestion in suggestions:
+            click.echo(color(message='{}: {} requests filter on {}, consider a {} index'.format(
+                table, suggestion['requests'], suggestion['attribute'], suggestion['type'])))
+    path = capacity.write_recommendations(target, recommendations)
+    click.echo(color(message='Wrote {}'.format(path)))
+
+
+@click.command()
+@click.option('--target', default=CWD)
+@click.option('--jobs', default=None, type=click.IntRange(min=1), help='Compression processes. Defaults to the CPU count.')
+@click.option('--prune/--no-prune', default=True, help='Apply the prune rules from tight.yml to the vendor dir.')
+@click.option('--precompile/--no-precompile', default=False, help='Ship bytecode compiled for the Lambda runtime.')
+@click.option('--runtime', default=None, help='Runtime to precompile for, e.g. python3.6. Defaults to tight.yml::runtime or the current interpreter.')
+@click.option('--optimize', default=0, type=click.IntRange(0, 2), help='Optimization level used by --precompile. Unless --sourceless, the function needs PYTHONOPTIMIZE set to the same level to use the bytecode.')
+@click.option('--sourceless/--with-sources', default=False, help='With --precompile, ship .pyc files in place of the sources.')
+@click.option('--import-index/--no-import-index', default=False, help='Ship a build time import index instead of relying on sys.path.')
+@click.option('--shake/--no-shake', default=False, help='Leave out vendored packages the app never imports.')
+@click.option('--per-function', is_flag=True, default=False, help='Also build a minimal bundle for every function.')
+@click.option('--layer', is_flag=True, default=False, help='Ship the vendor dir as a Lambda layer, separate from the app.')
 def artifact(*args, **kwargs):
     """
-    Generate an artifact for the app. Will be located at ./build
+    Generate an artifact for the app. Will be located at ./builds
+
+    Artifacts are deterministic: entries are sorted and carry a fixed
+    timestamp, so identical sources produce byte-identical zips. A manifest of
+    content hashes is kept in ./builds so that only files which changed since
+    the previous build are recompressed. Entries are deflated across a process
+    pool and streamed straight into the zip.
+
+    Files in the vendor dir that Lambda doesn't need (__pycache__, tests, docs,
+    stubs, packaging metadata) are pruned and shared objects are stripped of
+    debug symbols. Rules are configured in the `artifact.prune` section of
+    tight.yml, see tight_cli.prune.load_rules.
+
+    With --precompile, python sources are compiled by an interpreter matching
+    the Lambda runtime and shipped in __pycache__ (or in place of the sources
+    with --sourceless) so cold containers don't have to compile them.
+
+    With --import-index, app/_import_index.py maps every top level module in
+    the artifact to the directory it lives in. app/__init__.py installs it as
+    a meta path finder instead of prepending the vendor, lib, models and
+    serializers directories to sys.path.
+
+    With --shake, vendored packages that can't be reached by static imports
+    from app_index.py, the function handlers, models and serializers are left
+    out. List packages that are imported dynamically under
+    `artifact.shake.allow` in tight.yml; `tight pip unused` shows what would
+    be dropped.
+
+    With --per-function, a bundle is also built for every directory in
+    app/functions, at builds/functions/<function>. It holds that function's
+    modules, the app/lib, model and serializer modules it imports and the
+    vendored packages it reaches, and is compared to the full artifact.
+
+    With --layer, the vendor dir is packaged below python/ in
+    builds/layer/<name>-layer-<key>.zip, keyed by the vendored files
+    and build options and only rebuilt when they change. The artifact then
+    holds the app alone, with a vendor dir __init__.py that resolves
+    `app.vendored.<package>` imports from the layer. Per function bundles
+    leave the vendor dir out the same way.
 
     :param args:
     :param kwargs:
     :return:
     """
+    from tight_cli import artifacts, imports, prune
+    from tight_cli.utils import format_size
     target = kwargs.pop('target')
-    name = get_config(target)['name']
-    zip_name = '{}/builds/{}-artifact-{}'.format(target, name, int(time.time()))
+    config = get_config(target)
+    name = config['name']
+    vendor_dir = config.get('vendor_dir', 'app/vendored')
+    prune_rules = prune.load_rules(config) if kwargs.pop('prune') else None
+    import_index = kwargs.pop('import_index')
+    if import_index:
+        with open('{}/app/__init__.py'.format(target)) as app_init:
+            if '_import_index' not in app_init.read():
+                click.echo(color(message='app/__init__.py does not load _import_index, see the starter app/__init__.py'))
+    jobs = kwargs.pop('jobs')
+    per_function = kwargs.pop('per_function')
+    layer = kwargs.pop('layer')
+    exclude = None
+    if kwargs.pop('shake'):
+        exclude = set(imports.find_unreachable(target, vendor_dir, imports.load_allowlist(config)))
+    bytecode_options = None
+    if kwargs.pop('precompile'):
+        from tight_cli import bytecode
+        try:
+            bytecode_options = bytecode.load_options(kwargs.pop('runtime') or config.get('runtime'),
+                                                     kwargs.pop('optimize'), kwargs.pop('sourceless'))
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--runtime')
     builds_dir = '{}/builds'.format(target)
-    if os.path.exists(builds_dir):
-        shutil.rmtree(builds_dir)
+    zip_name = '{}/{}-artifact-{}.zip'.format(builds_dir, name, int(time.time()))
+    if not os.path.exists(builds_dir):
+        os.mkdir(builds_dir)
+    for registry_dir in REGISTRY_DIRS:
+        write_registry_index('{}/{}'.format(target, registry_dir))
+    if exclude:
+        click.echo('Unreachable vendored packages: {}'.format(', '.join(sorted(exclude))))
+
+    select = None
+    vendor_loader = None
+    if layer:
+        # Keyed by the vendored files themselves, so packages installed
+        # without the vendor cache (`tight pip install PACKAGE`) are picked up.
+        vendored_key = artifacts.tree_key('{}/{}'.format(target, vendor_dir))
+        key = artifacts.layer_key(vendored_key, prune_rules, bytecode_options, exclude)
+        layer_result = artifacts.build_layer(target, builds_dir, name, key, jobs=jobs, vendor_dir=vendor_dir,
+                                             prune=prune_rules, bytecode=bytecode_options, exclude=exclude)
+        layer_zip = os.path.relpath(artifacts.layer_path(builds_dir, name, key), target)
+        if layer_result is None:
+            click.echo(color(message='Layer {} is up to date'.format(layer_zip)))
+        else:
+            click.echo(color(message='Built layer {}'.format(layer_zip)))
+            report_build(layer_result, artifacts.LAYER_PREFIX, bytecode_options)
+        vendor_loader = artifacts.write_vendor_loader(builds_dir)
+        select = artifacts.app_selector(vendor_dir, vendor_loader)
+
+    result = artifacts.build_artifact(target, zip_name, builds_dir, jobs=jobs,
+                                      vendor_dir=vendor_dir, prune=prune_rules, bytecode=bytecode_options,
+                                      import_index=import_index, exclude=exclude, select=select)
+
+    for previous_zip in glob.glob('{}/{}-artifact-*.zip'.format(builds_dir, name)):
+        if previous_zip != zip_name:
+            os.remove(previous_zip)
+    staging_dir = '{}/{}-artifact'.format(builds_dir, name)
+    if os.path.isdir(staging_dir):
+        shutil.rmtree(staging_dir)
+
+    click.echo(color(message='Built {} ({} entries recompressed, {} reused)'.format(
+        os.path.relpath(zip_name, target), result['compressed'], result['reused'])))
+    report_build(result, vendor_dir, bytecode_options)
+
+    if per_function:
+        start = time.time()
+        function_results = artifacts.build_function_artifacts(
+            target, builds_dir, name, jobs=jobs, vendor_dir=vendor_dir, prune=prune_rules, bytecode=bytecode_options,
+            import_index=import_index, allow=imports.load_allowlist(config), vendor_loader=vendor_loader)
+        functions_dir = '{}/functions'.format(builds_dir)
+        for function_dir in glob.glob('{}/*'.format(functions_dir)):
+            if basename(function_dir) not in function_results:
+                shutil.rmtree(function_dir)
+        click.echo(color(message='Built {} function bundles in {:.2f}s'.format(len(function_results), time.time() - start)))
+        for function, function_result in sorted(function_results.items()):
+            for previous_zip in glob.glob('{}/{}/*-artifact-*.zip'.format(functions_dir, function)):
+                if previous_zip != function_result['path']:
+                    os.remove(previous_zip)
+            size = function_result['stats'].bytes_out
+            click.echo('  {:<32}{:>10} {:>5.1f}% of the full artifact'.format(
+                function, format_size(size), 100.0 * size / result['stats'].bytes_out))
+
+
+def report_build(result, vendor_dir, bytecode_options=None):
+    """
+    Print what build_artifact pruned, stripped and compiled, the size of
+    every package and the time spent in each phase.
+
+    :param result: build_artifact result.
+    :param vendor_dir:
+    :param bytecode_options:
+    :return:
+    """
+    from tight_cli.utils import format_size
+    stats = result['stats']
+    if stats.pruned:
+        click.echo('Pruned from {}:'.format(vendor_dir))
+        for rule, (files, size) in sorted(stats.pruned.items(), key=lambda item: -item[1][1]):
+            click.echo('  {:<32}{:>7} files {:>10}'.format(rule, files, format_size(size)))
+    if stats.stripped_bytes:
+        click.echo('Stripped debug symbols: {}'.format(format_size(stats.stripped_bytes)))
+    if stats.uncompiled:
+        click.echo('Not precompiled (invalid for {}): {}'.format(bytecode_options.cache_tag, ', '.join(stats.uncompiled)))
+    click.echo('Bundle size by package:')
+    for package, (size, compressed_size) in sorted(stats.packages.items(), key=lambda item: -item[1][0]):
+        click.echo('  {:<32}{:>10} ({} compressed)'.format(package, format_size(size), format_size(compressed_size)))
+    for phase, seconds in stats.phases:
+        click.echo('{:<10}{:.2f}s'.format(phase, seconds))
+    click.echo('{} in, {} out'.format(format_size(stats.bytes_in), format_size(stats.bytes_out)))
+    click.echo('sha256: {}'.format(result['sha256']))
 
-    os.mkdir(builds_dir)
-    os.mkdir('{}/{}-artifact'.format(builds_dir, name))
 
-    directory_list = ['{}/app'.format(target)]
-    file_list = ['{}/app_index.py'.format(target), '{}/env.dist.yml'.format(target), '{}/tight.yml'.format(target)]
+@click.group()
+def profile():
+    pass
 
-    create_zip = ['zip', '-9', zip_name]
-    subprocess.call(create_zip)
-    artifact_dir = '{}/builds/{}-artifact/'.format(target, name)
 
-    for dir in directory_list:
-        cp_dir_command = ['cp', '-R', dir, artifact_dir]
-        subprocess.call(cp_dir_command)
+@click.command()
+@click.option('--target', default=CWD)
+@click.option('--entrypoint', default='app_index', help='Module Lambda imports on cold start.')
+@click.option('--runs', default=5, type=click.IntRange(min=1), help='Number of clean interpreters to import in.')
+@click.option('--threshold', default=1.0, help='Hide modules cheaper than this many milliseconds.')
+@click.option('--depth', default=None, type=click.IntRange(min=0), help='Maximum tree depth to print.')
+@click.option('--budget', default=None, type=float, help='Exit non-zero when the median import time exceeds this many milliseconds.')
+@click.option('--precompiled', is_flag=True, default=False, help="Use the project's bytecode instead of compiling it, as with --precompile artifacts.")
+def coldstart(target, entrypoint, runs, threshold, depth, budget, precompiled):
+    """
+    Profile the import time of the app entrypoint.
+
+    Imports the entrypoint in several clean interpreters with
+    `python -X importtime` and prints the median cumulative and self time of
+    every module, ranked by cumulative time.
+
+    Like a Lambda container running an artifact without bytecode, the
+    project's modules are compiled from source in every run and no
+    bytecode is written. Pass --precompiled to measure with bytecode.
+
+    :param target:
+    :param entrypoint:
+    :param runs:
+    :param threshold:
+    :param depth:
+    :param budget:
+    :param precompiled:
+    :return:
+    """
+    from tight_cli import coldstart as profiler
+    env = profiler.project_env(target)
+    try:
+        trees = [profiler.profile_entrypoint(target, entrypoint, env, bytecode=precompiled) for _ in range(runs)]
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    tree = profiler.merge_runs(trees)
+    click.echo('{:>10} {:>10}  {}'.format('cumul(ms)', 'self(ms)', 'module'))
+    for line in profiler.format_tree(tree, threshold * 1000, depth):
+        click.echo(line)
+    total = tree.cumulative_us / 1000.0
+    click.echo(color(message='Importing {} took {:.1f}ms (median of {} runs)'.format(entrypoint, total, runs)))
+    if budget is not None and total > budget:
+        raise click.ClickException('Cold start import time {:.1f}ms exceeds the {:.1f}ms budget.'.format(total, budget))
+
+
+@click.command()
+@click.option('--target', default=CWD)
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=3000, type=click.IntRange(1, 65535))
+@click.option('--workers', default=None, type=click.IntRange(min=1), help='Requests handled at once. Defaults to the CPU count.')
+@click.option('--reload/--no-reload', default=True, help='Reload a function when its files change.')
+def serve(target, host, port, workers, reload):
+    """
+    Serve the app's functions over HTTP like API Gateway's Lambda proxy
+    integration.
+
+    The app is imported once and requests to /<function>/<path> call
+    app/functions/<function>/handler.py with a Lambda proxy event, on a pool
+    of worker threads that share the warm modules. With --reload, a changed
+    function is reloaded on its own once in-flight requests finish. Handlers
+    use local DynamoDB, see `tight dynamo rundb`.
+
+    :param target:
+    :param host:
+    :param port:
+    :param workers:
+    :param reload:
+    :return:
+    """
+    from tight_cli import runtime
+    from tight_cli import serve as gateway
+    from tight_cli.artifacts import list_functions
+    vendor_dir = get_config(target).get('vendor_dir', 'app/vendored')
+    target = os.path.abspath(target)
+    try:
+        app = runtime.load_app(target, vendor_dir)
+    except Exception as e:
+        raise click.ClickException('Could not import {} ({}: {})'.format(runtime.ENTRYPOINT, type(e).__name__, e))
+    functions = [function for function in list_functions(target) if hasattr(app, function)]
+    workers = workers or os.cpu_count() or 1
+    try:
+        server = gateway.LocalGateway((host, port), app, functions, workers, stage=os.environ.get('STAGE', 'dev'),
+                                      log=click.echo)
+    except OSError as e:
+        raise click.ClickException('Could not listen on {}:{} ({}).'.format(host, port, e))
+    if reload:
+        server.watch(gateway.Watcher(target, vendor_dir))
+    for function in functions:
+        click.echo('  http://{}:{}/{}'.format(host, port, function))
+    click.echo(color(message='Serving {} functions with {} workers, stop with Ctrl-C'.format(len(functions), workers)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@click.command()
+@click.argument('function')
+@click.option('--target', default=CWD)
+@click.option('--event', 'event_path', default=None, type=click.Path(exists=True, dir_okay=False), help='JSON or YAML event. Defaults to the GET event of the generated integration test.')
+@click.option('--requests', default=100, type=click.IntRange(min=1), help='Warm invocations.')
+@click.option('--concurrency', default=1, type=click.IntRange(min=1), help='Invocations run at once.')
+@click.option('--cold', default=5, type=click.IntRange(min=0), help='Cold invocations, each in a fresh interpreter.')
+@click.option('--warmup', default=1, type=click.IntRange(min=0), help='Untimed warm invocations first.')
+@click.option('--allocations', default=20, type=click.IntRange(min=0), help='Warm invocations traced for allocations.')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Defaults to builds/bench/<function>-<time>.json.')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False), help='Results of an earlier run to compare with.')
+@click.option('--max-regression', default=None, type=float, help='With --baseline, exit non-zero when a metric is this many percent worse.')
+def bench(function, target, event_path, requests, concurrency, cold, warmup, allocations, output, baseline, max_regression):
+    """
+    Benchmark a function's handler.
+
+    Invokes it cold, once per fresh interpreter, and warm, repeatedly in
+    this one at --concurrency, against local DynamoDB. Reports p50/p95/p99
+    latency, throughput and the memory allocated per invocation, and saves
+    the results as JSON to compare later runs with (--baseline).
+
+    :param function:
+    :param target:
+    :param event_path:
+    :param requests:
+    :param concurrency:
+    :param cold:
+    :param warmup:
+    :param allocations:
+    :param output:
+    :param baseline:
+    :param max_regression:
+    :return:
+    """
+    import json
+    import yaml
+    from tight_cli import bench as benchmark
+    from tight_cli import localdb, runtime
+    from tight_cli.artifacts import list_functions
+    from tight_cli.utils import format_size
+    target = os.path.abspath(target)
+    vendor_dir = get_config(target).get('vendor_dir', 'app/vendored')
+    if function not in list_functions(target):
+        raise click.BadParameter('No function named {} in app/functions.'.format(function), param_hint='function')
+    event = benchmark.DEFAULT_EVENT
+    if event_path:
+        with open(event_path) as event_file:
+            event = yaml.safe_load(event_file)
+    baseline_results = None
+    if baseline:
+        with open(baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+    env = runtime.project_env(target)
+    running = localdb.read_pidfile(target)
+    port = running['port'] if running else localdb.DEFAULT_PORT
+    if env.get('USE_LOCAL_DB') == 'True' and not localdb.is_ready(port):
+        click.echo(color(message='DynamoDB Local is not running on port {}, handlers using it will fail. '
+                                 'Start it with `tight dynamo rundb --detach`.'.format(port)))
+
+    results = {'version': benchmark.RESULTS_VERSION, 'function': function, 'event': event, 'timestamp': time.time(),
+               'environment': benchmark.environment()}
+    if cold:
+        try:
+            results['cold'] = benchmark.run_cold(target, vendor_dir, function, event, cold, concurrency, env)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo('cold  {runs} runs, init p50 {init[p50]:.1f}ms, invoke p50 {invoke[p50]:.1f}ms, '
+                   'total p50 {total[p50]:.1f}ms p95 {total[p95]:.1f}ms'.format(**results['cold']))
+    try:
+        app = runtime.load_app(target, vendor_dir, env)
+        results['warm'] = benchmark.run_warm(app, function, event, requests, concurrency, warmup)
+        if allocations:
+            results['allocations'] = benchmark.measure_allocations(app, function, event, allocations)
+    except Exception as e:
+        raise click.ClickException('Could not invoke {} ({}: {})'.format(function, type(e).__name__, e))
+    warm = results['warm']
+    click.echo('warm  {requests} requests x{concurrency}, p50 {latency[p50]:.2f}ms p95 {latency[p95]:.2f}ms '
+               'p99 {latency[p99]:.2f}ms, {throughput:.1f} req/s, {errors} errors'.format(**warm))
+    if allocations:
+        click.echo('alloc peak {} retained {} per invocation (median of {})'.format(
+            format_size(results['allocations']['peak_bytes']), format_size(results['allocations']['retained_bytes']),
+            allocations))
+    output = output or benchmark.results_path(target, function, results['timestamp'])
+    benchmark.save(output, results)
+    click.echo(color(message='Saved results to {}'.format(output)))
+
+    if baseline_results:
+        tolerance = (max_regression or 0) / 100.0
+        rows = benchmark.compare(results, baseline_results, tolerance)
+        for path, current, previous, change, regressed in rows:
+            click.echo('{:<24} {:>12.2f} {:>12.2f} {:>+8.1f}%{}'.format(
+                path, current, previous, change * 100, '  regressed' if regressed and max_regression is not None else ''))
+        regressions = [row[0] for row in rows if row[4]]
+        if max_regression is not None and regressions:
+            raise click.ClickException('{} regressed by more than {}%.'.format(', '.join(regressions), max_regression))
+
+
+@click.command()
+@click.argument('function')
+@click.argument('events', default='-', type=click.File('r'))
+@click.option('--target', default=CWD)
+@click.option('--output', default='-', type=click.File('w'), help='Where to write the results as NDJSON. Defaults to stdout.')
+@click.option('--concurrency', default=1, type=click.IntRange(min=1), help='Events invoked at once.')
+@click.option('--expectations', 'expectations_dir', default=None, type=click.Path(file_okay=False), help='Defaults to tests/functions/integration/<function>/expectations.')
+@click.option('--compare/--no-compare', default=True, help='Flag responses that differ from the expectations.')
+def invoke(function, events, target, output, concurrency, expectations_dir, compare):
+    """
+    Replay newline delimited JSON events through a function's handler.
+
+    EVENTS is a file with one event per line, or - for stdin. Each result is
+    written to --output as one JSON line, in input order, with the response,
+    the time taken and any error. Responses are compared with the
+    expectations of the function's integration tests: an event uses the
+    file named by its "expectation" key, or test_<method>_method.yml.
+    Progress and error counts go to stderr. Exits non-zero when an event
+    fails or differs from its expectation.
+
+    :param function:
+    :param events:
+    :param target:
+    :param output:
+    :param concurrency:
+    :param expectations_dir:
+    :param compare:
+    :return:
+    """
+    from tight_cli import replay, runtime
+    from tight_cli.artifacts import list_functions
+    target = os.path.abspath(target)
+    vendor_dir = get_config(target).get('vendor_dir', 'app/vendored')
+    if function not in list_functions(target):
+        raise click.BadParameter('No function named {} in app/functions.'.format(function), param_hint='function')
+    expectations = None
+    if compare:
+        expectations_dir = os.path.abspath(expectations_dir) if expectations_dir else os.path.join(
+            target, replay.EXPECTATIONS_DIR.format(function))
+        expectations = replay.load_expectations(expectations_dir)
+    try:
+        app = runtime.load_app(target, vendor_dir)
+    except Exception as e:
+        raise click.ClickException('Could not import {} ({}: {})'.format(runtime.ENTRYPOINT, type(e).__name__, e))
+    interactive = sys.stderr.isatty()
+
+    def write(line):
+        output.write(line + '\n')
 
-    for file_name in file_list:
-        cp_file_command = ['cp', file_name, artifact_dir]
-        subprocess.call(cp_file_command)
+    def progress(stats):
+        click.echo('\r{}'.format(stats) if interactive else str(stats), err=True, nl=not interactive)
 
-    shutil.make_archive(zip_name, 'zip', root_dir=artifact_dir)
+    stats = replay.replay(app, function, events, write, concurrency, expectations, progress)
+    output.flush()
+    if interactive:
+        click.echo('', err=True)
+    click.echo(color(message=str(stats)), err=True)
+    if stats.errors or stats.mismatches:
+        raise click.ClickException('{} events failed and {} differ from their expectations.'.format(
+            stats.errors, stats.mismatches))
 
 
 main.add_command(generate)
 main.add_command(pip)
 main.add_command(dynamo)
+main.add_command(profile)
+main.add_command(serve)
+main.add_command(bench)
+main.add_command(invoke)
 pip.add_command(install)
+pip.add_command(unused)
 generate.add_command(app)
 generate.add_command(function)
 generate.add_command(env)
 generate.add_command(model)
+generate.add_command(batch)
 generate.add_command(artifact)
 dynamo.add_command(generateschema)
 dynamo.add_command(installdb)
 dynamo.add_command(rundb)
+dynamo.add_command(stopdb)
+dynamo.add_command(snapshot)
+dynamo.add_command(restore)
+dynamo.add_command(recommend_capacity)
+profile.add_command(coldstart)
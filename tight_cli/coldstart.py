@@ -0,0 +1,190 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_PREFIX = 'import time:'
+# Lambda containers can't write bytecode, so an artifact without it compiles
+# the project's modules on every cold start. Unless precompiled bytecode is
+# measured, the profiled interpreter neither reads nor writes bytecode for
+# files below the project root; the standard library keeps its cache, as it
+# does on Lambda.
+SOURCE_ONLY_SCRIPT = '''
+import os, sys
+from importlib import machinery
+root = os.path.abspath(".")
+
+class SourceOnlyLoader(machinery.SourceFileLoader):
+    def get_code(self, fullname):
+        path = self.get_filename(fullname)
+        return self.source_to_code(self.get_data(path), path)
+
+def source_only(path):
+    path = os.path.abspath(path or ".")
+    if path != root and not path.startswith(root + os.sep):
+        raise ImportError
+    return machinery.FileFinder(path, (machinery.ExtensionFileLoader, machinery.EXTENSION_SUFFIXES),
+                                (SourceOnlyLoader, machinery.SOURCE_SUFFIXES))
+
+sys.path_hooks.insert(0, source_only)
+sys.path_importer_cache.clear()
+sys.path.insert(0, ".")
+import {}
+'''
+
+
+class ImportNode(object):
+    """
+    A module in the import tree reported by `python -X importtime`. Times are
+    in microseconds.
+    """
+
+    def __init__(self, name, self_us, cumulative_us, children=None):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.children = children or []
+
+    def find(self, name):
+        if self.name == name:
+            return self
+        for child in self.children:
+            found = child.find(name)
+            if found:
+                return found
+        return None
+
+
+def parse_importtime(output):
+    """
+    Build import trees from `-X importtime` output. A module is reported after
+    everything it imports, indented one level deeper than its parent.
+
+    :param output: stderr of the profiled interpreter.
+    :return: List of root ImportNodes, in import order.
+    """
+    pending = {}
+    for line in output.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len(IMPORT_TIME_PREFIX):].split('|')
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            # Header line.
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        node = ImportNode(name.strip(), self_us, cumulative_us, pending.pop(depth + 1, []))
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) // 2
+
+
+def merge_runs(trees):
+    """
+    Merge the trees of several runs into one, using the median time of each
+    module. Modules missing from a run count as 0 for that run.
+
+    :param trees: One ImportNode per run, all for the same module.
+    :return: ImportNode
+    """
+    runs = len(trees)
+    children = {}
+    order = []
+    for tree in trees:
+        for child in tree.children:
+            if child.name not in children:
+                children[child.name] = []
+                order.append(child.name)
+            children[child.name].append(child)
+    merged_children = []
+    for name in order:
+        nodes = children[name]
+        padded = nodes + [ImportNode(name, 0, 0)] * (runs - len(nodes))
+        merged_children.append(merge_runs(padded))
+    return ImportNode(trees[0].name,
+                      median([tree.self_us for tree in trees]),
+                      median([tree.cumulative_us for tree in trees]),
+                      merged_children)
+
+
+def profile_entrypoint(target, entrypoint, env=None, python=None, bytecode=False):
+    """
+    Import the entrypoint in a clean interpreter and return its import tree.
+
+    :param target: Project root, used as the working directory.
+    :param entrypoint: Module name, e.g. app_index.
+    :param env: Environment variables for the subprocess.
+    :param python: Interpreter to use. Defaults to the current one.
+    :param bytecode: Use the project's __pycache__ instead of compiling its
+                     modules from source, as with an artifact built with
+                     --precompile.
+    :return: ImportNode for the entrypoint.
+    """
+    if bytecode:
+        command = [python or sys.executable, '-X', 'importtime', '-c',
+                   'import sys; sys.path.insert(0, "."); import {}'.format(entrypoint)]
+    else:
+        command = [python or sys.executable, '-B', '-X', 'importtime', '-c', SOURCE_ONLY_SCRIPT.format(entrypoint)]
+    process = subprocess.Popen(command, cwd=target, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    _, output = process.communicate()
+    if process.returncode != 0:
+        lines = [line for line in output.splitlines() if not line.startswith(IMPORT_TIME_PREFIX)]
+        raise RuntimeError('Importing {} failed:\n{}'.format(entrypoint, '\n'.join(lines[-20:])))
+    for root in reversed(parse_importtime(output)):
+        if root.name == entrypoint:
+            return root
+    raise RuntimeError('{} was already imported during interpreter startup.'.format(entrypoint))
+
+
+def format_tree(node, threshold_us=0, max_depth=None, depth=0):
+    """
+    Render the tree ranked by cumulative time, hiding modules cheaper than
+    threshold_us.
+
+    :return: List of lines.
+    """
+    lines = ['{:>10.1f} {:>10.1f}  {}{}'.format(node.cumulative_us / 1000.0, node.self_us / 1000.0,
+                                                 '  ' * depth, node.name)]
+    if max_depth is not None and depth >= max_depth:
+        return lines
+    for child in sorted(node.children, key=lambda child: -child.cumulative_us):
+        if child.cumulative_us >= threshold_us:
+            lines += format_tree(child, threshold_us, max_depth, depth + 1)
+    return lines
+
+
+def project_env(target):
+    """
+    Environment for the profiled interpreter: the current environment plus
+    env.yml, which models read at import time.
+    """
+    import yaml
+    env = dict(os.environ)
+    env_path = os.path.join(target, 'env.yml')
+    if os.path.isfile(env_path):
+        with open(env_path) as env_file:
+            for key, value in (yaml.safe_load(env_file) or {}).items():
+                env[key] = str(value)
+    return env
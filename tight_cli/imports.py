@@ -0,0 +1,380 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+INDEX_NAME = 'app/_import_index.py'
+# Mirrors the sys.path order set up by the starter app/__init__.py, highest
+# priority first. '' is the project root.
+SEARCH_DIRS = ['', 'app/serializers', 'app/models', 'app/lib']
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+MODULE_SUFFIXES = ('.py', '.pyc', '.so', '.pyd')
+
+
+def top_level_name(relative_name):
+    """
+    The top level module an archive entry provides when its directory is on
+    sys.path, or None.
+
+    :param relative_name: Archive name relative to the search directory.
+    :return:
+    """
+    parts = relative_name.split('/')
+    if len(parts) > 1:
+        # Packages, including namespace packages. __pycache__ only holds bytecode.
+        return parts[0] if IDENTIFIER.match(parts[0]) and parts[0] != '__pycache__' else None
+    if not parts[0].endswith(MODULE_SUFFIXES):
+        return None
+    name = parts[0].split('.')[0]
+    return name if IDENTIFIER.match(name) else None
+
+
+def build_index(names, vendor_dir):
+    """
+    Map every top level module in the artifact to the directory it is
+    imported from.
+
+    :param names: Archive names in the artifact.
+    :param vendor_dir: Project relative vendor directory.
+    :return: Dict of module name -> archive directory.
+    """
+    search_dirs = SEARCH_DIRS + [vendor_dir.strip('/')]
+    index = {}
+    for directory in search_dirs:
+        prefix = directory + '/' if directory else ''
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            module = top_level_name(name[len(prefix):])
+            if module and module != '__init__' and module not in index:
+                index[module] = directory
+    return index
+
+
+def render_index(index):
+    lines = ['# Generated by `tight generate artifact --import-index`, do not edit.', 'MODULES = {']
+    lines += ['    {!r}: {!r},'.format(name, index[name]) for name in sorted(index)]
+    lines += ['}', '']
+    return '\n'.join(lines)
+
+
+def write_index(names, vendor_dir, output_dir):
+    """
+    Render the import index for an artifact.
+
+    :param names: Archive names in the artifact.
+    :param vendor_dir:
+    :param output_dir: Directory to write the generated module to.
+    :return: Tuple of (archive name, path of the generated file).
+    """
+    path = os.path.join(output_dir, INDEX_NAME)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as index_file:
+        index_file.write(render_index(build_index(names, vendor_dir)))
+    return INDEX_NAME, path
+
+
+# Tree shaking: a static import graph of the app, used to find vendored
+# packages that no handler can reach.
+
+DYNAMIC_IMPORTERS = ('import_module', '__import__')
+# Registries load any of their modules by name once the package is imported.
+REGISTRY_ROOTS = ['app/models', 'app/serializers']
+# Loaded by name at runtime (tight loads handlers, the registries load models).
+DYNAMIC_ROOTS = ['app/functions'] + REGISTRY_ROOTS
+ENTRYPOINT = 'app_index.py'
+
+
+def parse_imports(path, module_name, is_package):
+    """
+    Module names imported by a file, including constant string arguments of
+    importlib.import_module() and __import__().
+
+    :param path:
+    :param module_name: Dotted name of the module, used for relative imports.
+    :param is_package: True for __init__.py files.
+    :return: Set of absolute module names, or an empty set if the file can't be parsed.
+    """
+    import ast
+    try:
+        with open(path, 'rb') as source:
+            tree = ast.parse(source.read(), path)
+    except (SyntaxError, ValueError):
+        return set()
+    package = module_name if is_package else module_name.rpartition('.')[0]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split('.') if package else []
+                if node.level - 1 > len(parts):
+                    continue
+                base = '.'.join(parts[:len(parts) - (node.level - 1)] + ([node.module] if node.module else []))
+            else:
+                base = node.module
+            if not base:
+                continue
+            names.add(base)
+            # `from package import submodule`
+            names.update('{}.{}'.format(base, alias.name) for alias in node.names if alias.name != '*')
+        elif isinstance(node, ast.Call):
+            function = node.func
+            function_name = getattr(function, 'attr', None) or getattr(function, 'id', None)
+            if function_name in DYNAMIC_IMPORTERS and node.args:
+                argument = node.args[0]
+                value = getattr(argument, 'value', getattr(argument, 's', None))
+                if isinstance(value, str) and not value.startswith('.'):
+                    names.add(value)
+    return names
+
+
+class ImportGraph(object):
+    """
+    Resolves module names the way the app's sys.path does (project root,
+    serializers, models, lib, then the vendor dir) and walks the imports
+    reachable from a set of root files.
+    """
+
+    def __init__(self, target, vendor_dir):
+        self.target = target
+        self.vendor_dir = vendor_dir.strip('/')
+        self.search_dirs = [os.path.join(target, directory) for directory in SEARCH_DIRS + [self.vendor_dir]]
+        self.registries = dict((os.path.join(target, directory, '__init__.py'), directory) for directory in REGISTRY_ROOTS)
+        self.reached = set()
+        # Modules are imported from many files, so resolutions and directory
+        # listings are cached for the life of the graph.
+        self.resolved = {}
+        self.listings = {}
+
+    def resolve(self, name):
+        """
+        :param name: Absolute dotted module name.
+        :return: List of (path, module name, is package) for the module and
+                 its parent packages, which are executed first. Empty when
+                 the module is not part of the project (stdlib, runtime).
+        """
+        if name not in self.resolved:
+            self.resolved[name] = self._resolve(name)
+        return self.resolved[name]
+
+    def _resolve(self, name):
+        parts = name.split('.')
+        for directory in self.search_dirs:
+            if self._find(directory, parts[0]):
+                break
+        else:
+            return []
+        resolved = []
+        for index in range(1, len(parts) + 1):
+            found = self._find(os.path.join(directory, *parts[:index - 1]), parts[index - 1])
+            if not found:
+                break
+            resolved.append(found + ('.'.join(parts[:index]),))
+        return [(path, module_name, is_package) for path, is_package, module_name in resolved]
+
+    def _find(self, directory, name):
+        """
+        :return: Tuple of (path, is package) or None. Namespace packages and
+                 extension modules resolve to their directory / binary.
+        """
+        entries = self._list(directory)
+        package = os.path.join(directory, name)
+        if entries.get(name):
+            init = os.path.join(package, '__init__.py')
+            return (init if self._list(package).get('__init__.py') is False else package, True)
+        if entries.get(name + '.py') is False:
+            return (package + '.py', False)
+        for filename in sorted(entries):
+            if filename.startswith(name + '.') and filename.endswith(('.so', '.pyd')) and not entries[filename]:
+                return (os.path.join(directory, filename), False)
+        return None
+
+    def _list(self, directory):
+        """
+        :return: Dict of entry name -> is directory, empty when directory
+                 doesn't exist.
+        """
+        if directory not in self.listings:
+            try:
+                self.listings[directory] = dict((entry.name, entry.is_dir()) for entry in os.scandir(directory))
+            except OSError:
+                self.listings[directory] = {}
+        return self.listings[directory]
+
+    def walk(self, roots):
+        """
+        Mark every file reachable from roots.
+
+        :param roots: List of (path, module name, is package).
+        """
+        stack = list(roots)
+        while stack:
+            path, module_name, is_package = stack.pop()
+            if path in self.reached:
+                continue
+            self.reached.add(path)
+            if not path.endswith('.py'):
+                continue
+            if path in self.registries:
+                directory = self.registries[path]
+                stack.extend(self.module_files(os.path.join(self.target, directory), directory.replace('/', '.')))
+            for name in parse_imports(path, module_name, is_package):
+                stack.extend(self.resolve(name))
+
+    def module_files(self, directory, package):
+        """
+        Every python file below a directory as roots.
+        """
+        roots = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            relative = os.path.relpath(dirpath, directory)
+            prefix = package if relative == '.' else '{}.{}'.format(package, relative.replace(os.sep, '.'))
+            for filename in filenames:
+                if filename.endswith('.py'):
+                    is_package = filename == '__init__.py'
+                    name = prefix if is_package else '{}.{}'.format(prefix, filename[:-3])
+                    roots.append((os.path.join(dirpath, filename), name, is_package))
+        return roots
+
+
+def walk_app(target, vendor_dir, root_dirs, allow=None):
+    """
+    Walk the imports of app_index.py and every module below root_dirs.
+
+    :param target: Project root.
+    :param vendor_dir: Project relative vendor directory.
+    :param root_dirs: Project relative directories whose modules are loaded by name.
+    :param allow: Module names that are imported dynamically. They, their
+                  submodules and everything they import are reached.
+    :return: ImportGraph
+    """
+    graph = ImportGraph(target, vendor_dir)
+    roots = []
+    entrypoint = os.path.join(target, ENTRYPOINT)
+    if os.path.isfile(entrypoint):
+        roots.append((entrypoint, ENTRYPOINT[:-3], False))
+    for directory in root_dirs:
+        package = directory.replace('/', '.')
+        roots += graph.resolve(package)
+        roots += graph.module_files(os.path.join(target, directory), package)
+    for name in allow or []:
+        resolved = graph.resolve(name)
+        roots += resolved
+        if resolved and resolved[-1][2]:
+            path = resolved[-1][0]
+            roots += graph.module_files(path if os.path.isdir(path) else os.path.dirname(path), name)
+    graph.walk(roots)
+    return graph
+
+
+def unreachable_entries(graph):
+    """
+    :param graph: A walked ImportGraph.
+    :return: Sorted list of vendor dir entries the graph doesn't reach.
+    """
+    vendor_path = os.path.join(graph.target, graph.vendor_dir)
+    if not os.path.isdir(vendor_path):
+        return []
+    reached_top = set(os.path.relpath(path, vendor_path).split(os.sep)[0] for path in graph.reached
+                      if path.startswith(vendor_path + os.sep))
+    unreachable = []
+    metadata = []
+    for entry in sorted(os.listdir(vendor_path)):
+        if entry.endswith(('.dist-info', '.egg-info')):
+            metadata.append(entry)
+        elif top_level_name(entry + ('/' if os.path.isdir(os.path.join(vendor_path, entry)) else '')) \
+                and entry != '__init__.py' and entry not in reached_top:
+            unreachable.append(entry)
+    unreachable_set = set(unreachable)
+    for entry in metadata:
+        provided = distribution_top_levels(os.path.join(vendor_path, entry))
+        if provided and provided <= unreachable_set:
+            unreachable.append(entry)
+    return sorted(unreachable)
+
+
+def find_unreachable(target, vendor_dir, allow=None):
+    """
+    List vendored top level packages and modules that can't be reached by
+    static imports from app_index.py, the function handlers, models and
+    serializers, along with the metadata of their distributions.
+
+    :param target: Project root.
+    :param vendor_dir: Project relative vendor directory.
+    :param allow: Module names that are imported dynamically, see walk_app.
+    :return: Sorted list of entries directly below vendor_dir.
+    """
+    return unreachable_entries(walk_app(target, vendor_dir, DYNAMIC_ROOTS, allow))
+
+
+def function_closure(target, vendor_dir, function, allow=None):
+    """
+    The project modules and vendored packages a single function needs: its
+    own modules and what they import from app/lib, the models, serializers and
+    vendor_dir. Importing a registry package pulls in all of its modules,
+    since any of them can be loaded by name.
+
+    :param target: Project root.
+    :param vendor_dir: Project relative vendor directory.
+    :param function: Directory name below app/functions.
+    :param allow: Module names that are imported dynamically, see walk_app.
+    :return: Tuple of (set of reached project python files as archive names,
+             list of unreachable vendor dir entries).
+    """
+    graph = walk_app(target, vendor_dir, ['app/functions/{}'.format(function)], allow)
+    vendor_path = os.path.join(target, graph.vendor_dir) + os.sep
+    reached = set(os.path.relpath(path, target).replace(os.sep, '/') for path in graph.reached
+                  if path.endswith('.py') and not path.startswith(vendor_path))
+    return reached, unreachable_entries(graph)
+
+
+def distribution_top_levels(metadata_dir):
+    """
+    Entries directly below the vendor dir installed by a distribution,
+    according to its RECORD (wheels) or installed-files.txt (eggs).
+    """
+    provided = set()
+    for record_name in ['RECORD', 'installed-files.txt']:
+        record = os.path.join(metadata_dir, record_name)
+        if not os.path.isfile(record):
+            continue
+        with open(record) as record_file:
+            for line in record_file:
+                path = line.split(',')[0].strip()
+                if record_name == 'installed-files.txt':
+                    path = os.path.normpath(os.path.join(os.path.basename(metadata_dir), path))
+                top = path.replace(os.sep, '/').split('/')[0]
+                if top and top != '..' and not top.endswith(('.dist-info', '.egg-info')) and top != '__pycache__':
+                    provided.add(top)
+    return provided
+
+
+def load_allowlist(config):
+    """
+    Modules imported dynamically, from the `artifact.shake` section of tight.yml:
+
+    artifact:
+      shake:
+        allow:
+          - pkg_resources
+          - mypackage.plugins
+
+    :param config: Parsed tight.yml.
+    :return: List of module names.
+    """
+    shake_config = (config.get('artifact') or {}).get('shake') or {}
+    return list(shake_config.get('allow') or [])
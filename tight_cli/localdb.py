@@ -0,0 +1,441 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import sqlite3
+import tarfile
+import time
+import urllib.request
+from tight_cli.utils import get_cache_dir
+
+DB_DIR = 'dynamo_db'
+# DynamoDB Local keeps every table in one SQLite file when run with -sharedDb.
+SHARED_DB = 'shared-local-instance.db'
+SNAPSHOTS_DIR = 'snapshots'
+SNAPSHOT_SUFFIX = '.db'
+SNAPSHOT_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def db_dir(target):
+    return os.path.join(target, DB_DIR)
+
+
+def shared_db_path(target):
+    return os.path.join(db_dir(target), SHARED_DB)
+
+
+def snapshot_path(target, name):
+    """
+    :param target: Project root.
+    :param name: Snapshot name.
+    :return:
+    """
+    if not SNAPSHOT_NAME.match(name) or name.startswith('.'):
+        raise ValueError('Snapshot names may only contain letters, digits, `_`, `-` and `.`: {!r}'.format(name))
+    return os.path.join(db_dir(target), SNAPSHOTS_DIR, name + SNAPSHOT_SUFFIX)
+
+
+def list_snapshots(target):
+    """
+    :param target: Project root.
+    :return: Sorted snapshot names.
+    """
+    directory = os.path.join(db_dir(target), SNAPSHOTS_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(filename[:-len(SNAPSHOT_SUFFIX)] for filename in os.listdir(directory)
+                  if filename.endswith(SNAPSHOT_SUFFIX))
+
+
+def copy_database(source, destination):
+    """
+    Copy a SQLite database with the online backup API, or dump_database on
+    Python 3.6 where it isn't available. The copy is consistent even while
+    DynamoDB Local is writing to source, and writing into a database that is
+    open elsewhere goes through SQLite's locking, so a running instance sees
+    the restored data.
+
+    :param source:
+    :param destination:
+    :return: Size of destination in bytes.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    source_connection = sqlite3.connect(source)
+    try:
+        destination_connection = sqlite3.connect(destination)
+        try:
+            if hasattr(source_connection, 'backup'):
+                source_connection.backup(destination_connection)
+            else:
+                dump_database(source_connection, destination_connection)
+        finally:
+            destination_connection.close()
+    finally:
+        source_connection.close()
+    return os.path.getsize(destination)
+
+
+def dump_database(source_connection, destination_connection):
+    """
+    Replace the contents of destination with an SQL dump of source, for
+    Pythons without Connection.backup (added in 3.7). Source is read in a
+    single read transaction and destination is written in a single write
+    transaction, so both sides stay consistent.
+
+    :param source_connection:
+    :param destination_connection:
+    :return:
+    """
+    source_connection.isolation_level = None
+    destination_connection.isolation_level = None
+    source_connection.execute('BEGIN')
+    try:
+        destination_connection.execute('BEGIN IMMEDIATE')
+        try:
+            objects = destination_connection.execute(
+                "SELECT type, name FROM sqlite_master WHERE type IN ('view', 'trigger', 'table') "
+                "AND name NOT LIKE 'sqlite_%' ORDER BY type = 'table'").fetchall()
+            for object_type, name in objects:
+                destination_connection.execute('DROP {} IF EXISTS "{}"'.format(object_type.upper(), name.replace('"', '""')))
+            for statement in source_connection.iterdump():
+                if statement not in ('BEGIN TRANSACTION;', 'COMMIT;'):
+                    destination_connection.execute(statement)
+        except BaseException:
+            destination_connection.execute('ROLLBACK')
+            raise
+        destination_connection.execute('COMMIT')
+    finally:
+        source_connection.execute('ROLLBACK')
+
+
+def snapshot(target, name):
+    """
+    Save the shared database as a named snapshot.
+
+    :param target: Project root.
+    :param name: Snapshot name, an existing snapshot is replaced.
+    :return: Tuple of (snapshot path, size in bytes).
+    """
+    source = shared_db_path(target)
+    if not os.path.isfile(source):
+        raise ValueError('No database at {}. Run `tight dynamo rundb --persist` first.'.format(source))
+    destination = snapshot_path(target, name)
+    return destination, copy_database(source, destination)
+
+
+def restore(target, name):
+    """
+    Replace the contents of the shared database with a snapshot.
+
+    :param target: Project root.
+    :param name: Snapshot name.
+    :return: Tuple of (snapshot path, size in bytes).
+    """
+    source = snapshot_path(target, name)
+    if not os.path.isfile(source):
+        available = ', '.join(list_snapshots(target)) or 'none'
+        raise ValueError('No snapshot named {!r} (available: {}).'.format(name, available))
+    return source, copy_database(source, shared_db_path(target))
+
+
+PIDFILE = 'rundb.pid'
+LOGFILE = 'rundb.log'
+DEFAULT_PORT = 8000
+# Readiness polling: first delay, multiplier and cap, in seconds.
+POLL_INITIAL = 0.05
+POLL_FACTOR = 2
+POLL_MAX = 1.0
+
+
+def build_command(target, port=DEFAULT_PORT, in_memory=False):
+    """
+    Command line starting DynamoDB Local from dynamo_db.
+
+    :param target: Project root.
+    :param port:
+    :param in_memory: Keep tables in memory instead of dynamo_db/shared-local-instance.db.
+    :return:
+    """
+    directory = db_dir(target)
+    command = ['java', '-Djava.library.path={}/DynamoDBLocal_lib'.format(directory),
+               '-jar', '{}/DynamoDBLocal.jar'.format(directory), '-port', str(port), '-sharedDb']
+    if in_memory:
+        return command + ['-inMemory']
+    return command + ['-dbPath', directory]
+
+
+def free_port():
+    """
+    An unused local port, for running DynamoDB Local behind a proxy.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+def is_ready(port, timeout=1.0):
+    """
+    True once DynamoDB Local answers HTTP requests. Any response, even an
+    authentication error, means the server is up.
+    """
+    connection = http.client.HTTPConnection('localhost', port, timeout=timeout)
+    try:
+        connection.request('POST', '/', body='{}', headers={
+            'X-Amz-Target': 'DynamoDB_20120810.ListTables',
+            'Content-Type': 'application/x-amz-json-1.0'
+        })
+        connection.getresponse().read()
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+
+def wait_until_ready(port, process=None, timeout=30.0, sleep=None, clock=None):
+    """
+    Poll DynamoDB Local with exponential backoff until it is ready.
+
+    :param port:
+    :param process: Popen of the server, to fail fast when it exits.
+    :param timeout: Seconds to wait before giving up.
+    :return: Seconds until the server was ready.
+    """
+    sleep = sleep or time.sleep
+    clock = clock or time.time
+    start = clock()
+    delay = POLL_INITIAL
+    while True:
+        if is_ready(port):
+            return clock() - start
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('DynamoDB Local exited with code {} before it was ready.'.format(process.returncode))
+        elapsed = clock() - start
+        if elapsed >= timeout:
+            raise RuntimeError('DynamoDB Local was not ready on port {} after {:.1f}s.'.format(port, elapsed))
+        sleep(min(delay, timeout - elapsed))
+        delay = min(delay * POLL_FACTOR, POLL_MAX)
+
+
+def pidfile_path(target):
+    return os.path.join(db_dir(target), PIDFILE)
+
+
+def write_pidfile(target, pid, port, in_memory):
+    with open(pidfile_path(target), 'w') as pidfile:
+        json.dump({'pid': pid, 'port': port, 'in_memory': in_memory}, pidfile)
+
+
+def read_pidfile(target):
+    """
+    The detached instance recorded in dynamo_db/rundb.pid, if it is still
+    running. Stale pidfiles are removed.
+
+    :param target: Project root.
+    :return: Dict with pid, port and in_memory, or None.
+    """
+    path = pidfile_path(target)
+    try:
+        with open(path) as pidfile:
+            instance = json.load(pidfile)
+        os.kill(instance['pid'], 0)
+    except (OSError, ValueError, KeyError, TypeError):
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    return instance
+
+
+def stop(target):
+    """
+    Stop the detached instance.
+
+    :param target: Project root.
+    :return: The pid that was stopped, or None when nothing was running.
+    """
+    instance = read_pidfile(target)
+    if instance is None:
+        return None
+    try:
+        os.kill(instance['pid'], signal.SIGTERM)
+    except OSError:
+        pass
+    os.remove(pidfile_path(target))
+    return instance['pid']
+
+
+DOWNLOAD_URL = 'https://s3-us-west-2.amazonaws.com/dynamodb-local/dynamodb_local_latest.tar.gz'
+# AWS publishes a checksum next to each archive.
+CHECKSUM_SUFFIX = '.sha256'
+INSTALL_MARKER = '.tight-dynamodb.json'
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as archive:
+        for chunk in iter(lambda: archive.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(url, destination):
+    """
+    :param url:
+    :param destination: Written atomically.
+    """
+    temporary = '{}.tmp'.format(destination)
+    with urllib.request.urlopen(url) as response, open(temporary, 'wb') as output:
+        shutil.copyfileobj(response, output)
+    os.replace(temporary, destination)
+
+
+def cached_archive(url=DOWNLOAD_URL, from_archive=None, expected=None, refresh=False):
+    """
+    Locate the DynamoDB Local archive in the machine cache, adding it from a
+    local file or downloading it when needed, and verify its checksum.
+
+    :param url: Archive to download on a cache miss.
+    :param from_archive: Local tarball to install from, no network access.
+    :param expected: Expected sha256. Defaults to the checksum published
+                     next to url; archives from a local path are trusted
+                     when it is not given.
+    :param refresh: Download url again even when it is cached.
+    :return: Tuple of (archive path, sha256).
+    """
+    archives = get_cache_dir('dynamodb', 'archives')
+    if from_archive:
+        digest = sha256_file(from_archive)
+        if expected and digest != expected.lower():
+            raise ValueError('Checksum mismatch for {}: expected {}, got {}.'.format(from_archive, expected, digest))
+        path = os.path.join(archives, '{}.tar.gz'.format(digest))
+        if not os.path.isfile(path):
+            shutil.copyfile(from_archive, '{}.tmp'.format(path))
+            os.replace('{}.tmp'.format(path), path)
+        return path, digest
+
+    name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(archives, '{}.tar.gz'.format(name))
+    checksum_path = path + CHECKSUM_SUFFIX
+    if refresh or not os.path.isfile(path) or not os.path.isfile(checksum_path):
+        if not expected:
+            download(url + CHECKSUM_SUFFIX, checksum_path + '.published')
+            with open(checksum_path + '.published') as published:
+                expected = published.read().split()[0]
+            os.remove(checksum_path + '.published')
+        download(url, path)
+        with open(checksum_path, 'w') as checksum_file:
+            checksum_file.write(expected.lower())
+    with open(checksum_path) as checksum_file:
+        recorded = checksum_file.read().strip()
+    digest = sha256_file(path)
+    if digest != (expected or recorded).lower():
+        os.remove(path)
+        raise ValueError('Checksum mismatch for {}: expected {}, got {}. The cached copy was removed.'.format(
+            url, expected or recorded, digest))
+    return path, digest
+
+
+def extracted_copy(archive, digest):
+    """
+    The archive extracted once per machine, in the cache.
+
+    :return: Directory of the extracted copy.
+    """
+    extracted = get_cache_dir('dynamodb', 'extracted')
+    directory = os.path.join(extracted, digest)
+    if os.path.isdir(directory):
+        return directory
+    temporary = '{}.tmp'.format(directory)
+    if os.path.isdir(temporary):
+        shutil.rmtree(temporary)
+    with tarfile.open(archive) as tar:
+        for member in tar.getmembers():
+            if member.name.startswith(('/', '..')) or '/../' in member.name:
+                raise ValueError('Refusing to extract {} from {}.'.format(member.name, archive))
+        # Python 3.12 warns unless a filter is given; older versions have no filters.
+        tar.extractall(temporary, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+    os.replace(temporary, directory)
+    return directory
+
+
+def read_install_marker(target):
+    """
+    :param target: Project root.
+    :return: Dict with the sha256 and entries of the install, empty when
+             there is none.
+    """
+    try:
+        with open(os.path.join(db_dir(target), INSTALL_MARKER)) as marker:
+            installed = json.load(marker)
+    except (OSError, ValueError):
+        return {}
+    return installed if isinstance(installed, dict) else {}
+
+
+def installed_version(target):
+    """
+    :param target: Project root.
+    :return: sha256 of the archive linked into dynamo_db, or None.
+    """
+    return read_install_marker(target).get('sha256')
+
+
+def link_install(target, source, digest):
+    """
+    Symlink every entry of the shared extracted copy into dynamo_db, and
+    remove the links of a previous version that this one doesn't have. Local
+    data (the database, snapshots, pidfile) is left in place.
+
+    :param target: Project root.
+    :param source: Extracted copy.
+    :param digest: Archive sha256, recorded in the install marker.
+    :return:
+    """
+    directory = db_dir(target)
+    os.makedirs(directory, exist_ok=True)
+    entries = os.listdir(source)
+    for stale in set(read_install_marker(target).get('entries') or []) - set(entries):
+        link = os.path.join(directory, stale)
+        if os.path.islink(link):
+            os.remove(link)
+    for entry in entries:
+        link = os.path.join(directory, entry)
+        if os.path.islink(link) or os.path.isfile(link):
+            os.remove(link)
+        elif os.path.isdir(link):
+            shutil.rmtree(link)
+        os.symlink(os.path.join(source, entry), link)
+    with open(os.path.join(directory, INSTALL_MARKER), 'w') as marker:
+        json.dump({'sha256': digest, 'entries': sorted(entries)}, marker)
+
+
+def install(target, url=DOWNLOAD_URL, from_archive=None, expected=None, refresh=False):
+    """
+    Install DynamoDB Local into target/dynamo_db from the machine cache.
+
+    :return: Tuple of (sha256, True when the project already had this version).
+    """
+    archive, digest = cached_archive(url, from_archive, expected, refresh)
+    jar = os.path.join(db_dir(target), 'DynamoDBLocal.jar')
+    if installed_version(target) == digest and os.path.exists(jar):
+        return digest, True
+    link_install(target, extracted_copy(archive, digest), digest)
+    return digest, False
@@ -0,0 +1,170 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import shutil
+import subprocess
+
+# Built-in rules, relative to vendor_dir. Rules use gitignore style syntax:
+# `**` matches any number of directories, a trailing `/` matches everything
+# below a directory, a leading `/` anchors a pattern to vendor_dir, `!`
+# re-includes a path and the last matching rule wins.
+DEFAULT_RULES = [
+    '**/__pycache__/',
+    '**/*.pyc',
+    '**/*.pyo',
+    '**/*.pyi',
+    '*/tests/',
+    '*/test/',
+    '*/docs/',
+    # importlib.metadata only needs METADATA (versions) and entry_points.txt.
+    '*.dist-info/*',
+    '!*.dist-info/METADATA',
+    '!*.dist-info/entry_points.txt',
+    '*.egg-info/*',
+    '!*.egg-info/PKG-INFO',
+    '!*.egg-info/entry_points.txt',
+    # Written by `tight pip install --requirements`.
+    '/.tight-vendor.json',
+]
+SHARED_OBJECT = re.compile(r'\.so(\.[0-9]+)*$')
+STRIP = 'strip'
+
+
+def compile_rule(rule):
+    """
+    Translate a rule into (regex, negated). Like .gitignore, patterns without
+    a `/` match at any depth and a leading `/` anchors a pattern to vendor_dir.
+    """
+    negated = rule.startswith('!')
+    pattern = rule[1:] if negated else rule
+    anchored = pattern.startswith('/')
+    directory = pattern.endswith('/')
+    pattern = pattern.strip('/')
+    if not anchored and '/' not in pattern and not pattern.startswith('**'):
+        pattern = '**/' + pattern
+    regex = ''
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index):
+            regex += '(?:.*/)?'
+            index += 3
+        elif pattern.startswith('**', index):
+            regex += '.*'
+            index += 2
+        elif pattern[index] == '*':
+            regex += '[^/]*'
+            index += 1
+        elif pattern[index] == '?':
+            regex += '[^/]'
+            index += 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+    regex += '/.*' if directory else '(?:/.*)?'
+    return re.compile('^{}$'.format(regex)), negated
+
+
+class PruneRules(object):
+    """
+    Decides which vendored files are left out of an artifact.
+    """
+
+    def __init__(self, rules, strip=True):
+        self.rules = [(rule, compile_rule(rule)) for rule in rules]
+        self.strip = strip and shutil.which(STRIP) is not None
+
+    def match(self, path):
+        """
+        :param path: Path relative to vendor_dir, using `/` separators.
+        :return: The rule that excludes path, or None if it is kept.
+        """
+        excluded_by = None
+        for rule, (regex, negated) in self.rules:
+            if regex.match(path):
+                excluded_by = None if negated else rule
+        return excluded_by
+
+    def should_strip(self, path):
+        return self.strip and bool(SHARED_OBJECT.search(path))
+
+
+def load_rules(config):
+    """
+    Build rules from the `artifact.prune` section of tight.yml:
+
+    artifact:
+      prune:
+        defaults: true   # apply DEFAULT_RULES
+        rules: []        # extra rules, applied after the defaults
+        strip: true      # strip debug symbols from shared objects
+
+    `prune: false` disables pruning.
+
+    :param config: Parsed tight.yml.
+    :return: PruneRules or None when pruning is disabled.
+    """
+    prune_config = (config.get('artifact') or {}).get('prune', {})
+    if prune_config is False:
+        return None
+    if prune_config is True or prune_config is None:
+        prune_config = {}
+    rules = list(DEFAULT_RULES) if prune_config.get('defaults', True) else []
+    rules += prune_config.get('rules') or []
+    return PruneRules(rules, strip=prune_config.get('strip', True))
+
+
+def strip_shared_object(path, digest, cache_dir):
+    """
+    Write a copy of a shared object without debug symbols.
+
+    :param path:
+    :param digest: Content hash of path, used as the cache key.
+    :param cache_dir:
+    :return: Path of the stripped copy, or path when it can't be stripped
+             (e.g. a foreign architecture).
+    """
+    stripped = os.path.join(cache_dir, '{}.so'.format(digest))
+    if os.path.isfile(stripped):
+        return stripped
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = '{}.tmp'.format(stripped)
+    result = subprocess.call([STRIP, '--strip-debug', '-o', temporary, path],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result != 0 or not os.path.isfile(temporary) or os.path.getsize(temporary) >= os.path.getsize(path):
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return path
+    os.replace(temporary, stripped)
+    return stripped
+
+
+def package_name(name, vendor_prefix):
+    """
+    Group an archive entry under the vendored package it belongs to.
+
+    :param name: Archive name.
+    :param vendor_prefix: Archive name of vendor_dir.
+    :return:
+    """
+    if not name.startswith(vendor_prefix + '/') or name == vendor_prefix + '/__init__.py':
+        return '(project)'
+    top = name[len(vendor_prefix) + 1:].split('/')[0]
+    if top.endswith('.dist-info') or top.endswith('.egg-info'):
+        return '(metadata)'
+    if '/' not in name[len(vendor_prefix) + 1:]:
+        # Single module packages, e.g. six.py or _cffi_backend.cpython-36m-x86_64-linux-gnu.so
+        return top.split('.')[0]
+    return top
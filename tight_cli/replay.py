@@ -0,0 +1,214 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tight_cli import runtime
+
+# `tight invoke` streams newline delimited JSON events through a function's
+# handler. At most a few events per worker are held at once, and results are
+# written in input order as soon as they are ready, so neither the input nor
+# the output has to fit in memory.
+
+EXPECTATIONS_DIR = 'tests/functions/integration/{}/expectations'
+# Generated expectations are named after the method they test, e.g.
+# test_get_method.yml holds the response to a GET.
+METHOD_EXPECTATION = re.compile(r'^test_([a-z]+)_method$')
+# An event line may name its expectation with this key, which is removed
+# before the event is passed to the handler.
+EXPECTATION_KEY = 'expectation'
+# Events read ahead per worker.
+WINDOW_PER_WORKER = 2
+
+
+def read_events(lines):
+    """
+    :param lines: Iterable of NDJSON lines.
+    :return: Generator of (line number, event, error); blank lines are skipped.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError as e:
+            yield number, None, 'Invalid JSON: {}'.format(e)
+            continue
+        if not isinstance(event, dict):
+            yield number, None, 'Expected a JSON object'
+            continue
+        yield number, event, None
+
+
+def load_expectations(directory):
+    """
+    :param directory: Directory of expectation YAML files.
+    :return: Dict of name (file name without extension) -> expected response.
+    """
+    import yaml
+    expectations = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.yml'))):
+        with open(path) as expectation_file:
+            expected = yaml.safe_load(expectation_file)
+        if isinstance(expected, dict):
+            expectations[os.path.basename(path)[:-len('.yml')]] = expected
+    return expectations
+
+
+def find_expectation(expectations, event, name=None):
+    """
+    :param expectations: From load_expectations.
+    :param event:
+    :param name: Expectation named by the event line, if any.
+    :return: Tuple of (name, expected response), or (None, None).
+    """
+    if name:
+        return name, expectations.get(name)
+    method = str(event.get('httpMethod', '')).lower()
+    for candidate, expected in sorted(expectations.items()):
+        match = METHOD_EXPECTATION.match(candidate)
+        if match and match.group(1) == method:
+            return candidate, expected
+    return None, None
+
+
+def decode_body(body):
+    if isinstance(body, str):
+        try:
+            return json.loads(body)
+        except ValueError:
+            return body
+    return body
+
+
+def compare_response(expected, actual):
+    """
+    Compare a response with an expectation: the status code, the body (as
+    JSON when both parse) and the expected headers.
+
+    :return: Names of the differing parts, e.g. ['body', 'headers.Content-Type'].
+    """
+    if not isinstance(actual, dict):
+        return ['response']
+    differences = []
+    if 'statusCode' in expected and expected['statusCode'] != actual.get('statusCode'):
+        differences.append('statusCode')
+    if 'body' in expected and decode_body(expected['body']) != decode_body(actual.get('body')):
+        differences.append('body')
+    actual_headers = actual.get('headers') or {}
+    for header, value in sorted((expected.get('headers') or {}).items()):
+        if str(actual_headers.get(header)) != str(value):
+            differences.append('headers.{}'.format(header))
+    return differences
+
+
+def invoke_event(app, function, number, event, error, expectations):
+    """
+    Invoke the handler with one event.
+
+    :return: Result dict written as one output line.
+    """
+    result = {'line': number}
+    if error:
+        result['error'] = error
+        return result
+    name = event.pop(EXPECTATION_KEY, None)
+    start = time.perf_counter()
+    try:
+        response = runtime.invoke(app, function, event)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+    finally:
+        result['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    result['response'] = response
+    if runtime.is_error(response):
+        result['error'] = 'Status {}'.format(response.get('statusCode') if isinstance(response, dict) else None)
+    if expectations:
+        name, expected = find_expectation(expectations, event, name)
+        if name and expected is None:
+            result['mismatch'] = ['missing expectation {}'.format(name)]
+        elif expected is not None:
+            result['expectation'] = name
+            differences = compare_response(expected, response)
+            if differences:
+                result['mismatch'] = differences
+    return result
+
+
+class Stats(object):
+    def __init__(self):
+        self.start = time.time()
+        self.events = 0
+        self.errors = 0
+        self.mismatches = 0
+        self.compared = 0
+
+    def add(self, result):
+        self.events += 1
+        self.errors += 1 if 'error' in result else 0
+        self.compared += 1 if 'expectation' in result or 'mismatch' in result else 0
+        self.mismatches += 1 if 'mismatch' in result else 0
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.events / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return '{} events, {} errors, {} of {} compared differ, {:.1f} events/s'.format(
+            self.events, self.errors, self.mismatches, self.compared, self.rate())
+
+
+def replay(app, function, lines, write, concurrency=1, expectations=None, progress=None, interval=1.0):
+    """
+    Stream events through a function.
+
+    :param app: Module returned by runtime.load_app.
+    :param function:
+    :param lines: Iterable of NDJSON event lines, read lazily.
+    :param write: Called with each output line, in input order.
+    :param concurrency: Events invoked at once.
+    :param expectations: From load_expectations.
+    :param progress: Called with the Stats at most every interval seconds.
+    :param interval:
+    :return: Stats
+    """
+    stats = Stats()
+    pending = deque()
+    window = concurrency * WINDOW_PER_WORKER
+    last_progress = [time.time()]
+
+    def drain(limit):
+        # Write finished results in input order, waiting for the oldest while
+        # more than limit are pending.
+        while pending and (len(pending) > limit or pending[0].done()):
+            result = pending.popleft().result()
+            stats.add(result)
+            write(json.dumps(result, sort_keys=True, default=str))
+            if progress and time.time() - last_progress[0] >= interval:
+                last_progress[0] = time.time()
+                progress(stats)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for number, event, error in read_events(lines):
+            pending.append(pool.submit(invoke_event, app, function, number, event, error, expectations))
+            drain(window - 1)
+        drain(0)
+    return stats
@@ -0,0 +1,134 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import os
+import sys
+import time
+import uuid
+
+# Runs an app's functions in the current interpreter the way Lambda does:
+# app_index is imported once and `app_index.<function>(event, context)` is
+# called per invocation, so module state stays warm between calls.
+
+ENTRYPOINT = 'app_index'
+HANDLER_MODULE = 'app.functions.{}.handler'
+# Set like the generated conftest.py does, unless env.yml says otherwise.
+DEFAULT_ENV = {'AWS_REGION': 'us-west-2', 'CI': 'False', 'USE_LOCAL_DB': 'True'}
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MEMORY = 128
+
+
+class Context(object):
+    """
+    Stand-in for the context object Lambda passes to handlers.
+    """
+
+    def __init__(self, function_name, timeout=DEFAULT_TIMEOUT, memory=DEFAULT_MEMORY):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = 'arn:aws:lambda:{}:000000000000:function:{}'.format(
+            os.environ.get('AWS_REGION', DEFAULT_ENV['AWS_REGION']), function_name)
+        self.memory_limit_in_mb = memory
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = '/aws/lambda/{}'.format(function_name)
+        self.log_stream_name = 'local'
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def project_env(target):
+    """
+    The environment handlers run in: the current environment, env.yml and
+    the defaults of the generated conftest.py.
+    """
+    from tight_cli.coldstart import project_env as import_env
+    env = import_env(target)
+    for key, value in DEFAULT_ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def load_app(target, vendor_dir='app/vendored', env=None):
+    """
+    Import the app entrypoint in this interpreter. The runtime discovers
+    functions relative to the working directory, so this changes into the
+    project root.
+
+    :param target: Project root.
+    :param vendor_dir: Relative to target, from tight.yml.
+    :param env: Variables to set. Defaults to project_env(target).
+    :return: The app_index module.
+    """
+    target = os.path.abspath(target)
+    os.environ.update(project_env(target) if env is None else env)
+    for path in [os.path.join(target, vendor_dir), target]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.chdir(target)
+    return importlib.import_module(ENTRYPOINT)
+
+
+def invoke(app, function, event, context=None):
+    """
+    Call a function the way Lambda calls `app_index.<function>`.
+
+    :param app: Module returned by load_app.
+    :param function: Directory name below app/functions.
+    :param event:
+    :param context: Defaults to a fresh Context.
+    :return: The handler's response.
+    """
+    try:
+        handler = getattr(app, function)
+    except AttributeError:
+        raise LookupError('No function named {}'.format(function))
+    return handler(event, context or Context(function))
+
+
+def is_error(response):
+    """
+    True for responses API Gateway would turn into a server error.
+    """
+    return not isinstance(response, dict) or int(response.get('statusCode', 200)) >= 500
+
+
+def function_modules(function):
+    """
+    Loaded modules of a function: its handler and anything imported from
+    its directory, handler last.
+    """
+    handler = HANDLER_MODULE.format(function)
+    package = handler.rsplit('.', 1)[0]
+    names = sorted(name for name in sys.modules if name.startswith(package + '.') and name != handler)
+    if handler in sys.modules:
+        names.append(handler)
+    return names
+
+
+def reload_function(function):
+    """
+    Reload a function's modules in place. Shared code (app/lib, models,
+    vendored packages) is left alone.
+
+    :param function:
+    :return: Names of the reloaded modules.
+    """
+    importlib.invalidate_caches()
+    names = function_modules(function)
+    for name in names:
+        importlib.reload(sys.modules[name])
+    return names
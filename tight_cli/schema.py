@@ -0,0 +1,431 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+import glob
+import hashlib
+import json
+import os
+import string
+from tight_cli.utils import get_cache_dir
+
+# Flywheel models are read from source with `ast` instead of being imported,
+# so discovering them doesn't need env.yml or pay for importing flywheel, boto
+# and the models' own dependencies. Each model file holds the model class of
+# the same name (e.g. app/models/Account.py defines Account).
+
+# Bump when the shape of discovered models changes, invalidating the cache.
+DISCOVERY_VERSION = 1
+# Flywheel's default throughput, see dynamo3.Throughput.
+DEFAULT_THROUGHPUT = [5, 5]
+# Field types usable in keys -> DynamoDB attribute type.
+KEY_TYPES = {
+    'str': 'S', 'unicode': 'S', 'text_type': 'S', 'six.text_type': 'S', 'STRING': 'S', 'S': 'S',
+    'int': 'N', 'float': 'N', 'long': 'N', 'Decimal': 'N', 'decimal.Decimal': 'N', 'datetime': 'N',
+    'datetime.datetime': 'N', 'date': 'N', 'datetime.date': 'N', 'NUMBER': 'N', 'N': 'N',
+    'bytes': 'B', 'Binary': 'B', 'dynamo3.Binary': 'B', 'BINARY': 'B', 'B': 'B',
+}
+INDEX_PROJECTIONS = {'all_index': 'all', 'keys_index': 'keys', 'include_index': 'include'}
+# Environment variables are marked while evaluating table names, then turned
+# into str.format placeholders.
+ENV_MARK = '\x00'
+
+
+class UnsupportedModel(Exception):
+    """
+    Raised when a model uses constructs that can't be read statically. The
+    model is then imported instead.
+    """
+
+
+def dotted_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = dotted_name(node.value)
+        return '{}.{}'.format(base, node.attr) if base else None
+    return None
+
+
+def constant(node):
+    """
+    The value of a constant node, or None. Python < 3.8 has separate Str and Num nodes.
+    """
+    if type(node).__name__ in ('Constant', 'Str', 'Num', 'Bytes', 'NameConstant'):
+        return getattr(node, 'value', getattr(node, 's', getattr(node, 'n', None)))
+    return None
+
+
+def literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise UnsupportedModel('line {}: expected a literal'.format(getattr(node, 'lineno', '?')))
+
+
+class ModuleReader(object):
+    """
+    Evaluates the small set of expressions models use for table names:
+    string literals, os.environ lookups, `%`, `+`, str.format, f-strings and
+    references to module level string constants.
+    """
+
+    def __init__(self, tree):
+        self.constants = {}
+        self.classes = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                self.constants[node.targets[0].id] = node.value
+            elif isinstance(node, ast.ClassDef):
+                self.classes[node.name] = node
+
+    def string(self, node):
+        if isinstance(constant(node), str):
+            return constant(node)
+        if isinstance(node, ast.Name) and node.id in self.constants:
+            return self.string(self.constants[node.id])
+        environ_name = self.environ_name(node)
+        if environ_name is not None:
+            return '{0}{1}{0}'.format(ENV_MARK, environ_name)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self.string(node.left) + self.string(node.right)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod):
+            values = node.right.elts if isinstance(node.right, ast.Tuple) else [node.right]
+            return self.string(node.left) % tuple(self.string(value) for value in values)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'format':
+            return self.string(node.func.value).format(
+                *[self.string(arg) for arg in node.args],
+                **dict((keyword.arg, self.string(keyword.value)) for keyword in node.keywords))
+        if isinstance(node, ast.JoinedStr):
+            return ''.join(self.string(value.value if isinstance(value, ast.FormattedValue) else value)
+                           for value in node.values)
+        raise UnsupportedModel('line {}: table name is not a static string'.format(getattr(node, 'lineno', '?')))
+
+    def environ_name(self, node):
+        """
+        The variable name of os.environ['X'], os.environ.get('X') or os.getenv('X').
+        """
+        if isinstance(node, ast.Subscript) and dotted_name(node.value) in ('os.environ', 'environ'):
+            # Python < 3.9 wraps subscripts in ast.Index.
+            key = node.slice.value if isinstance(node.slice, getattr(ast, 'Index', ())) else node.slice
+            return self.string(key)
+        if isinstance(node, ast.Call) and dotted_name(node.func) in ('os.environ.get', 'environ.get', 'os.getenv', 'getenv'):
+            return self.string(node.args[0])
+        return None
+
+
+def to_template(value):
+    """
+    Turn an evaluated table name into a str.format template, e.g.
+    '{NAME}-{STAGE}-accounts'.
+    """
+    parts = value.split(ENV_MARK)
+    escaped = [part.replace('{', '{{').replace('}', '}}') for part in parts]
+    return ''.join('{' + part + '}' if index % 2 else part for index, part in enumerate(escaped))
+
+
+def parse_field(node):
+    """
+    Read `Field(...)` and chained index calls, e.g.
+    `Field(type=int).include_index('ts-index', ['name'])`.
+
+    :return: Dict describing the field, or None if node isn't a Field.
+    """
+    index = None
+    while isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in INDEX_PROJECTIONS:
+        args = [literal(arg) for arg in node.args]
+        kwargs = dict((keyword.arg, literal(keyword.value)) for keyword in node.keywords)
+        index = {'name': args[0] if args else kwargs['name'], 'projection': INDEX_PROJECTIONS[node.func.attr],
+                 'includes': list(args[1] if len(args) > 1 else kwargs.get('includes') or [])}
+        node = node.func.value
+    if not isinstance(node, ast.Call) or dotted_name(node.func) not in ('Field', 'flywheel.Field'):
+        return None
+    kwargs = dict((keyword.arg, keyword.value) for keyword in node.keywords)
+    if node.args:
+        raise UnsupportedModel('line {}: positional Field arguments'.format(node.lineno))
+    field = {'hash_key': False, 'range_key': False, 'type': 'S', 'index': index}
+    for key in ('hash_key', 'range_key'):
+        if key in kwargs:
+            field[key] = bool(literal(kwargs[key]))
+    type_node = kwargs.get('data_type', kwargs.get('type'))
+    if type_node is not None:
+        type_name = dotted_name(type_node)
+        if type_name is None:
+            type_name = constant(type_node)
+        field['type'] = KEY_TYPES.get(type_name)
+    if 'index' in kwargs:
+        field['index'] = {'name': literal(kwargs['index']), 'projection': 'all', 'includes': []}
+    return field
+
+
+def parse_global_index(node):
+    """
+    Read `GlobalIndex.all('name', 'hash', 'range').throughput(read, write)`.
+    """
+    throughput = DEFAULT_THROUGHPUT
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'throughput':
+        values = dict(zip(['read', 'write'], [literal(arg) for arg in node.args]))
+        values.update((keyword.arg, literal(keyword.value)) for keyword in node.keywords)
+        throughput = [values.get('read', 5), values.get('write', 5)]
+        node = node.func.value
+    function = dotted_name(node.func) if isinstance(node, ast.Call) else None
+    if function in ('GlobalIndex', 'flywheel.GlobalIndex'):
+        projection = 'all'
+    elif function and function.rsplit('.', 1)[0] in ('GlobalIndex', 'flywheel.GlobalIndex'):
+        projection = function.rsplit('.', 1)[1]
+    else:
+        raise UnsupportedModel('line {}: global index is not a GlobalIndex call'.format(getattr(node, 'lineno', '?')))
+    names = ['name', 'hash_key', 'range_key', 'includes']
+    values = dict(zip(names, [literal(arg) for arg in node.args]))
+    values.update((keyword.arg, literal(keyword.value)) for keyword in node.keywords)
+    return {'name': values['name'], 'hash_key': values['hash_key'], 'range_key': values.get('range_key'),
+            'projection': projection, 'includes': list(values.get('includes') or []), 'throughput': throughput}
+
+
+def parse_model(reader, class_node, path):
+    """
+    :return: Dict describing the model, or None when the class isn't a
+             Flywheel model or is abstract.
+    """
+    fields = {}
+    metadata = {}
+    is_model = False
+    for base in class_node.bases:
+        base_name = dotted_name(base)
+        if base_name in ('Model', 'flywheel.Model', 'flywheel.models.Model'):
+            is_model = True
+        elif base_name in reader.classes and base_name != class_node.name:
+            parent = parse_model(reader, reader.classes[base_name], path)
+            if parent is not None:
+                is_model = True
+                fields.update(parent['fields'])
+        elif base_name not in ('object',):
+            raise UnsupportedModel('{}: base class {} is defined elsewhere'.format(class_node.name, base_name))
+    if not is_model:
+        return None
+    abstract = False
+    for node in class_node.body:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)):
+            continue
+        name = node.targets[0].id
+        if name == '__metadata__':
+            if not isinstance(node.value, ast.Dict):
+                raise UnsupportedModel('{}: __metadata__ is not a dict literal'.format(class_node.name))
+            metadata = dict((literal(key), value) for key, value in zip(node.value.keys, node.value.values))
+        elif name == '__abstract__':
+            abstract = bool(literal(node.value))
+        else:
+            field = parse_field(node.value)
+            if field is not None:
+                fields[name] = field
+    if abstract or ('_abstract' in metadata and literal(metadata['_abstract'])):
+        return {'abstract': True, 'fields': fields}
+
+    try:
+        table_name = to_template(reader.string(metadata['_name'])) if '_name' in metadata else class_node.name
+    except (TypeError, ValueError, KeyError, IndexError) as e:
+        raise UnsupportedModel('{}: table name is not a static string ({})'.format(class_node.name, e))
+    throughput = DEFAULT_THROUGHPUT
+    if 'throughput' in metadata:
+        values = literal(metadata['throughput'])
+        throughput = [values.get('read', 5), values.get('write', 5)]
+    global_indexes = []
+    if 'global_indexes' in metadata:
+        if not isinstance(metadata['global_indexes'], (ast.List, ast.Tuple)):
+            raise UnsupportedModel('{}: global_indexes is not a list'.format(class_node.name))
+        global_indexes = [parse_global_index(node) for node in metadata['global_indexes'].elts]
+
+    hash_keys = [name for name, field in fields.items() if field['hash_key']]
+    range_keys = [name for name, field in fields.items() if field['range_key']]
+    if len(hash_keys) != 1 or len(range_keys) > 1:
+        raise UnsupportedModel('{}: expected one hash key and at most one range key'.format(class_node.name))
+    key_fields = set(hash_keys + range_keys)
+    key_fields.update(name for name, field in fields.items() if field['index'])
+    for index in global_indexes:
+        key_fields.update(key for key in (index['hash_key'], index['range_key']) if key)
+    for name in key_fields:
+        if name not in fields or fields[name]['type'] is None:
+            raise UnsupportedModel('{}: key field {} has no static key type'.format(class_node.name, name))
+    return {
+        'abstract': False,
+        'class_name': class_node.name,
+        'table_name': table_name,
+        'throughput': throughput,
+        'hash_key': hash_keys[0],
+        'range_key': range_keys[0] if range_keys else None,
+        'fields': fields,
+        'global_indexes': global_indexes,
+        'path': path,
+    }
+
+
+def parse_model_file(source, path, class_name):
+    """
+    :param source: Contents of the model file.
+    :param path: Used in error messages.
+    :param class_name: The model class, named after the file.
+    :return: Model dict or None when the file defines no concrete model.
+    """
+    try:
+        tree = ast.parse(source, path)
+    except SyntaxError as e:
+        raise UnsupportedModel('{}: {}'.format(path, e))
+    reader = ModuleReader(tree)
+    if class_name not in reader.classes:
+        return None
+    model = parse_model(reader, reader.classes[class_name], path)
+    if model is None or model['abstract']:
+        return None
+    return model
+
+
+def discover_models(models_dir):
+    """
+    Read every model in models_dir. Results are cached per machine by the
+    hash of each file, so unchanged models aren't parsed again.
+
+    :param models_dir: e.g. <project>/app/models
+    :return: Tuple of (sorted list of model dicts, list of (module name,
+             reason) for models that have to be imported instead).
+    """
+    cache_dir = get_cache_dir('models')
+    models = []
+    unsupported = []
+    for path in sorted(glob.glob(os.path.join(models_dir, '*.py'))):
+        module_name = os.path.basename(path)[:-3]
+        if module_name.startswith('_'):
+            continue
+        with open(path, 'rb') as model_file:
+            source = model_file.read()
+        digest = hashlib.sha256(source + str(DISCOVERY_VERSION).encode('ascii') + module_name.encode('utf-8')).hexdigest()
+        cache_path = os.path.join(cache_dir, '{}.json'.format(digest))
+        try:
+            with open(cache_path) as cached:
+                entry = json.load(cached)
+        except (OSError, ValueError):
+            try:
+                entry = {'model': parse_model_file(source, path, module_name)}
+            except UnsupportedModel as e:
+                entry = {'unsupported': str(e)}
+            temporary = '{}.{}.tmp'.format(cache_path, os.getpid())
+            with open(temporary, 'w') as cached:
+                json.dump(entry, cached)
+            os.replace(temporary, cache_path)
+        if entry.get('unsupported'):
+            unsupported.append((module_name, entry['unsupported']))
+        elif entry.get('model'):
+            model = entry['model']
+            model['path'] = path
+            model['module'] = module_name
+            model['digest'] = digest
+            models.append(model)
+    return models, unsupported
+
+
+def table_name(model, env=None):
+    """
+    :param model: Model dict.
+    :param env: Mapping used for environment variables in the table name. Defaults to os.environ.
+    :return:
+    """
+    try:
+        return model['table_name'].format(**(os.environ if env is None else env))
+    except KeyError as e:
+        raise ValueError('{} needs the {} environment variable, have you run `tight generate env`?'.format(
+            model['class_name'], e.args[0]))
+
+
+def render_key(model, env=None, extra=None):
+    """
+    Key of a model's generated schema: the model file's hash plus NAME, STAGE
+    and any other environment variable its table name uses.
+
+    :param model: Model dict from discover_models.
+    :param env: See table_name.
+    :param extra: Anything else the schema depends on, JSON serializable.
+    :return:
+    """
+    env = os.environ if env is None else env
+    variables = {'NAME', 'STAGE'}
+    variables.update(field for _, field, _, _ in string.Formatter().parse(model['table_name']) if field)
+    key = [model['digest'], extra] + [[name, env.get(name)] for name in sorted(variables)]
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def create_table_kwargs(model, env=None):
+    """
+    Arguments of the DynamoDB CreateTable call for a model, the same that
+    flywheel's create_schema sends. Attribute definitions are sorted so the
+    output is stable.
+
+    :param model: Model dict.
+    :param env: See table_name.
+    :return:
+    """
+    from dynamo3 import DynamoKey, GlobalIndex, LocalIndex, Throughput
+    fields = model['fields']
+
+    def key(name):
+        return DynamoKey(name, data_type=fields[name]['type'])
+
+    hash_key = key(model['hash_key'])
+    attributes = {model['hash_key']: hash_key}
+    key_schema = [hash_key.hash_schema()]
+    if model['range_key']:
+        range_key = attributes[model['range_key']] = key(model['range_key'])
+        key_schema.append(range_key.range_schema())
+    kwargs = {
+        'TableName': table_name(model, env),
+        'KeySchema': key_schema,
+        'ProvisionedThroughput': Throughput(*model['throughput']).schema(),
+    }
+    local_indexes = []
+    for name in sorted(fields):
+        index = fields[name]['index']
+        if not index:
+            continue
+        attributes[name] = key(name)
+        factory = getattr(LocalIndex, index['projection'])
+        extra = {'includes': index['includes']} if index['projection'] == 'include' else {}
+        local_indexes.append(factory(index['name'], attributes[name], **extra).schema(hash_key))
+    if local_indexes:
+        kwargs['LocalSecondaryIndexes'] = local_indexes
+    global_indexes = []
+    for index in model['global_indexes']:
+        index_hash_key = attributes.setdefault(index['hash_key'], key(index['hash_key']))
+        index_range_key = attributes.setdefault(index['range_key'], key(index['range_key'])) if index['range_key'] else None
+        factory = getattr(GlobalIndex, index['projection'])
+        extra = {'includes': index['includes']} if index['projection'] == 'include' else {}
+        global_indexes.append(factory(index['name'], index_hash_key, index_range_key,
+                                      throughput=Throughput(*index['throughput']), **extra).schema())
+    if global_indexes:
+        kwargs['GlobalSecondaryIndexes'] = global_indexes
+    kwargs['AttributeDefinitions'] = [attributes[name].definition() for name in sorted(attributes)]
+    return kwargs
+
+
+def import_models(models_dir, module_names):
+    """
+    Import model classes that can't be read statically. Requires the
+    environment the models read at import time (see load_env).
+
+    :param models_dir:
+    :param module_names: Model modules, each defining a class of the same name.
+    :return: List of model classes.
+    """
+    import importlib
+    import sys
+    if models_dir not in sys.path:
+        sys.path.insert(0, models_dir)
+    return [getattr(importlib.import_module(name), name) for name in module_names]
@@ -0,0 +1,312 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+from tight_cli import runtime
+from tight_cli.artifacts import FUNCTIONS_DIR
+
+# `tight serve` emulates API Gateway's Lambda proxy integration in front of an
+# app loaded once with tight_cli.runtime. /<function>/<path> is routed to
+# app/functions/<function>/handler.py with <path> as the {proxy+} parameter.
+# Requests run on a pool of threads sharing the warm modules, and a watcher
+# reloads a function's modules when its files change.
+
+DEFAULT_PORT = 3000
+POLL_INTERVAL = 0.5
+WATCHED_SUFFIX = '.py'
+
+
+def route(path):
+    """
+    :param path: Request path, e.g. /accounts/42?expand=1
+    :return: Tuple of (function name or None, proxy path).
+    """
+    segments = [segment for segment in urlsplit(path).path.split('/') if segment]
+    if not segments:
+        return None, ''
+    return segments[0], '/'.join(segments[1:])
+
+
+def build_event(method, path, headers, body, stage, source_ip='127.0.0.1'):
+    """
+    Lambda proxy integration event for a request.
+
+    :param method:
+    :param path: Raw request path including the query string.
+    :param headers: List of (name, value).
+    :param body: Request body bytes.
+    :param stage: Used for requestContext.stage.
+    :param source_ip:
+    :return:
+    """
+    parsed = urlsplit(path)
+    function, proxy = route(path)
+    resource = '/{}/{{proxy+}}'.format(function) if proxy else '/{}'.format(function)
+    multi_headers = {}
+    for name, value in headers:
+        multi_headers.setdefault(name, []).append(value)
+    multi_query = {}
+    for name, value in parse_qsl(parsed.query, keep_blank_values=True):
+        multi_query.setdefault(name, []).append(value)
+    encoded = False
+    if body:
+        try:
+            body = body.decode('utf-8')
+        except UnicodeDecodeError:
+            body = base64.b64encode(body).decode('ascii')
+            encoded = True
+    else:
+        body = None
+    return {
+        'resource': resource,
+        'path': parsed.path,
+        'httpMethod': method,
+        'headers': {name: values[-1] for name, values in multi_headers.items()} or None,
+        'multiValueHeaders': multi_headers or None,
+        'queryStringParameters': {name: values[-1] for name, values in multi_query.items()} or None,
+        'multiValueQueryStringParameters': multi_query or None,
+        'pathParameters': {'proxy': proxy} if proxy else None,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': resource,
+            'httpMethod': method,
+            'path': '/{}{}'.format(stage, parsed.path),
+            'stage': stage,
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(time.time() * 1000),
+            'identity': {'sourceIp': source_ip, 'userAgent': multi_headers.get('User-Agent', [None])[-1]},
+        },
+        'body': body,
+        'isBase64Encoded': encoded,
+    }
+
+
+def parse_response(response):
+    """
+    Turn a Lambda proxy response into HTTP. Like API Gateway, anything but a
+    dict with a string body is a 502.
+
+    :param response: What the handler returned.
+    :return: Tuple of (status, list of (header, value), body bytes).
+    """
+    if not isinstance(response, dict) or not isinstance(response.get('body', ''), (str, type(None))):
+        return error_response(502, 'Malformed Lambda proxy response')
+    headers = [(name, str(value)) for name, value in (response.get('headers') or {}).items()]
+    for name, values in (response.get('multiValueHeaders') or {}).items():
+        headers.extend((name, str(value)) for value in values)
+    body = response.get('body') or ''
+    body = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode('utf-8')
+    return int(response.get('statusCode', 200)), headers, body
+
+
+def error_response(status, message):
+    return status, [('Content-Type', 'application/json')], json.dumps({'message': message}).encode('utf-8')
+
+
+class ReadWriteLock(object):
+    """
+    Requests hold the read side while they run; reloading a function waits
+    for them and holds the write side.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+
+    @contextmanager
+    def reading(self):
+        with self.condition:
+            while self.writing:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def writing_lock(self):
+        with self.condition:
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class Watcher(object):
+    """
+    Polls the modification times of the app's python files.
+    """
+
+    def __init__(self, target, vendor_dir):
+        self.root = os.path.join(target, 'app')
+        self.functions_dir = os.path.join(target, FUNCTIONS_DIR)
+        self.vendor_dir = os.path.join(target, vendor_dir)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.root):
+            dirs[:] = [name for name in dirs if name != '__pycache__' and os.path.join(root, name) != self.vendor_dir]
+            for name in names:
+                if name.endswith(WATCHED_SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def changes(self):
+        """
+        :return: Tuple of (names of functions whose files changed, other changed paths).
+        """
+        snapshot = self.scan()
+        changed = {path for path in set(snapshot) | set(self.snapshot) if snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = snapshot
+        functions = set()
+        others = []
+        for path in sorted(changed):
+            relative = os.path.relpath(path, self.functions_dir)
+            if relative.startswith(os.pardir) or os.sep not in relative:
+                others.append(path)
+            else:
+                functions.add(relative.split(os.sep)[0])
+        return functions, others
+
+
+class GatewayHandler(http.server.BaseHTTPRequestHandler):
+    def handle_request(self):
+        start = time.time()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        function, proxy = route(self.path)
+        if function not in self.server.functions:
+            status, headers, payload = error_response(404, 'No function named {}'.format(function))
+        else:
+            event = build_event(self.command, self.path, list(self.headers.items()), body, self.server.stage,
+                                self.client_address[0])
+            try:
+                with self.server.lock.reading():
+                    response = runtime.invoke(self.server.app, function, event)
+                status, headers, payload = parse_response(response)
+            except Exception:
+                traceback.print_exc()
+                status, headers, payload = error_response(502, 'Internal server error')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+        self.server.log('{} {} {} {:.1f}ms'.format(self.command, self.path, status, (time.time() - start) * 1000))
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalGateway(http.server.HTTPServer):
+    """
+    HTTP server dispatching to the app's functions on a fixed pool of worker
+    threads.
+
+    :param address: (host, port)
+    :param app: Module returned by runtime.load_app.
+    :param functions: Names of the functions to route to.
+    :param workers: Requests handled at once.
+    :param stage: Reported in requestContext.
+    :param log: Called with a line per request and reload.
+    """
+
+    def __init__(self, address, app, functions, workers, stage='dev', log=None):
+        self.app = app
+        self.functions = set(functions)
+        self.stage = stage
+        self.log = log or (lambda message: sys.stderr.write(message + '\n'))
+        self.lock = ReadWriteLock()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        http.server.HTTPServer.__init__(self, address, GatewayHandler)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        http.server.HTTPServer.server_close(self)
+        self.pool.shutdown(wait=True)
+
+    def reload(self, functions, others=()):
+        """
+        Reload changed functions once in-flight requests finish.
+
+        :param functions: Names of the functions whose files changed.
+        :param others: Other changed paths, which need a restart.
+        :return:
+        """
+        for function in sorted(functions):
+            if function not in self.functions:
+                self.log('New function {}, restart `tight serve` to route to it'.format(function))
+                continue
+            with self.lock.writing_lock():
+                try:
+                    modules = runtime.reload_function(function)
+                except Exception:
+                    traceback.print_exc()
+                    self.log('Could not reload {}, the previous version keeps serving'.format(function))
+                    continue
+            self.log('Reloaded {} ({} modules)'.format(function, len(modules)))
+        for path in others:
+            self.log('{} changed, restart `tight serve` to pick up changes to shared code'.format(path))
+
+    def watch(self, watcher, interval=POLL_INTERVAL):
+        def poll():
+            while True:
+                time.sleep(interval)
+                functions, others = watcher.changes()
+                if functions or others:
+                    self.reload(functions, others)
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,81 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from tight_cli.utils import find_project_root, get_cache_dir
+
+PROJECT_TEMPLATES_DIR = 'templates'
+_ENVIRONMENTS = {}
+
+
+class MtimeBytecodeCache(FileSystemBytecodeCache):
+    """
+    On-disk bytecode cache whose keys include the template's mtime, so editing
+    a template (packaged or project-local) invalidates its compiled code.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        if filename:
+            try:
+                filename = '{}:{}'.format(filename, os.path.getmtime(filename))
+            except OSError:
+                pass
+        return super(MtimeBytecodeCache, self).get_cache_key(name, filename)
+
+
+def get_bytecode_cache():
+    try:
+        return MtimeBytecodeCache(get_cache_dir('templates'))
+    except OSError:
+        # An unwritable home directory shouldn't stop generation.
+        return None
+
+
+def get_environment(search_path):
+    """
+    Return the shared Environment for a template search path. Environments are
+    created once per process so that parsed templates are reused.
+
+    :param search_path: Tuple of template directories, highest priority first.
+    :return:
+    """
+    environment = _ENVIRONMENTS.get(search_path)
+    if environment is None:
+        environment = Environment(loader=FileSystemLoader(list(search_path)),
+                                  bytecode_cache=get_bytecode_cache(),
+                                  auto_reload=True)
+        _ENVIRONMENTS[search_path] = environment
+    return environment
+
+
+def get_search_path(template_root, target=None):
+    """
+    Project-local templates in <project>/templates override the packaged ones.
+
+    :param template_root:
+    :param target: Any path inside the project being generated into.
+    :return:
+    """
+    search_path = [template_root]
+    project_root = find_project_root(target) if target else None
+    if project_root:
+        overrides = os.path.join(project_root, PROJECT_TEMPLATES_DIR)
+        if os.path.isdir(overrides):
+            search_path.insert(0, overrides)
+    return tuple(search_path)
+
+
+def get_template(template_root, template, target=None):
+    return get_environment(get_search_path(template_root, target)).get_template(template)
@@ -0,0 +1,64 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+CACHE_DIR_ENV = 'TIGHT_CACHE_DIR'
+PROJECT_CONFIG = 'tight.yml'
+
+
+def get_cache_dir(*parts):
+    """
+    Return (and create) a machine level cache directory shared by all projects.
+
+    Defaults to ~/.tight/cache and can be moved with the TIGHT_CACHE_DIR
+    environment variable.
+
+    :param parts: Sub directories of the cache root.
+    :return:
+    """
+    root = os.environ.get(CACHE_DIR_ENV, os.path.join(os.path.expanduser('~'), '.tight', 'cache'))
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def find_project_root(path):
+    """
+    Walk up from path until a directory containing tight.yml is found.
+
+    :param path:
+    :return: The project root or None when path is not inside a project.
+    """
+    path = os.path.realpath(path)
+    while True:
+        if os.path.isfile(os.path.join(path, PROJECT_CONFIG)):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def format_size(size):
+    """
+    Human readable byte count, e.g. 1.5 MB.
+
+    :param size:
+    :return:
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
+        size /= 1024.0
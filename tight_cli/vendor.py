@@ -0,0 +1,384 @@
+# Copyright (c) 2017 lululemon athletica Canada inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tight_cli.utils import get_cache_dir
+
+# Provided by the Lambda runtime, never shipped in the vendor dir.
+RUNTIME_PROVIDED = ['boto3', 'botocore']
+# Records which cache entry a vendor dir was populated from.
+VENDOR_MARKER = '.tight-vendor.json'
+# Below the cache root, maps the key of requirement lines to the key of their
+# last resolution.
+INDEX_DIR = 'index'
+# name==version, optionally with extras and an environment marker.
+PINNED = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*(\[[^\]]*\])?\s*==\s*[^*;\s]+\s*(;.*)?$')
+KEEP = ['__init__.py']
+
+
+def read_requirements(requirements_path):
+    """
+    Requirement lines without comments, blank lines or surrounding whitespace.
+
+    :param requirements_path:
+    :return:
+    """
+    requirements = []
+    with open(requirements_path) as requirements_file:
+        for line in requirements_file:
+            line = line.split(' #')[0].strip()
+            if line and not line.startswith('#'):
+                requirements.append(line)
+    return requirements
+
+
+def requirements_key(requirements):
+    """
+    Cache key for a vendored tree: the requirements, the Python version and
+    platform they are installed for and the packages removed after install.
+
+    :param requirements: List of resolved requirements from
+                         resolved_requirements, or requirement lines when pip
+                         can't resolve them.
+    :return:
+    """
+    key = {
+        'requirements': sorted(requirements),
+        'python': '{}.{}'.format(*sys.version_info[:2]),
+        'platform': '{}-{}'.format(sys.platform, platform.machine()),
+        'excluded': RUNTIME_PROVIDED
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def remove_runtime_provided(directory):
+    """
+    Remove packages provided by Lambda, along with their dist-info.
+
+    :param directory:
+    :return: Names of the removed packages.
+    """
+    removed = []
+    for package in RUNTIME_PROVIDED:
+        package_path = os.path.join(directory, package)
+        if os.path.exists(package_path):
+            shutil.rmtree(package_path)
+            removed.append(package)
+        for metadata in glob.glob('{}-*'.format(package_path)):
+            shutil.rmtree(metadata) if os.path.isdir(metadata) else os.remove(metadata)
+    return removed
+
+
+def copy_tree(source, destination):
+    """
+    Populate destination with copies of the files in source. Copies rather
+    than links, so editing a vendored file never changes the cached tree
+    shared with other projects.
+    """
+    for item in os.listdir(source):
+        src = os.path.join(source, item)
+        dst = os.path.join(destination, item)
+        if os.path.isdir(src) and not os.path.islink(src):
+            shutil.copytree(src, dst, symlinks=True)
+        else:
+            shutil.copy2(src, dst, follow_symlinks=False)
+
+
+def clear_vendor_dir(vendor_dir):
+    for item in os.listdir(vendor_dir):
+        if item in KEEP:
+            continue
+        path = os.path.join(vendor_dir, item)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def read_marker(vendor_dir):
+    try:
+        with open(os.path.join(vendor_dir, VENDOR_MARKER)) as marker:
+            return json.load(marker).get('key')
+    except (OSError, ValueError):
+        return None
+
+
+def remove_marker(vendor_dir):
+    marker = os.path.join(vendor_dir, VENDOR_MARKER)
+    if os.path.isfile(marker):
+        os.remove(marker)
+
+
+def is_pinned(requirements):
+    """
+    True when every line pins an exact version, so resolving them again
+    gives the same result. VCS and other URLs, ranges and pip options are
+    not pinned.
+    """
+    return all(PINNED.match(line) for line in requirements)
+
+
+def read_index(cache_root, lines_key):
+    """
+    :return: Key of the cache entry last resolved from the requirement lines,
+             or None when there is none or it was removed.
+    """
+    try:
+        with open(os.path.join(cache_root, INDEX_DIR, lines_key)) as index:
+            key = index.read().strip()
+    except OSError:
+        return None
+    return key if key and os.path.isdir(os.path.join(cache_root, key)) else None
+
+
+def write_index(cache_root, lines_key, key):
+    index_dir = os.path.join(cache_root, INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(prefix='.index-', dir=index_dir)
+    with os.fdopen(handle, 'w') as index:
+        index.write(key)
+    os.replace(temporary, os.path.join(index_dir, lines_key))
+
+
+def normalize_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def resolve_requirements(requirements_path, run_command, work_dir):
+    """
+    Resolve the full dependency set once, without installing anything, using
+    `pip install --dry-run --report` (pip >= 22.2).
+
+    :return: List of report items, or None if pip can't produce a report.
+    """
+    report_path = os.path.join(work_dir, 'report.json')
+    command = ['pip', 'install', '--dry-run', '--ignore-installed', '--quiet', '--report', report_path,
+               '-r', requirements_path]
+    if run_command(command) or not os.path.isfile(report_path):
+        return None
+    with open(report_path) as report:
+        return json.load(report).get('install', [])
+
+
+def resolve(requirements_path, run_command):
+    """
+    resolve_requirements in a throwaway directory.
+    """
+    work_dir = tempfile.mkdtemp(prefix='.tight-resolve-')
+    try:
+        return resolve_requirements(requirements_path, run_command, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def resolved_requirements(items):
+    """
+    Exact requirements of a resolution, e.g. ['six==1.16.0'], so a new
+    release of an unpinned requirement changes the cache key.
+
+    :param items: Report items from resolve_requirements.
+    :return:
+    """
+    return sorted(install_spec(item) for item in items)
+
+
+def select_packages(items, excluded=None):
+    """
+    Drop runtime provided packages and every dependency that is only needed
+    by them, before anything is downloaded or unpacked.
+
+    :param items: Report items from resolve_requirements.
+    :param excluded: Package names to leave out. Defaults to RUNTIME_PROVIDED.
+    :return: Tuple of (items to install, names of left out packages).
+    """
+    excluded = set(normalize_name(name) for name in (excluded or RUNTIME_PROVIDED))
+    by_name = dict((normalize_name(item['metadata']['name']), item) for item in items)
+    dependencies = {}
+    for name, item in by_name.items():
+        requirements = item['metadata'].get('requires_dist') or []
+        matches = [re.match(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)', requirement) for requirement in requirements]
+        names = [normalize_name(match.group(1)) for match in matches if match]
+        dependencies[name] = [dependency for dependency in names if dependency in by_name]
+    keep = set()
+    stack = [name for name, item in by_name.items() if item.get('requested') and name not in excluded]
+    while stack:
+        name = stack.pop()
+        if name in keep or name in excluded:
+            continue
+        keep.add(name)
+        stack.extend(dependencies[name])
+    return ([by_name[name] for name in sorted(keep)],
+            sorted(by_name[name]['metadata']['name'] for name in by_name if name not in keep))
+
+
+def install_spec(item):
+    """
+    pip requirement that installs exactly the resolved distribution.
+    """
+    name = item['metadata']['name']
+    if not item.get('is_direct'):
+        return '{}=={}'.format(name, item['metadata']['version'])
+    download_info = item['download_info']
+    url = download_info['url']
+    vcs_info = download_info.get('vcs_info')
+    if vcs_info:
+        url = '{}+{}@{}'.format(vcs_info['vcs'], url, vcs_info['commit_id'])
+    return '{} @ {}'.format(name, url)
+
+
+def merge_tree(source, destination, merged):
+    """
+    Move an installed package into destination. Top level entries left over
+    from a previous install are replaced, entries already written during this
+    install (namespace packages shared by several distributions) are merged.
+
+    :param merged: Set of top level entries written during this install.
+    """
+    for item in os.listdir(source):
+        src = os.path.join(source, item)
+        dst = os.path.join(destination, item)
+        if os.path.isdir(dst) and not os.path.islink(dst) and item in merged:
+            for dirpath, dirnames, filenames in os.walk(src):
+                relative = os.path.relpath(dirpath, src)
+                os.makedirs(os.path.join(dst, relative), exist_ok=True)
+                for filename in filenames:
+                    os.replace(os.path.join(dirpath, filename), os.path.join(dst, relative, filename))
+        else:
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            elif os.path.lexists(dst):
+                os.remove(dst)
+            shutil.move(src, dst)
+        merged.add(item)
+
+
+def install_packages(items, destination, run_command, jobs=None):
+    """
+    Install resolved distributions without dependency resolution, each into
+    its own directory in parallel, then merge them into destination.
+
+    :return: List of (package name, seconds) tuples.
+    """
+    work_dir = tempfile.mkdtemp(prefix='.tight-install-', dir=destination)
+
+    def install(item):
+        start = time.time()
+        package_dir = os.path.join(work_dir, normalize_name(item['metadata']['name']))
+        if run_command(['pip', 'install', '--no-deps', '--quiet', '-t', package_dir, install_spec(item)]):
+            raise RuntimeError('pip install {} failed'.format(install_spec(item)))
+        return item['metadata']['name'], package_dir, time.time() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            results = list(pool.map(install, items))
+        merged = set()
+        for name, package_dir, seconds in results:
+            if os.path.isdir(package_dir):
+                merge_tree(package_dir, destination, merged)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return [(name, seconds) for name, package_dir, seconds in results]
+
+
+def install_into(requirements_path, items, destination, run_command, jobs=None):
+    """
+    Install requirements into destination, leaving out runtime provided
+    packages. Falls back to a single `pip install -r` followed by removing the
+    runtime provided packages when pip can't resolve without installing.
+
+    :param items: From resolve, None when pip couldn't resolve.
+    :return: Tuple of (left out package names, list of (package, seconds)).
+    """
+    os.makedirs(destination, exist_ok=True)
+    if items is None:
+        start = time.time()
+        if run_command(['pip', 'install', '-r', requirements_path, '-t', destination, '--upgrade']):
+            raise RuntimeError('pip install failed')
+        return remove_runtime_provided(destination), [('(all)', time.time() - start)]
+    items, excluded = select_packages(items)
+    timings = install_packages(items, destination, run_command, jobs)
+    remove_runtime_provided(destination)
+    return excluded, timings
+
+
+def install_requirements(requirements_path, vendor_dir, run_command, use_cache=True, refresh=False, jobs=None):
+    """
+    Install requirements into vendor_dir through a machine level cache of
+    vendored trees, shared by every project on the machine. Entries are keyed
+    by the resolved requirements and indexed by the requirement lines. When
+    every line is pinned and the index has an entry for them, pip doesn't run
+    at all. Otherwise pip resolves them first, so unpinned requirements pick
+    up new releases, and only installs on a cache miss. When pip can't
+    resolve (offline, or pip older than 22.2) the last resolution of the
+    lines is used, or the lines themselves are the key.
+
+    :param requirements_path:
+    :param vendor_dir:
+    :param run_command: Runs a command and returns its exit code.
+    :param use_cache: False installs straight into vendor_dir.
+    :param refresh: Reinstall and replace the cache entry.
+    :param jobs: Number of packages installed in parallel.
+    :return: Dict with the cache key, whether it was a hit, the left out
+             packages and per package install times.
+    """
+    if not use_cache:
+        items = resolve(requirements_path, run_command)
+        removed, timings = install_into(requirements_path, items, vendor_dir, run_command, jobs)
+        return {'key': None, 'hit': False, 'removed': removed, 'timings': timings}
+
+    requirements = read_requirements(requirements_path)
+    lines_key = requirements_key(requirements)
+    cache_root = get_cache_dir('vendor')
+    items = None
+    key = read_index(cache_root, lines_key) if is_pinned(requirements) and not refresh else None
+    if key is None:
+        items = resolve(requirements_path, run_command)
+        if items is not None:
+            key = requirements_key(resolved_requirements(items))
+        else:
+            key = (None if refresh else read_index(cache_root, lines_key)) or lines_key
+    entry = os.path.join(cache_root, key)
+    hit = os.path.isdir(entry) and not refresh
+    removed = []
+    timings = []
+    if not hit:
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=cache_root)
+        try:
+            removed, timings = install_into(requirements_path, items, staging, run_command, jobs)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(staging, entry)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+    write_index(cache_root, lines_key, key)
+    if hit and read_marker(vendor_dir) == key:
+        return {'key': key, 'hit': True, 'removed': removed, 'timings': timings}
+
+    os.makedirs(vendor_dir, exist_ok=True)
+    clear_vendor_dir(vendor_dir)
+    copy_tree(entry, vendor_dir)
+    with open(os.path.join(vendor_dir, VENDOR_MARKER), 'w') as marker:
+        json.dump({'key': key}, marker)
+    return {'key': key, 'hit': hit, 'removed': removed, 'timings': timings}